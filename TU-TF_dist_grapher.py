@@ -1,77 +1,140 @@
+import argparse
+import itertools
 import numpy as np
-import sys
-import re
-import json
+import pandas as pd
 import matplotlib.pyplot as plt
+from matplotlib.colors import LogNorm
 
-def parse_lammpstrj(file_path):
-
-    with open(file_path, 'r') as f:
-        lines = f.readlines()
-    
-    timestep_data = {}  
-    timestep = None
-    reading_atoms = False
-    
-    for i, line in enumerate(lines):
-        if "ITEM: TIMESTEP" in line:
-            timestep = int(lines[i + 1].strip())
-            timestep_data[timestep] = []
-            reading_atoms = False
-        
-        if "ITEM: ATOMS" in line:
-            reading_atoms = True
-            continue
-        
-        if reading_atoms:
-            parts = line.strip().split()
-            if len(parts) < 5:
-                continue  # Skip lines that do not contain complete data
-            bead_id, bead_type = int(parts[0]), int(parts[1])
-            x, y, z = map(float, parts[2:5])
-            timestep_data[timestep].append((bead_id, bead_type, x, y, z))
-    
-    return timestep_data
-
-def plot_tu_tf_distances(file_path):
-    # Parse trajectory file
-    timestep_data = parse_lammpstrj(file_path)
-    
+from binding import BINDING_THRESHOLD, binding_blocks
+from online_stats import DistanceHistogram
+from profiling import active, add_profile_args, profile_dir, profile_traj, report_base, \
+    write_report
+from traj_reader import add_frame_args, box_lengths, read_frames
+
+QUANTILES = [0.05, 0.25, 0.5, 0.75, 0.95]
+
+def output_name(file_path, prefix, ext):
+    return f"{prefix}_{file_path.split('/')[-1].replace('.lammpstrj', ext)}"
+
+def plot_tu_tf_distances(file_path, start=None, stop=None, stride=None):
+    # Scatter of every (timestep, distance) point, only readable for short runs
     tu_tf_distances_over_time = []
 
-    for timestep, beads in timestep_data.items():
-        tu_positions = [np.array(b[2:]) for b in beads if b[1] == 2]  # TUs (type 2)
-        tf_positions = [np.array(b[2:]) for b in beads if b[1] == 3]  # TFs (type 3)
+    # Stream the trajectory in blocks of frames; distances are in real units
+    # with the minimum-image convention (see binding.py)
+    with active().hot():
+        for timesteps, _, dist, _ in binding_blocks(read_frames(file_path, start, stop, stride)):
+            #Compute min distances, frames without TFs give inf and are skipped
+            steps = np.broadcast_to(timesteps[:, None], dist.shape)
+            keep = np.isfinite(dist)
+            tu_tf_distances_over_time.append(np.column_stack((steps[keep], dist[keep])))
 
-        #Compute min distances 
-        for tu_pos in tu_positions:
-            if tf_positions:  # Avoid errors if no TFs are present
-                min_distance = min(np.linalg.norm(tu_pos - tf_pos) for tf_pos in tf_positions)
-                tu_tf_distances_over_time.append((timestep, min_distance))
+    if not tu_tf_distances_over_time:
+        raise ValueError(f"No complete frames in {file_path}")
+    tu_tf_distances_over_time = np.concatenate(tu_tf_distances_over_time)
 
-    tu_tf_distances_over_time = np.array(tu_tf_distances_over_time)
+    # Drawing and rendering the figure (in savefig) are timed as "plot"
+    output_filename = output_name(file_path, "TU_TF_distances", ".png")
+    with active().stage("plot"):
+        plt.figure(figsize=(10, 5))
+        plt.scatter(tu_tf_distances_over_time[:, 0], tu_tf_distances_over_time[:, 1], alpha=0.5, s=5)
+        plt.axhline(y=BINDING_THRESHOLD, color='r', linestyle='--',
+                    label=f"Binding Threshold ({BINDING_THRESHOLD:g})")
+        plt.xlabel("Timestep")
+        plt.ylabel("Distance to Nearest TF")
+        plt.title(f"TU-TF Minimum Distances Over Time ({file_path})")
+        plt.legend()
+        plt.grid()
+        plt.savefig(output_filename)
+    print(f"Plot saved as {output_filename}")
+    return output_filename
 
-  
-    plt.figure(figsize=(10, 5))
-    plt.scatter(tu_tf_distances_over_time[:, 0], tu_tf_distances_over_time[:, 1], alpha=0.5, s=5)
-    plt.axhline(y=3.5, color='r', linestyle='--', label="Binding Threshold (3.5)")
-    plt.xlabel("Timestep")
-    plt.ylabel("Distance to Nearest TF")
-    plt.title(f"TU-TF Minimum Distances Over Time ({file_path})")
-    plt.legend()
-    plt.grid()
+def aggregate_tu_tf_distances(file_path, start=None, stop=None, stride=None, n_dist_bins=400,
+                              max_time_bins=500, threshold=BINDING_THRESHOLD):
+    # Stream the distances into a DistanceHistogram (see online_stats.py), whose size does not
+    # depend on the number of frames
+    frames = read_frames(file_path, start, stop, stride)
+    first = next(frames, None)
+    if first is None:
+        raise ValueError(f"No complete frames in {file_path}")
+    # No minimum-image distance exceeds half the box diagonal
+    max_distance = np.linalg.norm(box_lengths(first.box) / 2.0)
+    hist = DistanceHistogram(max_distance, n_dist_bins, max_time_bins, threshold)
+    with active().hot():
+        for timesteps, _, dist, _ in binding_blocks(itertools.chain([first], frames)):
+            hist.update(timesteps, dist)
+    return hist
 
+def distance_bin_table(hist):
+    # Per time bin: timestep range, number of distances, quantiles and fraction bound
+    return pd.DataFrame(hist.bin_table(QUANTILES))
 
-    output_filename = f"TU_TF_distances_{file_path.split('/')[-1].replace('.lammpstrj', '.png')}"
-    plt.savefig(output_filename)
+def plot_tu_tf_density(file_path, start=None, stop=None, stride=None, n_dist_bins=400,
+                       max_time_bins=500):
+    hist = aggregate_tu_tf_distances(file_path, start, stop, stride, n_dist_bins, max_time_bins)
+    table = distance_bin_table(hist)
+    csv_filename = output_name(file_path, "TU_TF_distance_bins", ".csv")
+    with active().stage("serialize"):
+        table.to_csv(csv_filename, index=False)
+    print(f"Per-bin statistics saved as {csv_filename}")
+    output_filename = output_name(file_path, "TU_TF_distances", ".png")
+    with active().stage("plot"):
+        draw_tu_tf_density(file_path, hist, table, output_filename)
     print(f"Plot saved as {output_filename}")
+    return [csv_filename, output_filename]
+
+def draw_tu_tf_density(file_path, hist, table, output_filename):
+    # Density of the binned distances with the per-bin quantiles, and the fraction bound
+    edges = hist.time_edges()
+    centres = (edges[:-1] + edges[1:]) / 2.0
+    counts = hist.histogram()
+    fig, (ax, ax_frac) = plt.subplots(2, 1, figsize=(10, 7), sharex=True,
+                                      gridspec_kw={"height_ratios": [3, 1]})
+    mesh = ax.pcolormesh(edges, hist.dist_edges, np.ma.masked_equal(counts.T, 0),
+                         norm=LogNorm(), cmap="viridis", shading="flat")
+    fig.colorbar(mesh, ax=[ax, ax_frac], label="Count")
+    for q in QUANTILES:
+        style = "-" if q == 0.5 else ":"
+        ax.plot(centres, table[f"q{int(q * 100):02d}"], color="w", linestyle=style, lw=1)
+    ax.axhline(y=hist.threshold, color='r', linestyle='--',
+               label=f"Binding Threshold ({hist.threshold:g})")
+    ax.set_ylabel("Distance to Nearest TF")
+    ax.set_title(f"TU-TF Minimum Distances Over Time ({file_path})\n"
+                 f"{hist.frames_per_bin} frames per bin; median (solid), 5/25/75/95% (dotted)")
+    ax.legend(loc="upper right")
+
+    ax_frac.step(centres, table["fraction_below_threshold"], where="mid", color='r')
+    ax_frac.set_ylim(0, 1)
+    ax_frac.set_xlabel("Timestep")
+    ax_frac.set_ylabel(f"Fraction ≤ {hist.threshold:g}")
+    ax_frac.grid()
+
+    fig.savefig(output_filename)
 
-   
 
 if __name__ == "__main__":
-    if len(sys.argv) != 2:
-        print("Usage: python plot_tu_tf_distances.py <trajectory_file>")
-        sys.exit(1)
+    parser = argparse.ArgumentParser(description="Plot TU-TF minimum distances over time")
+    parser.add_argument("traj_file", help="Trajectory file")
+    parser.add_argument("--mode", choices=["density", "scatter"], default="density",
+                        help="Binned density with per-bin quantiles (constant memory), or the "
+                             "scatter of every point")
+    parser.add_argument("--dist-bins", type=int, default=400, help="Distance bins (density mode)")
+    parser.add_argument("--time-bins", type=int, default=500,
+                        help="Maximum number of time bins (density mode)")
+    add_frame_args(parser)
+    add_profile_args(parser)
+    args = parser.parse_args()
 
-    traj_file = sys.argv[1]
-    plot_tu_tf_distances(traj_file)
\ No newline at end of file
+    report = report_base(args)
+    #stage timings, including the plot stage, if requested (see profiling.py)
+    with profile_traj(args.traj_file, report is not None, args.profile) as prof:
+        if args.mode == "density":
+            plot_tu_tf_density(args.traj_file, args.start, args.stop, args.stride, args.dist_bins,
+                               args.time_bins)
+        else:
+            plot_tu_tf_distances(args.traj_file, args.start, args.stop, args.stride)
+    if prof.enabled:
+        report_files = write_report([prof.record()], report)
+        if args.profile:
+            report_files += (prof.dump_cprofile(profile_dir(report)),)
+        print("Profile saved as " + ", ".join(report_files))
\ No newline at end of file
@@ -0,0 +1,332 @@
+#!/usr/bin/env python3
+# batch_phi.py
+# Compute phi statistics for every trajectory in a sweep in parallel.
+#
+# The sweep directory (e.g. one containing runSep10, runSep20, ...) is scanned
+# once for pos_noise_Ns_{Ns}_l_{l}_Np_{Np}_run_{run}.lammpstrj files. The
+# resulting job table is processed across a pool of worker processes and the
+# results are merged into the per-l phi_stats_l{l}_r{n}.csv files written by
+# computePhiStats2.py (with an Ns column, and one phi_stats_Ns{Ns}_l{l}_r{n}.csv
+# per Ns if the sweep has several), and the per-TU phi and run summaries are
+# upserted into the results store (see results_store.py). This replaces both
+# computePhiStats2.main and the parse_all_trajs.sh / run_on_all_trajs.sh
+# loops.
+#
+# With --thresholds (e.g. 2.5:5.0:0.1) every trajectory is read once and phi
+# is derived for all the thresholds from the same nearest-TF distances. The
+# summaries then go to phi_stats_l{l}_r{n}_thresholds.csv, with one row per
+# run and threshold, and to the "thresholds" table of the store; --save-runs
+# writes the per-run threshold-indexed phi tables of parseTraj.py.
+
+import argparse
+import os
+import re
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+import pandas as pd
+
+from binding import parse_thresholds
+from computePhiStats2 import BINDING_THRESHOLD, LENGTH_REPEAT_MAP, SIGMA, \
+    compute_phi, phi_cache_params, threshold_summaries
+from onoff_store import onoff_filename
+from profiling import add_profile_args, profile_dir, profile_traj, report_base, \
+    write_report
+from result_cache import CACHE_DIR, CACHE_MAX_MB, ResultCache, cache_key
+from results_store import RESULTS_DIR, ResultsStore
+from traj_reader import add_frame_args
+
+TRAJ_RE = re.compile(
+    r"^pos_noise_Ns_(\d+)_l_(\d+)_Np_(\d+)_run_(\d+)\.(lammpstrj(\.gz)?|lta)$")
+JOB_COLUMNS = ["Ns", "l", "Np", "run", "path"]
+
+
+def scan_sweep(root):
+    # Walk the sweep directory once and build the job table
+    records = []
+    for dirpath, _, filenames in os.walk(root):
+        for name in filenames:
+            match = TRAJ_RE.match(name)
+            if match:
+                ns, l, n_tf, run = map(int, match.groups()[:4])
+                records.append((ns, l, n_tf, run, os.path.join(dirpath, name)))
+    jobs = pd.DataFrame(records, columns=JOB_COLUMNS)
+    # The same run may be found twice (e.g. a copy in trajs/, or a dump and
+    # its archive, see traj_archive.py); keep one, preferring the archive
+    archive = jobs["path"].str.endswith(".lta")
+    jobs = jobs.loc[archive.sort_values(ascending=False, kind="stable").index]
+    jobs = jobs.drop_duplicates(subset=["Ns", "l", "Np", "run"])
+    return jobs.sort_values(["l", "Np", "run"]).reset_index(drop=True)
+
+
+def process_job(path, binding_threshold=BINDING_THRESHOLD, sigma=SIGMA,
+                save_runs=None, write_json=False, frames=(None, None, None)):
+    # Worker: compute the phi vector of one trajectory and its summary, or
+    # the (K, N_TU) phi array if binding_threshold is an array of thresholds.
+    # If save_runs is a directory, the per-run on/off matrix and phi files
+    # written by parseTraj.py (or its threshold table) are saved under
+    # save_runs/runSep{l} as well
+    if save_runs and np.ndim(binding_threshold) > 0:
+        from parseTraj import accumulate_thresholds, save_threshold_table
+        acc = accumulate_thresholds(path, np.asarray(binding_threshold) * sigma,
+                                    *frames)
+        if acc.n == 0:
+            raise ValueError(f"No complete frames in {path}")
+        _, l_val, n_tf, run = map(
+            int, TRAJ_RE.match(os.path.basename(path)).groups()[:4])
+        save_threshold_table(acc.tu_ids, binding_threshold, acc.phi(), n_tf,
+                             run, os.path.join(save_runs, f"runSep{l_val}",
+                                               "TF_Phi_Values"))
+        return acc.phi()
+    if save_runs:
+        from parseTraj import parse_binding_matrix, save_run_outputs
+        tu_ids, timesteps, matrix = parse_binding_matrix(
+            path, binding_threshold * sigma, *frames)
+        if matrix.size == 0:
+            raise ValueError(f"No complete frames in {path}")
+        _, l_val, n_tf, run = map(
+            int, TRAJ_RE.match(os.path.basename(path)).groups()[:4])
+        run_dir = os.path.join(save_runs, f"runSep{l_val}")
+        save_run_outputs(tu_ids, timesteps, matrix, n_tf, run,
+                         os.path.join(run_dir, "TF_On_Off_Matrices"),
+                         os.path.join(run_dir, "TF_Phi_Values"),
+                         l_value=l_val, write_json=write_json)
+        return matrix.mean(axis=1)
+    return compute_phi(path, None, sigma, binding_threshold, *frames)
+
+
+def profiled_job(path, cprofile_dir, *args):
+    # Worker: process_job with per-stage timings (see profiling.py). Returns
+    # (phi, profile record)
+    with profile_traj(path, cprofile=cprofile_dir is not None) as prof:
+        phi = process_job(path, *args)
+    if cprofile_dir is not None:
+        prof.dump_cprofile(cprofile_dir)
+    return phi, prof.record()
+
+
+def summarize(phi):
+    return {"phi_mean": round(np.mean(phi), 6),
+            "phi_std": round(np.std(phi), 6)}
+
+
+def run_outputs_exist(save_runs, job, thresholds=False):
+    # Whether the --save-runs outputs of a job are already on disk
+    if thresholds:
+        from parseTraj import threshold_filename
+        out_file = os.path.join(save_runs, f"runSep{job.l}", "TF_Phi_Values",
+                                threshold_filename(job.Np, job.run))
+    else:
+        out_file = os.path.join(save_runs, f"runSep{job.l}",
+                                "TF_On_Off_Matrices",
+                                onoff_filename(job.Np, job.run))
+    return os.path.exists(out_file)
+
+
+def stats_filename(l_val, runs, thresholds=False, ns=None):
+    # Use the repeat count from computePhiStats2 where known. With ns, the
+    # file of one Ns of a sweep that has several
+    n_repeats = LENGTH_REPEAT_MAP.get(l_val, int(runs.max()))
+    prefix = "phi_stats" if ns is None else f"phi_stats_Ns{ns}"
+    suffix = "_thresholds" if thresholds else ""
+    return f"{prefix}_l{l_val}_r{n_repeats}{suffix}.csv"
+
+
+def merge_results(results, out_dir):
+    # Merge new per-run rows into the per-l CSVs, replacing any rows for the
+    # same (Ns, TFs, Run) (and Threshold, for a multi-threshold pass) so that
+    # reruns do not duplicate entries. If the results span several Ns, each
+    # Ns gets its own files (phi_stats_Ns{Ns}_l*.csv). Rows of existing files
+    # written without an Ns column are taken to be of the Ns merged into them
+    thresholds = "Threshold" in results.columns
+    key = ["Ns", "TFs", "Run"] + (["Threshold"] if thresholds else [])
+    split_ns = results["Ns"].nunique() > 1
+    written = []
+    for (ns, l_val), df in results.groupby(["Ns", "l"]):
+        out_file = os.path.join(out_dir, stats_filename(
+            l_val, df["Run"], thresholds, ns if split_ns else None))
+        df = df.drop(columns=["l"])
+        if os.path.exists(out_file):
+            old = pd.read_csv(out_file)
+            if "Ns" not in old.columns:
+                old.insert(0, "Ns", ns)
+            df = pd.concat([old, df], ignore_index=True)
+        if thresholds:
+            df["Threshold"] = df["Threshold"].round(6)
+        df = df.drop_duplicates(subset=key, keep="last")
+        df = df.sort_values(key)
+        df.to_csv(out_file, index=False)
+        written.append((out_file, len(df)))
+    return written
+
+
+def run_batch(jobs, workers, binding_threshold=BINDING_THRESHOLD,
+              save_runs=None, write_json=False, cache=None,
+              frames=(None, None, None), profile_records=None,
+              cprofile_dir=None):
+    # Process the job table across a process pool, printing progress.
+    # Trajectories with an entry in the cache (see result_cache.py) are not
+    # parsed again. Returns (results, failures) DataFrames and the phi vectors
+    # as {(Ns, l, Np, run): phi}. If profile_records is a list, the profile
+    # record of every parsed trajectory is appended to it, and with
+    # cprofile_dir their frame loops are profiled with cProfile too. If
+    # binding_threshold is an array of thresholds, the results have a
+    # Threshold column with one row per run and threshold, and the phi
+    # values are (K, N_TU) arrays
+    results, failures, phis = [], [], {}
+    params = phi_cache_params(binding_threshold, SIGMA, None, *frames)
+    multi = np.ndim(binding_threshold) > 0
+
+    def record(job, phi):
+        name = os.path.basename(job.path)
+        if multi:
+            results.extend({"Ns": job.Ns, "l": job.l, "TFs": job.Np,
+                            "Run": job.run, **row, "File": name}
+                           for row in threshold_summaries(binding_threshold,
+                                                          phi))
+        else:
+            results.append({"Ns": job.Ns, "l": job.l, "TFs": job.Np,
+                            "Run": job.run, **summarize(phi), "File": name})
+        phis[(job.Ns, job.l, job.Np, job.run)] = phi
+
+    todo = []
+    for job in jobs.itertuples(index=False):
+        key = cache_key(job.path, params) if cache is not None else None
+        hit = cache.get(key) if key is not None else None
+        if hit is not None and (not save_runs
+                                or run_outputs_exist(save_runs, job, multi)):
+            record(job, hit["phi"])
+        else:
+            todo.append((job, key))
+    if cache is not None:
+        cache.flush()
+        print(f"{len(jobs) - len(todo)} cached, {len(todo)} to process")
+
+    start = time.time()
+    total = len(todo)
+    profiled = profile_records is not None
+    job_args = (binding_threshold, SIGMA, save_runs, write_json, frames)
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = {(pool.submit(profiled_job, job.path, cprofile_dir, *job_args)
+                    if profiled else
+                    pool.submit(process_job, job.path, *job_args)): (job, key)
+                   for job, key in todo}
+        for done, future in enumerate(as_completed(futures), 1):
+            job, key = futures[future]
+            name = os.path.basename(job.path)
+            try:
+                phi = future.result()
+                if profiled:
+                    phi, prof_record = phi
+                    profile_records.append(prof_record)
+            except Exception as e:
+                failures.append({"File": name, "Error": repr(e)})
+                status = "FAILED"
+            else:
+                record(job, phi)
+                if cache is not None:
+                    cache.put(key, job.path, params, phi=phi)
+                status = "ok"
+            elapsed = time.time() - start
+            eta = elapsed / done * (total - done)
+            print(f"[{done}/{total}] {status} {name} "
+                  f"(elapsed {elapsed:.0f}s, eta {eta:.0f}s)", flush=True)
+
+    columns = ["Ns", "l", "TFs", "Run"] + (["Threshold"] if multi else [])
+    results = pd.DataFrame(results, columns=columns + ["phi_mean", "phi_std",
+                                                       "File"])
+    return results, pd.DataFrame(failures, columns=["File", "Error"]), phis
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Compute phi statistics for a whole sweep in parallel")
+    parser.add_argument("sweep_dir", nargs="?", default=".",
+                        help="Directory containing the runSep* directories")
+    parser.add_argument("-j", "--workers", type=int, default=os.cpu_count(),
+                        help="Number of worker processes")
+    parser.add_argument("-o", "--out-dir", default=".",
+                        help="Where to write the phi_stats_*.csv files")
+    parser.add_argument("--l", type=int, nargs="+", dest="l_values",
+                        help="Only process these spacings")
+    parser.add_argument("--threshold", type=float, default=BINDING_THRESHOLD,
+                        help="Binding threshold (in units of sigma)")
+    parser.add_argument("--thresholds", metavar="SPEC",
+                        help="Compute phi for several binding thresholds in "
+                             "one pass, as start:stop:step (e.g. "
+                             "2.5:5.0:0.1) or a comma separated list")
+    parser.add_argument("--save-runs", metavar="DIR",
+                        help="Also write parseTraj.py per-run outputs to DIR")
+    parser.add_argument("--json", action="store_true",
+                        help="With --save-runs, also write on/off JSON files")
+    parser.add_argument("--cache-dir", default=CACHE_DIR,
+                        help="Directory of the per-trajectory result cache")
+    parser.add_argument("--cache-max-mb", type=float, default=CACHE_MAX_MB,
+                        help="Size limit of the result cache")
+    parser.add_argument("--no-cache", action="store_true",
+                        help="Parse every trajectory, ignoring the cache")
+    parser.add_argument("--clear-cache", action="store_true",
+                        help="Empty the result cache before starting")
+    parser.add_argument("--store", default=RESULTS_DIR,
+                        help="Results store to upsert the phi values into")
+    parser.add_argument("--no-store", action="store_true",
+                        help="Only write the phi_stats CSV files")
+    add_frame_args(parser)
+    add_profile_args(parser)
+    args = parser.parse_args()
+
+    jobs = scan_sweep(args.sweep_dir)
+    if args.l_values:
+        jobs = jobs[jobs["l"].isin(args.l_values)]
+    if jobs.empty:
+        print(f"No trajectories found in {args.sweep_dir}")
+        sys.exit(1)
+    print(f"Found {len(jobs)} trajectories "
+          f"(l = {sorted(jobs['l'].unique().tolist())})")
+
+    cache = None
+    if not args.no_cache:
+        cache = ResultCache(args.cache_dir, args.cache_max_mb)
+        if args.clear_cache:
+            cache.invalidate()
+
+    threshold = args.threshold
+    if args.thresholds:
+        threshold = parse_thresholds(args.thresholds)
+        print(f"{len(threshold)} binding thresholds from {threshold[0]:g} "
+              f"to {threshold[-1]:g}")
+
+    report = report_base(args)
+    if report is not None:
+        report = os.path.join(args.out_dir, report)
+    profile_records = [] if report is not None else None
+    results, failures, phis = run_batch(
+        jobs, args.workers, threshold, args.save_runs, args.json, cache,
+        (args.start, args.stop, args.stride), profile_records,
+        profile_dir(report) if args.profile else None)
+
+    os.makedirs(args.out_dir, exist_ok=True)
+    for out_file, n in merge_results(results, args.out_dir):
+        print(f"✓ Saved: {out_file} with {n} entries")
+    if not args.no_store and args.thresholds:
+        n = ResultsStore(args.store).upsert_thresholds(phis, threshold)
+        print(f"✓ Stored {n} run/threshold summaries in {args.store}")
+    elif not args.no_store:
+        n = ResultsStore(args.store).upsert_runs(
+            phis, binding_threshold=args.threshold)
+        print(f"✓ Stored {n} runs in {args.store}")
+    if report is not None:
+        for path in write_report(profile_records, report):
+            print(f"✓ Saved profile report: {path}")
+
+    if not failures.empty:
+        fail_file = os.path.join(args.out_dir, "phi_stats_failures.csv")
+        failures.to_csv(fail_file, index=False)
+        print(f"{len(failures)} trajectories failed, see {fail_file}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,280 @@
+#!/usr/bin/env python3
+# benchmarks.py
+# Time and memory benchmarks of the analysis hot paths on synthetic data.
+#
+# A synthetic trajectory (synthetic_traj.py) and the matching on/off matrix
+# files are written to a work directory (reused between invocations with the
+# same sizes), then each benchmark is run --repeat times for the wall time
+# and once more under tracemalloc for the peak Python/NumPy memory. Results
+# are written as JSON so that they can be kept as a baseline; --compare
+# checks a new run against a baseline and exits with status 1 if any
+# benchmark got slower or bigger by more than --tolerance.
+#
+# Usage: benchmarks.py [-o results.json] [--frames N] [--nprots N]
+#            [--only NAME ...] [--compare baseline.json]
+
+import argparse
+import datetime
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+
+from onoff_store import load_onoff, onoff_filename, save_onoff, to_json
+from synthetic_traj import write_synthetic_traj
+
+RESULTS_FILE = "benchmark_results.json"
+TOLERANCE = 0.25  # Allowed relative slowdown/growth before flagging
+# Changes smaller than this are timer/allocator noise and never flagged
+NOISE_FLOOR = {"time_s": 0.01, "peak_mb": 1.0}
+
+
+class Workload:
+    # Input files shared by the benchmarks
+
+    def __init__(self, work_dir, frames=1000, nsites=30, sep=10, nprots=50,
+                 seed=0):
+        self.params = {"frames": frames, "nsites": nsites, "sep": sep,
+                       "nprots": nprots, "seed": seed}
+        self.frames = frames
+        os.makedirs(work_dir, exist_ok=True)
+        tag = f"Ns_{nsites}_l_{sep}_Np_{nprots}_run_{seed}_F_{frames}"
+        self.traj = os.path.join(work_dir, f"pos_noise_{tag}.lammpstrj")
+        if not os.path.exists(self.traj):
+            write_synthetic_traj(self.traj + ".tmp", frames, nsites, sep,
+                                 nprots, seed=seed)
+            os.replace(self.traj + ".tmp", self.traj)
+
+        # On/off matrices in both storage formats, from the same trajectory
+        self.onoff_dir = os.path.join(work_dir, f"on_off_{tag}")
+        self.np_value, self.run_value = nprots, seed
+        npz_file = os.path.join(self.onoff_dir,
+                                onoff_filename(nprots, seed))
+        json_dir = self.onoff_dir + "_json"
+        if not os.path.exists(npz_file):
+            from parseTraj import parse_binding_matrix
+            tu_ids, timesteps, matrix = parse_binding_matrix(self.traj)
+            os.makedirs(self.onoff_dir, exist_ok=True)
+            save_onoff(npz_file, matrix, tu_ids, timesteps)
+        if not os.path.exists(json_dir):
+            os.makedirs(json_dir)
+            to_json(load_onoff(npz_file),
+                    os.path.join(json_dir,
+                                 onoff_filename(nprots, seed, ".json")))
+        self.onoff_json_dir = json_dir
+
+        # The trajectory as a binary archive (see traj_archive.py)
+        from traj_archive import archive_path, convert
+        self.archive = archive_path(self.traj)
+        if not os.path.exists(self.archive):
+            convert(self.traj)
+
+
+def bench_read_frames(work):
+    from traj_reader import read_frames
+    n = 0
+    for _ in read_frames(work.traj):
+        n += 1
+    return n
+
+
+def bench_read_archive(work):
+    from traj_reader import read_frames
+    n = 0
+    for _ in read_frames(work.archive):
+        n += 1
+    return n
+
+
+def bench_parse_binding_matrix(work):
+    from parseTraj import parse_binding_matrix
+    _, timesteps, _ = parse_binding_matrix(work.traj)
+    return len(timesteps)
+
+
+def bench_parse_traj(work):
+    from computePhiStats2 import parse_traj
+    parse_traj(work.traj)
+    return work.frames
+
+
+def bench_tu_tf_distances(work):
+    # The distance computation of TU-TF_dist_grapher.py
+    from binding import binding_blocks
+    from traj_reader import read_frames
+    n = 0
+    for _, _, dist, _ in binding_blocks(read_frames(work.traj)):
+        dist[np.isfinite(dist)]
+        n += len(dist)
+    return n
+
+
+def bench_onoff_npz(work):
+    # The on/off matrix load of histogram_heatmap.py
+    from onoff_store import load_onoff_matrix
+    _, matrix = load_onoff_matrix(work.onoff_dir, work.np_value,
+                                  work.run_value)
+    return matrix.shape[1]
+
+
+def bench_onoff_json(work):
+    from onoff_store import load_onoff_matrix
+    _, matrix = load_onoff_matrix(work.onoff_json_dir, work.np_value,
+                                  work.run_value)
+    return matrix.shape[1]
+
+
+def bench_boomerang_fit(work):
+    # Fit of the boomerang model to synthetic (mean, std) points
+    from scipy.optimize import curve_fit
+    from boomerang_fit import boomerang_fit_function
+    rng = np.random.default_rng(0)
+    mu = np.linspace(0.05, 0.95, 10)
+    n_fits = 100
+    for _ in range(n_fits):
+        sigma = boomerang_fit_function(mu, 0.5, 0.6, 0.4)
+        sigma += rng.normal(scale=0.01, size=mu.shape)
+        curve_fit(boomerang_fit_function, mu, sigma, p0=[0.2, 0.5, 0.5])
+    return None
+
+
+def bench_boomerang_bootstrap(work):
+    # Bootstrap of the normalized boomerang fit over 30 runs for each of 10
+    # Np values, in this process
+    import pandas as pd
+    from boomerang_fit import bootstrap_fit, normalized_boomerang
+    rng = np.random.default_rng(0)
+    n_tf = np.repeat(np.arange(10, 110, 10), 30)
+    mu = np.clip(n_tf / 120 + rng.normal(scale=0.03, size=n_tf.shape),
+                 0.01, 0.99)
+    sigma = normalized_boomerang(mu, 0.3, 0.8, 1.2)
+    sigma += rng.normal(scale=0.01, size=mu.shape)
+    runs = pd.DataFrame({"Np": n_tf, "phi_mean": mu, "phi_std": sigma})
+    n_boot = 200
+    bootstrap_fit(runs, "normalized", n_boot, workers=1, seed=0)
+    return n_boot
+
+
+# name -> (function, unit of the returned count)
+BENCHMARKS = {
+    "read_frames": (bench_read_frames, "frames"),
+    "read_archive": (bench_read_archive, "frames"),
+    "parseTraj.parse_binding_matrix": (bench_parse_binding_matrix, "frames"),
+    "computePhiStats2.parse_traj": (bench_parse_traj, "frames"),
+    "tu_tf_distances": (bench_tu_tf_distances, "frames"),
+    "onoff_load_npz": (bench_onoff_npz, "frames"),
+    "onoff_load_json": (bench_onoff_json, "frames"),
+    "boomerang_fit": (bench_boomerang_fit, None),
+    "boomerang_bootstrap": (bench_boomerang_bootstrap, "fits"),
+}
+
+
+def measure(func, work, repeat=3):
+    # Best-of-repeat wall time, then the peak traced memory of one more run
+    times = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        count = func(work)
+        times.append(time.perf_counter() - t0)
+    tracemalloc.start()
+    try:
+        func(work)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return {"time_s": min(times), "times_s": times, "count": count,
+            "peak_mb": peak / 2**20}
+
+
+def run_benchmarks(work, names=None, repeat=3):
+    results = {}
+    for name, (func, unit) in BENCHMARKS.items():
+        if names and name not in names:
+            continue
+        try:
+            result = measure(func, work, repeat)
+        except ImportError as e:
+            # e.g. the plotting modules need matplotlib/seaborn
+            results[name] = {"skipped": str(e)}
+            print(f"{name:32s} skipped ({e})", flush=True)
+            continue
+        if unit and result["count"]:
+            result[f"{unit}_per_s"] = result["count"] / result["time_s"]
+        results[name] = result
+        rate = (f"  {result[f'{unit}_per_s']:10.1f} {unit}/s"
+                if f"{unit}_per_s" in result else "")
+        print(f"{name:32s} {result['time_s']:8.3f} s  "
+              f"{result['peak_mb']:8.1f} MB{rate}", flush=True)
+    return results
+
+
+def compare(results, baseline, tolerance=TOLERANCE):
+    # (name, metric) of benchmarks whose time or peak memory grew by more
+    # than tolerance relative to the baseline
+    regressions = []
+    for name, result in results.items():
+        old = baseline.get("results", {}).get(name)
+        if not old or "skipped" in result or "skipped" in old:
+            continue
+        for metric in ("time_s", "peak_mb"):
+            ratio = result[metric] / max(old[metric], 1e-12)
+            flag = (ratio > 1.0 + tolerance and
+                    result[metric] - old[metric] > NOISE_FLOOR[metric])
+            print(f"{name:32s} {metric:8s} {old[metric]:10.3f} -> "
+                  f"{result[metric]:10.3f}  x{ratio:.2f}"
+                  + ("  REGRESSION" if flag else ""))
+            if flag:
+                regressions.append((name, metric))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmark the trajectory analysis hot paths")
+    parser.add_argument("-o", "--out", default=RESULTS_FILE,
+                        help="Output JSON file")
+    parser.add_argument("--work-dir", default=None,
+                        help="Directory for the synthetic inputs (default: "
+                             "a directory under the system temp dir)")
+    parser.add_argument("--frames", type=int, default=1000)
+    parser.add_argument("--nsites", type=int, default=30)
+    parser.add_argument("--sep", type=int, default=10)
+    parser.add_argument("--nprots", type=int, default=50)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--only", nargs="+", choices=list(BENCHMARKS),
+                        help="Run only these benchmarks")
+    parser.add_argument("--compare", default=None,
+                        help="Baseline JSON to compare against")
+    parser.add_argument("--tolerance", type=float, default=TOLERANCE,
+                        help="Allowed relative slowdown or memory growth")
+    args = parser.parse_args()
+
+    work_dir = args.work_dir or os.path.join(tempfile.gettempdir(),
+                                             "chromatin_benchmarks")
+    work = Workload(work_dir, args.frames, args.nsites, args.sep, args.nprots)
+    results = run_benchmarks(work, args.only, args.repeat)
+
+    report = {"date": datetime.datetime.now().isoformat(timespec="seconds"),
+              "host": platform.node(), "python": platform.python_version(),
+              "numpy": np.__version__, "workload": work.params,
+              "repeat": args.repeat, "results": results}
+    with open(args.out, 'w') as f:
+        json.dump(report, f, indent=4)
+    print(f"Saved {args.out}")
+
+    if args.compare:
+        with open(args.compare, 'r') as f:
+            baseline = json.load(f)
+        if baseline.get("workload") != work.params:
+            print("Warning: the baseline was run with a different workload")
+        if compare(results, baseline, args.tolerance):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+# binding.py
+# Batched TU-TF distance and binding kernel shared by parseTraj.py,
+# computePhiStats2.py and TU-TF_dist_grapher.py.
+#
+# For every TU (type 2) we need the distance to the nearest ON protein
+# (type 3) in each frame. The simulation box is periodic (boundary p p p in
+# lammps_init.sh), so all distances use the minimum-image convention. Small
+# systems are handled with dense broadcasting over a block of frames; large
+# ones fall back to a periodic cKDTree per frame.
+
+import numpy as np
+from scipy.spatial import cKDTree
+
+from profiling import active
+
+BINDING_THRESHOLD = 3.5
+TU_TYPE = 2
+TF_TYPE = 3
+PROTEIN_TYPES = (3, 4)
+
+# Use the dense path while (TUs x proteins) stays below this many pairs
+DENSE_MAX_PAIRS = 50000
+# Number of frames stacked into each block
+BLOCK_SIZE = 64
+
+
+def _nearest_dense(tu_scaled, prot_scaled, on_mask, lengths):
+    # tu_scaled (F,Ntu,3), prot_scaled (F,Np,3), on_mask (F,Np),
+    # lengths (F,3) -> (F,Ntu) nearest ON-protein distances
+    if prot_scaled.shape[1] == 0:
+        return np.full(tu_scaled.shape[:2], np.inf)
+    delta = prot_scaled[:, None, :, :] - tu_scaled[:, :, None, :]
+    delta -= np.rint(delta)  # Minimum image in scaled units
+    delta *= lengths[:, None, None, :]
+    dist2 = np.einsum("ftpk,ftpk->ftp", delta, delta)
+    dist2[~np.broadcast_to(on_mask[:, None, :], dist2.shape)] = np.inf
+    return np.sqrt(dist2.min(axis=2))
+
+
+def wrap_into_box(scaled, box):
+    # Real coordinates in [0, L) of scaled coordinates, as a periodic
+    # cKDTree(boxsize=L) requires
+    return np.minimum(np.mod(scaled, 1.0) * box, np.nextafter(box, 0.0))
+
+
+def _nearest_tree(tu_scaled, prot_scaled, on_mask, lengths):
+    # Same as _nearest_dense but with one periodic k-d tree per frame
+    nframes, ntu = tu_scaled.shape[:2]
+    out = np.full((nframes, ntu), np.inf)
+    for k in range(nframes):
+        tf = prot_scaled[k][on_mask[k]]
+        if len(tf) == 0:
+            continue
+        box = lengths[k]
+        tree = cKDTree(wrap_into_box(tf, box), boxsize=box)
+        out[k] = tree.query(wrap_into_box(tu_scaled[k], box), k=1)[0]
+    return out
+
+
+def nearest_tf_distances(tu_scaled, prot_scaled, on_mask, lengths,
+                         method="auto"):
+    # Minimum-image distance from every TU to its nearest ON protein for a
+    # block of frames. Frames without any ON protein give inf.
+    #   tu_scaled   : (F,Ntu,3) scaled TU coordinates
+    #   prot_scaled : (F,Np,3) scaled protein coordinates
+    #   on_mask     : (F,Np) True where the protein is ON (type 3)
+    #   lengths     : (F,3) box edge lengths
+    #   method      : "dense", "tree" or "auto"
+    if method == "auto":
+        npairs = tu_scaled.shape[1] * prot_scaled.shape[1]
+        method = "dense" if npairs <= DENSE_MAX_PAIRS else "tree"
+    if method not in ("dense", "tree"):
+        raise ValueError(f"Unknown method '{method}'")
+    nearest = _nearest_dense if method == "dense" else _nearest_tree
+    with active().stage("distance"):
+        return nearest(tu_scaled, prot_scaled, on_mask, lengths)
+
+
+def parse_thresholds(spec):
+    # Binding thresholds from "start:stop:step" (stop included) or a comma
+    # separated list, rounded to avoid float steps such as 2.9000000000000004
+    if ":" in spec:
+        start, stop, step = (float(x) for x in spec.split(":"))
+        if step <= 0 or stop < start:
+            raise ValueError(f"Bad threshold range '{spec}'")
+        values = start + step * np.arange(int(np.floor((stop - start) / step
+                                                       + 1e-9)) + 1)
+    else:
+        values = np.array([float(x) for x in spec.split(",")])
+    return np.unique(np.round(values, 6))
+
+
+def threshold_counts(dist, thresholds):
+    # (K, Ntu) number of frames in which each TU is within each of K sorted
+    # thresholds, for an (F, Ntu) block of distances. Each distance is placed
+    # once among the thresholds (searchsorted) and the counts are summed up
+    # the threshold axis, rather than comparing the block K times
+    ntu = dist.shape[1]
+    k = len(thresholds)
+    first = np.searchsorted(thresholds, dist, side="left")  # dist <= t[first]
+    cols = np.broadcast_to(np.arange(ntu), dist.shape)
+    counts = np.bincount((first * ntu + cols).ravel(),
+                         minlength=(k + 1) * ntu).reshape(k + 1, ntu)
+    return np.cumsum(counts[:k], axis=0)
+
+
+def frame_blocks(frames, block_size=BLOCK_SIZE):
+    # Group a stream of frames into stacked arrays of at most block_size
+    # frames. Yields (timesteps, tu_ids, tu_scaled, prot_scaled, on_mask,
+    # lengths). Chromatin and protein bead sets are fixed by id, only the
+    # ON/OFF protein type changes between frames.
+    tu_idx = prot_idx = None
+    block = []
+
+    def stack(block):
+        timesteps = np.array([f.timestep for f in block])
+        tu = np.stack([f.scaled[tu_idx] for f in block])
+        prot = np.stack([f.scaled[prot_idx] for f in block])
+        on = np.stack([f.types[prot_idx] == TF_TYPE for f in block])
+        lengths = np.stack([f.box[:, 1] - f.box[:, 0] for f in block])
+        return timesteps, tu_ids, tu, prot, on, lengths
+
+    for frame in frames:
+        if tu_idx is None:
+            tu_idx = np.flatnonzero(frame.types == TU_TYPE)
+            prot_idx = np.flatnonzero(np.isin(frame.types, PROTEIN_TYPES))
+            tu_ids = frame.ids[tu_idx]
+        block.append(frame)
+        if len(block) == block_size:
+            yield stack(block)
+            block = []
+    if block:
+        yield stack(block)
+
+
+def binding_blocks(frames, binding_threshold=BINDING_THRESHOLD,
+                   block_size=BLOCK_SIZE, method="auto"):
+    # Stream (timesteps, tu_ids, distances, bound) for blocks of frames.
+    # distances and bound are (F,Ntu) arrays of nearest-TF distance and
+    # bound (distance <= binding_threshold) flags.
+    for timesteps, tu_ids, tu, prot, on, lengths in frame_blocks(
+            frames, block_size):
+        dist = nearest_tf_distances(tu, prot, on, lengths, method)
+        yield timesteps, tu_ids, dist, dist <= binding_threshold
@@ -0,0 +1,276 @@
+#!/usr/bin/env python3
+# binding_correlations.py
+# Temporal autocorrelation and TU-TU co-activation of the binding states.
+#
+# For each stored on/off matrix (N_TU TUs x F frames) this computes
+#   - the autocorrelation of every TU's binding series up to max_lag frames,
+#     all rows at once with zero-padded FFTs (Wiener-Khinchin), from which
+#     the integrated autocorrelation time tau_int (Sokal's automatic window:
+#     the smallest W with W >= c * tau_int(W)) gives the effective number of
+#     independent samples behind each phi, ESS = F / tau_int, and its
+#     standard error sqrt(var * tau_int / F);
+#   - the N_TU x N_TU Pearson correlation of the binding states, from a Gram
+#     matrix accumulated by matrix products over blocks of rows.
+# Rows are unpacked from the bit-packed (memory-mapped) store a chunk at a
+# time, so a run is read once when its matrix fits in one chunk. TUs that
+# never change state have no defined correlation (NaN).
+#
+# Per run the results are saved next to the phi files as
+# TF_phi_ess_Np_{Np}_run_{run}.csv (TU, phi, tau_int, ess, phi_stderr) and
+# TF_corr_Np_{Np}_run_{run}.npz. Across runs of the same (l, Np) the
+# autocovariances and centred cross products are pooled (each run centred on
+# its own means) into a mean autocorrelation and correlation matrix, also
+# reduced to the mean correlation against TU separation along the chain.
+# online_stats.BindingAccumulator gives the same autocorrelation in
+# stats-only mode, where the matrix is never stored.
+#
+# Usage: binding_correlations.py <sweep_dir> [-j N] [--max-lag K]
+#            [-o binding_correlations.csv] [--force]
+
+import argparse
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+import pandas as pd
+from scipy.fft import irfft, next_fast_len, rfft
+
+from onoff_store import find_onoff_files, load_onoff, run_key
+
+CHUNK_ELEMENTS = 1 << 24  # Matrix entries unpacked at a time
+MAX_LAG = 200
+SOKAL_C = 5.0
+
+
+def correlation_filenames(np_value, run_value):
+    return (f"TF_phi_ess_Np_{np_value}_run_{run_value}.csv",
+            f"TF_corr_Np_{np_value}_run_{run_value}.npz")
+
+
+def autocovariance(states, max_lag):
+    # (R, max_lag+1) sums over t of x[t] * x[t+k] for the mean-removed rows
+    # of an (R, F) array, by FFT with padding against wrap-around
+    x = states - states.mean(axis=1, keepdims=True)
+    n = x.shape[1]
+    size = next_fast_len(n + max_lag + 1, real=True)
+    power = np.abs(rfft(x, size, axis=1)) ** 2
+    return irfft(power, size, axis=1)[:, :max_lag + 1]
+
+
+def normalize_acf(acov):
+    # Autocorrelation from summed lagged products (biased estimator, which
+    # keeps the window sums of tau_int well behaved)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return acov / acov[:, :1]
+
+
+def integrated_time(rho, c=SOKAL_C):
+    # Integrated autocorrelation time of each row of an (R, K+1)
+    # autocorrelation, using the first window W with W >= c * tau(W)
+    # (the largest available window if there is none); NaN for constant rows
+    if rho.shape[1] < 2:
+        # No lags (a single frame)
+        out = np.ones(len(rho))
+    else:
+        tau = 1.0 + 2.0 * np.cumsum(rho[:, 1:], axis=1)
+        window = np.arange(1, rho.shape[1])
+        ok = window >= c * tau
+        first = np.where(ok.any(axis=1), ok.argmax(axis=1), rho.shape[1] - 2)
+        out = tau[np.arange(len(rho)), first]
+    return np.where(np.isfinite(rho[:, 0]), np.maximum(out, 1.0), np.nan)
+
+
+def _row_chunks(onoff):
+    rows = max(1, CHUNK_ELEMENTS // max(onoff.n_frames, 1))
+    for r0 in range(0, len(onoff.tu_ids), rows):
+        yield r0, np.unpackbits(onoff.bits[r0:r0 + rows], axis=1,
+                                count=onoff.n_frames).astype(np.float64)
+
+
+def run_correlations(onoff, max_lag=MAX_LAG):
+    # Autocorrelation, tau_int, ESS and correlation matrix of one run.
+    # Returns a dict of arrays, including the summed centred products
+    # ("acov", "cross") needed to pool runs
+    n_tu, n_frames = len(onoff.tu_ids), onoff.n_frames
+    max_lag = min(max_lag, n_frames - 1)
+    phi = np.zeros(n_tu)
+    acov = np.zeros((n_tu, max_lag + 1))
+    cross = np.zeros((n_tu, n_tu))
+    # Keep the unpacked rows when they fit in one chunk, otherwise unpack the
+    # chunks again for each block row of the Gram matrix
+    chunks = list(_row_chunks(onoff)) if n_tu * n_frames <= CHUNK_ELEMENTS \
+        else None
+    for r0, states in (chunks or _row_chunks(onoff)):
+        r1 = r0 + len(states)
+        phi[r0:r1] = states.mean(axis=1)
+        acov[r0:r1] = autocovariance(states, max_lag)
+        centred = states - phi[r0:r1, None]
+        # Blocks of the Gram matrix against the chunks up to this one
+        for s0, other in (chunks or _row_chunks(onoff)):
+            if s0 > r0:
+                break
+            block = centred @ (other - other.mean(axis=1, keepdims=True)).T
+            cross[r0:r1, s0:s0 + len(other)] = block
+            cross[s0:s0 + len(other), r0:r1] = block.T
+
+    rho = normalize_acf(acov)
+    tau = integrated_time(rho)
+    var = np.diag(cross) / n_frames
+    return {"tu_ids": np.asarray(onoff.tu_ids), "n_frames": n_frames,
+            "phi": phi, "acov": acov, "cross": cross, "rho": rho,
+            "tau_int": tau, "ess": n_frames / tau,
+            "phi_stderr": np.sqrt(var * tau / n_frames),
+            "corr": correlation(cross)}
+
+
+def correlation(cross):
+    # Pearson correlation from summed centred cross products
+    sd = np.sqrt(np.diag(cross))
+    with np.errstate(invalid="ignore", divide="ignore"):
+        corr = cross / np.outer(sd, sd)
+    corr[:, sd == 0] = np.nan
+    corr[sd == 0, :] = np.nan
+    return corr
+
+
+def corr_by_separation(corr):
+    # Mean correlation of TU pairs against their separation along the chain
+    # (in TUs), ignoring undefined pairs
+    n = len(corr)
+    i, j = np.triu_indices(n, k=1)
+    values = corr[i, j]
+    ok = np.isfinite(values)
+    sums = np.bincount(j[ok] - i[ok], values[ok], n)
+    counts = np.bincount(j[ok] - i[ok], minlength=n)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return (sums / counts)[1:]
+
+
+def save_correlations(result, np_value, run_value, out_dir, key=(-1, -1, -1)):
+    os.makedirs(out_dir, exist_ok=True)
+    ess_name, corr_name = correlation_filenames(np_value, run_value)
+    ess_file = os.path.join(out_dir, ess_name)
+    pd.DataFrame({"TU": result["tu_ids"], "phi": result["phi"],
+                  "tau_int": result["tau_int"], "ess": result["ess"],
+                  "phi_stderr": result["phi_stderr"]}).to_csv(ess_file,
+                                                              index=False)
+    corr_file = os.path.join(out_dir, corr_name)
+    np.savez(corr_file, key=np.array([-1 if k is None else k for k in key],
+                                     dtype=np.int64),
+             **{name: result[name] for name in
+                ("tu_ids", "n_frames", "phi", "acov", "cross", "rho",
+                 "tau_int", "corr")})
+    return [ess_file, corr_file]
+
+
+def process_onoff(on_off_file, out_dir, max_lag=MAX_LAG, force=False):
+    # Worker: correlations of one stored matrix, reusing saved results that
+    # are newer than the matrix. Returns (key, result)
+    onoff = load_onoff(on_off_file)
+    key = run_key(on_off_file, onoff)
+    corr_file = os.path.join(out_dir, correlation_filenames(*key[1:])[1])
+    if (not force and os.path.exists(corr_file)
+            and os.path.getmtime(corr_file) >= os.path.getmtime(on_off_file)):
+        with np.load(corr_file) as data:
+            result = {name: data[name] for name in data.files}
+        if result["acov"].shape[1] == min(max_lag, onoff.n_frames - 1) + 1:
+            result["n_frames"] = int(result["n_frames"])
+            result["ess"] = result["n_frames"] / result["tau_int"]
+            return key, result
+    result = run_correlations(onoff, max_lag)
+    save_correlations(result, key[1], key[2], out_dir, key)
+    return key, result
+
+
+def pool_runs(results):
+    # Pool the runs of one (l, Np): autocovariances and centred cross
+    # products are summed over runs (same TUs and lags), giving the mean
+    # autocorrelation, its tau_int and the correlation matrix. The ESS of the
+    # mean phi over runs is the sum of the per-run ESS
+    acov = sum(r["acov"] for r in results)
+    cross = sum(r["cross"] for r in results)
+    rho = normalize_acf(acov)
+    corr = correlation(cross)
+    return {"rho": rho, "tau_int": integrated_time(rho), "corr": corr,
+            "ess": sum(r["ess"] for r in results),
+            "corr_by_separation": corr_by_separation(corr)}
+
+
+def run_record(key, result):
+    corr = result["corr"]
+    off_diag = corr[~np.eye(len(corr), dtype=bool)]
+    with np.errstate(invalid="ignore"):
+        neighbours = np.nanmean(np.diagonal(corr, 1)) if len(corr) > 1 \
+            else np.nan
+    return {"l": key[0], "Np": key[1], "run": key[2],
+            "n_frames": int(result["n_frames"]),
+            "phi_mean": float(np.mean(result["phi"])),
+            "tau_int_mean": float(np.nanmean(result["tau_int"])),
+            "ess_mean": float(np.nanmean(result["ess"])),
+            "corr_mean": float(np.nanmean(off_diag)) if np.isfinite(
+                off_diag).any() else np.nan,
+            "corr_neighbours": float(neighbours)}
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Binding autocorrelations and TU-TU correlations of a "
+                    "sweep")
+    parser.add_argument("sweep_dir", nargs="?", default=".",
+                        help="Directory searched for TF_On_Off_Matrices")
+    parser.add_argument("-j", "--workers", type=int, default=os.cpu_count(),
+                        help="Number of worker processes")
+    parser.add_argument("--max-lag", type=int, default=MAX_LAG,
+                        help="Largest autocorrelation lag in frames")
+    parser.add_argument("-o", "--out", default="binding_correlations.csv",
+                        help="Run summaries (one row per run)")
+    parser.add_argument("--pooled-dir", default="binding_correlations",
+                        help="Where to write the pooled results per (l, Np)")
+    parser.add_argument("--force", action="store_true",
+                        help="Recompute runs whose outputs are up to date")
+    args = parser.parse_args()
+
+    files = find_onoff_files(args.sweep_dir)
+    if not files:
+        print(f"No on/off matrices found under {args.sweep_dir}")
+        return
+    print(f"Found {len(files)} runs")
+
+    records, by_group = [], {}
+    with ProcessPoolExecutor(max_workers=args.workers) as pool:
+        futures = {pool.submit(process_onoff, path,
+                               os.path.join(os.path.dirname(os.path.dirname(path)),
+                                            "TF_Phi_Values"),
+                               args.max_lag, args.force): path
+                   for path in files}
+        for done, future in enumerate(as_completed(futures), 1):
+            name = os.path.basename(futures[future])
+            try:
+                key, result = future.result()
+            except Exception as e:
+                print(f"[{done}/{len(files)}] FAILED {name}: {e}")
+                continue
+            records.append(run_record(key, result))
+            by_group.setdefault(key[:2], []).append(result)
+            print(f"[{done}/{len(files)}] ok {name}")
+
+    os.makedirs(args.pooled_dir, exist_ok=True)
+    for (l_val, np_value), results in sorted(by_group.items()):
+        shapes = {(len(r["tu_ids"]), r["acov"].shape[1]) for r in results}
+        if len(shapes) > 1:
+            print(f"Not pooling l={l_val} Np={np_value}: runs differ in TUs "
+                  f"or lags")
+            continue
+        pooled = pool_runs(results)
+        np.savez(os.path.join(args.pooled_dir,
+                              f"corr_l_{l_val}_Np_{np_value}.npz"),
+                 tu_ids=results[0]["tu_ids"], n_runs=len(results), **pooled)
+
+    summary = pd.DataFrame(records).sort_values(["l", "Np", "run"])
+    summary.to_csv(args.out, index=False)
+    print(f"✓ Saved {args.out} ({len(summary)} runs) and pooled results in "
+          f"{args.pooled_dir}")
+
+
+if __name__ == "__main__":
+    main()
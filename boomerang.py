@@ -2,20 +2,18 @@ import pandas as pd
 import numpy as np
 import matplotlib.pyplot as plt
 import seaborn as sns
-from scipy.optimize import curve_fit
 
-def fit_function(x, a, b, c):
-    #fit to quadratic function for later
-    return a * x**2 + b * x + c
+from boomerang_fit import bootstrap_fit, confidence_band, quadratic
+from results_store import normalize_stats
 
-def plot_phi_statistics(csv_file, output_plot):
-  #reads from csv from parse_mean_std.py  
-  df = pd.read_csv(csv_file)
+def plot_phi_statistics(csv_file, output_plot, n_boot=2000):
+    #reads from csv from parse_mean_std.py  
+    df = pd.read_csv(csv_file)
     
     #kill none values
     df = df.dropna()
 
-  #diff colours for runs of same Np
+    #diff colours for runs of same Np
     plt.figure(figsize=(8, 6))
     sns.scatterplot(
         data=df,
@@ -28,16 +26,17 @@ def plot_phi_statistics(csv_file, output_plot):
     )
     
     # Curve fitting ASSUMING QUADRATIC FROM PRE PRINT
+    # Fit to every run, with a 95% band from bootstrapping the runs of each Np
     x_data = df["Mean"].values
-    y_data = df["Standard Deviation"].values
-    
-    try:
-        popt, _ = curve_fit(fit_function, x_data, y_data)
+    fit = bootstrap_fit(normalize_stats(df), "quadratic", n_boot, grouped=False)
+    if np.all(np.isfinite(fit.params)):
         x_fit = np.linspace(min(x_data), max(x_data), 100)
-        y_fit = fit_function(x_fit, *popt)
+        y_fit = quadratic(x_fit, *fit.params)
+        y_lo, y_hi = confidence_band(fit, x_fit)
         plt.plot(x_fit, y_fit, 'k--', label='Best Fit Curve')
-    except Exception as e:
-        print(f"Curve fitting failed: {e}")
+        plt.fill_between(x_fit, y_lo, y_hi, color='k', alpha=0.15, label='95% band')
+    else:
+        print("Curve fitting failed")
     
 
     plt.xlabel("Mean Phi (Activity)")
@@ -1,14 +1,16 @@
+import argparse
 import pandas as pd
 import numpy as np
 import matplotlib.pyplot as plt
-from scipy.optimize import curve_fit
 from pathlib import Path
+import os
 
-# Fitting model from the paper
-def normalized_boomerang(mu, A_sigma, alpha, beta):
-    nu = alpha / (alpha + beta)
-    norm = (nu ** alpha) * ((1 - nu) ** beta)
-    return A_sigma * (mu ** alpha) * ((1 - mu) ** beta) / norm
+# Fitting model from the paper (normalized_boomerang) and bootstrap intervals
+from boomerang_fit import bootstrap_fit, confidence_band, normalized_boomerang, \
+    parameter_intervals
+from results_store import RESULTS_DIR, ResultsStore, normalize_stats
+
+N_BOOT = 2000  # Bootstrap resamples of the runs per l
 
 # Load CSVs for all l-values
 paths = {
@@ -20,76 +22,117 @@ paths = {
     100: "phi_stats_l100_r10.csv"
 }
 
-# Group φ values by TF and compute mean/std for plotting
-grouped_by_l = {}
-for l, path in paths.items():
-    df = pd.read_csv(path)
-    if l == 30:
-        grouped = df.groupby("Np").agg({
-            "Mean": "mean",
-            "Standard Deviation": "mean"
-        }).reset_index().rename(columns={"Np": "TFs", "Mean": "phi_mean", "Standard Deviation": "phi_std"})
-    else:
-        grouped = df.groupby("TFs").agg({
+# Per-run phi tables {l: df}. "csv" reads the CSVs above, "store" the results
+# store (see results_store.py), and "auto" the store for every l it has runs
+# for and the CSV for the others. Store rows are restricted to Ns = ns; they
+# must all have the same Ns if ns is not given
+def load_stats(source="auto", store_dir=RESULTS_DIR, ns=None):
+    stats_by_l = {}
+    if source != "csv" and os.path.isdir(store_dir):
+        runs = ResultsStore(store_dir).load("runs", columns=["Ns", "l", "Np", "phi_mean", "phi_std"],
+                                            Ns=ns)
+        for l, df in runs.groupby("l"):
+            if df["Ns"].nunique() > 1:
+                raise ValueError(f"The results store has l={l} runs for Ns = "
+                                 f"{sorted(df['Ns'].unique().tolist())}; choose one with --ns")
+            stats_by_l[l] = df
+    elif source == "store":
+        raise FileNotFoundError(f"No results store at {store_dir}")
+    if source != "store":
+        for l, path in paths.items():
+            if l in stats_by_l:
+                continue
+            if source == "csv" or os.path.exists(path):
+                df = normalize_stats(pd.read_csv(path))
+                # batch_phi.py adds an Ns column to the CSVs it writes
+                if "Ns" in df.columns and ns is not None:
+                    df = df[df["Ns"] == ns]
+                elif "Ns" in df.columns and df["Ns"].nunique() > 1:
+                    raise ValueError(f"{path} has runs for Ns = "
+                                     f"{sorted(df['Ns'].unique().tolist())}; choose one with --ns")
+                stats_by_l[l] = df
+    return stats_by_l
+
+# Fit and plot each l's data, with the 95% band of the bootstrapped fits
+def fit_and_plot(ax, runs, label, color):
+    fit = bootstrap_fit(runs, "normalized", N_BOOT)
+    if not np.all(np.isfinite(fit.params)):
+        return None
+    mu_fit = np.linspace(0.01, 0.99, 300)
+    sigma_fit = normalized_boomerang(mu_fit, *fit.params)
+    sigma_lo, sigma_hi = confidence_band(fit, mu_fit)
+    ax.plot(mu_fit, sigma_fit, color=color, lw=2, label=label)
+    ax.fill_between(mu_fit, sigma_lo, sigma_hi, color=color, alpha=0.2, lw=0)
+    return fit
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Boomerang curves of all TU spacings")
+    parser.add_argument("--source", choices=["auto", "csv", "store"], default="auto",
+                        help="Read the runs from the CSVs, the results store, or the store "
+                             "with the CSVs for the spacings it has no runs for")
+    parser.add_argument("--store", default=RESULTS_DIR, help="Results store directory")
+    parser.add_argument("--ns", type=int, default=None,
+                        help="Number of TUs (Ns) of the store runs to plot")
+    args = parser.parse_args()
+
+    stats_by_l = load_stats(args.source, args.store, args.ns)
+    if not stats_by_l:
+        parser.error("no phi statistics found")
+
+    # Group φ values by TF and compute mean/std for plotting
+    grouped_by_l = {}
+    for l, df in stats_by_l.items():
+        grouped_by_l[l] = df.groupby("Np").agg({
             "phi_mean": "mean",
             "phi_std": "mean"
         }).reset_index()
-    grouped_by_l[l] = grouped
-
-# Plotting setup
-colors = plt.cm.plasma(np.linspace(0, 1, len(grouped_by_l)))
-fit_params = {}
-plt.figure(figsize=(7, 5))
-
-# Fit and plot each l's data
-def fit_and_plot(ax, mu_vals, sigma_vals, label, color):
-    try:
-        popt, _ = curve_fit(normalized_boomerang, mu_vals, sigma_vals, bounds=([0, 0, 0], [1, 10, 10]))
-        mu_fit = np.linspace(0.01, 0.99, 300)
-        sigma_fit = normalized_boomerang(mu_fit, *popt)
-        ax.plot(mu_fit, sigma_fit, color=color, lw=2, label=label)
-        return popt
-    except RuntimeError:
-        return None
 
-fig, ax = plt.subplots(figsize=(7, 5))
-for (l, df), color in zip(sorted(grouped_by_l.items()), colors):
-    mu = df["phi_mean"].values
-    sigma = df["phi_std"].values
-    ax.scatter(mu, sigma, color=color, s=30)
-    params = fit_and_plot(ax, mu, sigma, f"$d_{{\mathrm{{TU}}}} = {l}$", color)
-    fit_params[l] = params
-
-# Add binomial baseline
-mu_bin = np.linspace(0.01, 0.99, 200)
-sigma_bin = np.sqrt(mu_bin * (1 - mu_bin) / 101)
-ax.plot(mu_bin, sigma_bin, 'k--', linewidth=1, label="Binomial")
-
-# Final styling
-ax.set_xlim(0, 1)
-ax.set_ylim(0, 0.45)
-ax.set_xlabel(r"$\mu(\phi)$")
-ax.set_ylabel(r"$\sigma(\phi)$")
-ax.set_title("Boomerang curves for different $d_{\mathrm{TU}}$")
-ax.legend(title=r"$d_{\mathrm{TU}}$", fontsize=9)
-plt.grid(True)
-plt.tight_layout()
-plt.savefig("boomerang_all_lengths_final.png", dpi=300)
-plt.show()
-
-# Save fitted parameters
-fit_param_records = []
-for l, popt in fit_params.items():
-    if popt is not None:
-        A_sigma, alpha, beta = popt
-        nu = alpha / (alpha + beta)
-        fit_param_records.append({
-            "l (kbp)": l,
-            "A_sigma (max \u03c3)": round(A_sigma, 4),
-            "alpha": round(alpha, 4),
-            "beta": round(beta, 4),
-            "nu (\u03bc at max \u03c3)": round(nu, 4)
-        })
-
-df_fits = pd.DataFrame(fit_param_records).sort_values("l (kbp)")
-df_fits.to_csv("boomerang_fit_parameters.csv", index=False)
+    # Plotting setup
+    colors = plt.cm.plasma(np.linspace(0, 1, len(grouped_by_l)))
+    fits = {}
+
+    fig, ax = plt.subplots(figsize=(7, 5))
+    for (l, df), color in zip(sorted(grouped_by_l.items()), colors):
+        mu = df["phi_mean"].values
+        sigma = df["phi_std"].values
+        ax.scatter(mu, sigma, color=color, s=30)
+        fits[l] = fit_and_plot(ax, stats_by_l[l], f"$d_{{\mathrm{{TU}}}} = {l}$", color)
+
+    # Add binomial baseline
+    mu_bin = np.linspace(0.01, 0.99, 200)
+    sigma_bin = np.sqrt(mu_bin * (1 - mu_bin) / 101)
+    ax.plot(mu_bin, sigma_bin, 'k--', linewidth=1, label="Binomial")
+
+    # Final styling
+    ax.set_xlim(0, 1)
+    ax.set_ylim(0, 0.45)
+    ax.set_xlabel(r"$\mu(\phi)$")
+    ax.set_ylabel(r"$\sigma(\phi)$")
+    ax.set_title("Boomerang curves for different $d_{\mathrm{TU}}$")
+    ax.legend(title=r"$d_{\mathrm{TU}}$", fontsize=9)
+    plt.grid(True)
+    plt.tight_layout()
+    plt.savefig("boomerang_all_lengths_final.png", dpi=300)
+    plt.show()
+
+    # Save fitted parameters with their 95% confidence intervals
+    fit_param_records = []
+    for l, fit in fits.items():
+        if fit is not None:
+            intervals = parameter_intervals(fit)
+            record = {"l (kbp)": l}
+            for name, column in (("A_sigma", "A_sigma (max \u03c3)"), ("alpha", "alpha"),
+                                 ("beta", "beta"), ("nu", "nu (\u03bc at max \u03c3)")):
+                est, lo, hi = intervals[name]
+                record[column] = round(est, 4)
+                record[f"{name}_lo"] = round(lo, 4)
+                record[f"{name}_hi"] = round(hi, 4)
+            fit_param_records.append(record)
+
+    df_fits = pd.DataFrame(fit_param_records).sort_values("l (kbp)")
+    df_fits.to_csv("boomerang_fit_parameters.csv", index=False)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,274 @@
+#!/usr/bin/env python3
+# boomerang_fit.py
+# Boomerang fits (sigma(phi) against mu(phi)) with bootstrap uncertainties.
+#
+# The plotting scripts fit one curve per spacing l to the (mean phi, std phi)
+# points of a sweep. Here the runs are resampled with replacement within each
+# Np (a stratified bootstrap over the rows of the per-run phi table), the fit
+# points are recomputed from every resample and the model is refitted, giving
+# percentile confidence intervals for the parameters and pointwise confidence
+# bands for the curve. The resamples of one fit are drawn at once as index
+# arrays and every refit starts from the point estimate with the analytic
+# Jacobian of the model, so a refit takes about a millisecond. That is too
+# little work to pay for a process pool, so resamples are fitted in the
+# calling process unless workers (-j) is given.
+# Models broadcast over parameter arrays, so the bands of thousands of
+# resamples are evaluated in a single array operation.
+#
+# Models:
+#   boomerang   A * mu^alpha * (1-mu)^beta          (boomerang_plotter4.py)
+#   normalized  the same scaled so that A is the maximum, reached at
+#               mu = nu = alpha/(alpha+beta)        (boomerangAllLengthsFinal.py)
+#   quadratic   a*mu^2 + b*mu + c                   (boomerang.py)
+#
+# Usage: boomerang_fit.py [--csv L phi_stats.csv ...] [--store DIR]
+#            [--n-boot 2000] [-j N] [-o boomerang_fit_parameters.csv]
+
+import argparse
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+from scipy.optimize import curve_fit
+
+from results_store import RESULTS_DIR, ResultsStore, normalize_stats
+
+N_BOOT = 2000
+CI = 0.95
+CHUNKS_PER_WORKER = 4
+
+
+def boomerang_fit_function(mu, A_sigma, alpha, beta):
+    return A_sigma * (mu ** alpha) * ((1 - mu) ** beta)
+
+
+def normalized_boomerang(mu, A_sigma, alpha, beta):
+    nu = alpha / (alpha + beta)
+    norm = (nu ** alpha) * ((1 - nu) ** beta)
+    return A_sigma * (mu ** alpha) * ((1 - mu) ** beta) / norm
+
+
+def quadratic(mu, a, b, c):
+    return a * mu**2 + b * mu + c
+
+
+def _boomerang_jac(mu, A_sigma, alpha, beta):
+    f = boomerang_fit_function(mu, A_sigma, alpha, beta)
+    return np.column_stack([f / A_sigma, f * np.log(mu), f * np.log(1 - mu)])
+
+
+def _normalized_jac(mu, A_sigma, alpha, beta):
+    # The derivatives of the normalisation through nu cancel, leaving
+    # d(log f)/d(alpha) = log(mu/nu) and d(log f)/d(beta) = log((1-mu)/(1-nu))
+    f = normalized_boomerang(mu, A_sigma, alpha, beta)
+    nu = alpha / (alpha + beta)
+    return np.column_stack([f / A_sigma, f * np.log(mu / nu),
+                            f * np.log((1 - mu) / (1 - nu))])
+
+
+def _quadratic_jac(mu, a, b, c):
+    return np.column_stack([mu**2, mu, np.ones_like(mu)])
+
+
+# name -> (function, Jacobian, parameter names, default p0, default bounds)
+Model = namedtuple("Model", ["func", "jac", "params", "p0", "bounds"])
+MODELS = {
+    "boomerang": Model(boomerang_fit_function, _boomerang_jac,
+                       ["A_sigma", "alpha", "beta"], [0.2, 0.5, 0.5],
+                       (-np.inf, np.inf)),
+    "normalized": Model(normalized_boomerang, _normalized_jac,
+                        ["A_sigma", "alpha", "beta"], [0.2, 0.5, 0.5],
+                        ([0, 0, 0], [1, 10, 10])),
+    "quadratic": Model(quadratic, _quadratic_jac, ["a", "b", "c"], None,
+                       (-np.inf, np.inf)),
+}
+
+# Result of bootstrap_fit
+#   model    : model name
+#   params   : (3,) point estimate from the full data (NaN if it failed)
+#   samples  : (n_ok, 3) parameters of the successful resample fits
+#   n_failed : number of resamples whose fit did not converge
+#   mu, sigma: the fit points of the full data
+BoomerangFit = namedtuple("BoomerangFit", ["model", "params", "samples",
+                                           "n_failed", "mu", "sigma"])
+
+
+def fit_curve(mu, sigma, model="normalized", p0=None):
+    # Least-squares fit of one set of points; raises RuntimeError if the fit
+    # does not converge
+    m = MODELS[model]
+    mu = np.asarray(mu, dtype=np.float64)
+    use_jac = model == "quadratic" or np.all((mu > 0) & (mu < 1))
+    popt, _ = curve_fit(m.func, mu, sigma, p0=m.p0 if p0 is None else p0,
+                        bounds=m.bounds, jac=m.jac if use_jac else None)
+    return popt
+
+
+def _fit_chunk(model, X, Y, p0):
+    # Worker: fit every row of (X, Y), NaN where the fit fails
+    out = np.full((len(X), 3), np.nan)
+    for k, (mu, sigma) in enumerate(zip(X, Y)):
+        try:
+            out[k] = fit_curve(mu, sigma, model, p0)
+        except (RuntimeError, ValueError):
+            pass
+    return out
+
+
+def fit_points(runs, grouped=True):
+    # (mu, sigma) fit points of a per-run table (columns Np, phi_mean,
+    # phi_std): the mean over runs for each Np, or every run if not grouped
+    runs = runs.dropna(subset=["phi_mean", "phi_std"]).sort_values("Np")
+    if not grouped:
+        return runs["phi_mean"].to_numpy(), runs["phi_std"].to_numpy()
+    means = runs.groupby("Np")[["phi_mean", "phi_std"]].mean()
+    return means["phi_mean"].to_numpy(), means["phi_std"].to_numpy()
+
+
+def resample_points(runs, n_boot, rng, grouped=True):
+    # (n_boot, n_points) arrays of the fit points of n_boot stratified
+    # resamples, runs being drawn with replacement within each Np
+    runs = runs.dropna(subset=["phi_mean", "phi_std"]).sort_values("Np")
+    X, Y = [], []
+    for _, group in runs.groupby("Np"):
+        m = group["phi_mean"].to_numpy()
+        s = group["phi_std"].to_numpy()
+        idx = rng.integers(len(group), size=(n_boot, len(group)))
+        if grouped:
+            X.append(m[idx].mean(axis=1, keepdims=True))
+            Y.append(s[idx].mean(axis=1, keepdims=True))
+        else:
+            X.append(m[idx])
+            Y.append(s[idx])
+    return np.hstack(X), np.hstack(Y)
+
+
+def bootstrap_fit(runs, model="normalized", n_boot=N_BOOT, grouped=True,
+                  workers=1, seed=None, p0=None):
+    # Fit a per-run phi table and bootstrap the fit over its runs. runs needs
+    # the columns Np, phi_mean and phi_std (see results_store.normalize_stats)
+    mu, sigma = fit_points(runs, grouped)
+    try:
+        params = fit_curve(mu, sigma, model, p0)
+    except (RuntimeError, ValueError):
+        return BoomerangFit(model, np.full(3, np.nan), np.zeros((0, 3)),
+                            n_boot, mu, sigma)
+
+    X, Y = resample_points(runs, n_boot, np.random.default_rng(seed), grouped)
+    if workers > 1 and n_boot > 1:
+        chunks = np.array_split(np.arange(n_boot),
+                                min(n_boot, workers * CHUNKS_PER_WORKER))
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            parts = pool.map(_fit_chunk, [model] * len(chunks),
+                             [X[c] for c in chunks], [Y[c] for c in chunks],
+                             [params] * len(chunks))
+            samples = np.vstack(list(parts))
+    else:
+        samples = _fit_chunk(model, X, Y, params)
+    ok = np.all(np.isfinite(samples), axis=1)
+    return BoomerangFit(model, params, samples[ok], int(np.sum(~ok)), mu,
+                        sigma)
+
+
+def _with_nu(model, params):
+    # Append nu = alpha/(alpha+beta), the mu of maximum noise, for the
+    # boomerang models
+    params = np.atleast_2d(params)
+    if model == "quadratic":
+        return params
+    nu = params[:, 1] / (params[:, 1] + params[:, 2])
+    return np.column_stack([params, nu])
+
+
+def parameter_intervals(fit, ci=CI):
+    # {name: (estimate, low, high)} with percentile confidence intervals,
+    # including nu for the boomerang models
+    names = MODELS[fit.model].params + ([] if fit.model == "quadratic"
+                                        else ["nu"])
+    est = _with_nu(fit.model, fit.params)[0]
+    if len(fit.samples):
+        lo, hi = np.percentile(_with_nu(fit.model, fit.samples),
+                               [50 * (1 - ci), 50 * (1 + ci)], axis=0)
+    else:
+        lo = hi = np.full(len(names), np.nan)
+    return {name: (est[k], lo[k], hi[k]) for k, name in enumerate(names)}
+
+
+def evaluate(model, params, mu):
+    # Model values for (n, 3) parameter sets on a grid of mu, as (n, len(mu))
+    params = np.atleast_2d(params)
+    return MODELS[model].func(np.asarray(mu)[None, :], *(params.T[:, :, None]))
+
+
+def confidence_band(fit, mu, ci=CI):
+    # Pointwise (low, high) percentile band of the fitted curve on mu
+    if not len(fit.samples):
+        nan = np.full(len(mu), np.nan)
+        return nan, nan
+    with np.errstate(invalid="ignore", over="ignore"):
+        curves = evaluate(fit.model, fit.samples, mu)
+    lo, hi = np.nanpercentile(curves, [50 * (1 - ci), 50 * (1 + ci)], axis=0)
+    return lo, hi
+
+
+def fit_record(fit, ci=CI, **key):
+    # One row of the fit parameter table: estimate and interval bounds of
+    # every parameter
+    record = dict(key)
+    for name, (est, lo, hi) in parameter_intervals(fit, ci).items():
+        record.update({name: est, f"{name}_lo": lo, f"{name}_hi": hi})
+    record.update({"n_boot": len(fit.samples) + fit.n_failed,
+                   "n_failed": fit.n_failed})
+    return record
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Bootstrap boomerang fits for each TU spacing")
+    parser.add_argument("--csv", nargs=2, action="append", default=[],
+                        metavar=("L", "CSV"),
+                        help="Per-run phi statistics of spacing L "
+                             "(phi_stats_l*.csv or phi_statistics.csv)")
+    parser.add_argument("--store", default=RESULTS_DIR,
+                        help="Results store read when no --csv is given")
+    parser.add_argument("--model", choices=list(MODELS), default="normalized")
+    parser.add_argument("--per-run", action="store_true",
+                        help="Fit every run rather than the mean per Np")
+    parser.add_argument("--n-boot", type=int, default=N_BOOT)
+    parser.add_argument("--ci", type=float, default=CI,
+                        help="Confidence level of the intervals")
+    parser.add_argument("-j", "--workers", type=int, default=1,
+                        help="Worker processes for the resample fits (more "
+                             "than 1 only helps for large --n-boot)")
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("-o", "--out", default="boomerang_fit_parameters.csv")
+    args = parser.parse_args()
+
+    if args.csv:
+        runs_by_l = {int(l): normalize_stats(pd.read_csv(path))
+                     for l, path in args.csv}
+    else:
+        runs = ResultsStore(args.store).load(
+            "runs", columns=["l", "Np", "run", "phi_mean", "phi_std"])
+        runs_by_l = {l: df for l, df in runs.groupby("l")}
+    if not runs_by_l:
+        parser.error("no phi statistics found (give --csv or --store)")
+
+    records = []
+    for l_val, runs in sorted(runs_by_l.items()):
+        fit = bootstrap_fit(runs, args.model, args.n_boot, not args.per_run,
+                            args.workers, args.seed)
+        records.append(fit_record(fit, args.ci, l=l_val))
+        intervals = parameter_intervals(fit, args.ci)
+        print(f"l={l_val}: " + ", ".join(
+            f"{name}={est:.4f} [{lo:.4f}, {hi:.4f}]"
+            for name, (est, lo, hi) in intervals.items())
+            + (f" ({fit.n_failed} failed fits)" if fit.n_failed else ""))
+
+    pd.DataFrame(records).to_csv(args.out, index=False)
+    print(f"Saved {args.out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -2,12 +2,12 @@ import pandas as pd
 import numpy as np
 import matplotlib.pyplot as plt
 import seaborn as sns
-from scipy.optimize import curve_fit
 
-def boomerang_fit_function(mu, A_sigma, alpha, beta):
-    return A_sigma * (mu ** alpha) * ((1 - mu) ** beta)
+from boomerang_fit import bootstrap_fit, boomerang_fit_function, confidence_band, \
+    parameter_intervals
+from results_store import normalize_stats
 
-def plot_phi_statistics(csv_file, output_plot):
+def plot_phi_statistics(csv_file, output_plot, n_boot=2000):
     df = pd.read_csv(csv_file)
     df = df.dropna()
 
@@ -32,18 +32,22 @@ def plot_phi_statistics(csv_file, output_plot):
     )
 
     x_data = grouped_df["Mean"].values
-    y_data = grouped_df["Standard Deviation"].values
-    p0 = [0.2, 0.5, 0.5]
 
-    try:
-        popt, _ = curve_fit(boomerang_fit_function, x_data, y_data, p0=p0)
+    # Fit to the means per Np, with 95% intervals from bootstrapping the runs
+    fit = bootstrap_fit(normalize_stats(df), "boomerang", n_boot)
+    if np.all(np.isfinite(fit.params)):
         x_fit = np.linspace(min(x_data), max(x_data), 100)
-        y_fit = boomerang_fit_function(x_fit, *popt)
+        y_fit = boomerang_fit_function(x_fit, *fit.params)
+        y_lo, y_hi = confidence_band(fit, x_fit)
+        intervals = parameter_intervals(fit)
         # Legend label with multi-line formatting
-        fit_label = f'Fit:\nA = {popt[0]:.3f}\nα = {popt[1]:.3f}\nβ = {popt[2]:.3f}'
+        fit_label = "Fit:" + "".join(
+            f"\n{symbol} = {intervals[name][0]:.3f} [{intervals[name][1]:.3f}, {intervals[name][2]:.3f}]"
+            for symbol, name in (("A", "A_sigma"), ("α", "alpha"), ("β", "beta")))
         plt.plot(x_fit, y_fit, 'k--', label=fit_label)
-    except Exception as e:
-        print(f"Curve fitting failed: {e}")
+        plt.fill_between(x_fit, y_lo, y_hi, color='k', alpha=0.15, label="95% band")
+    else:
+        print("Curve fitting failed")
 
     plt.xlabel("Mean Phi (Activity)")
     plt.ylabel("Standard Deviation of Phi (Noise)")
@@ -1,8 +1,17 @@
+import argparse
 import os
+import sys
 import numpy as np
 import pandas as pd
 from pathlib import Path
 
+from binding import BINDING_THRESHOLD, frame_blocks, nearest_tf_distances, parse_thresholds
+from online_stats import BindingAccumulator, ThresholdAccumulator
+from profiling import active, add_profile_args, profile_dir, profile_traj, report_base, \
+    write_report
+from result_cache import CACHE_DIR, ResultCache, cache_key
+from traj_reader import add_frame_args, read_frames
+
 # Parameters
 LENGTH_REPEAT_MAP = {
     10: 30,
@@ -12,66 +21,92 @@ LENGTH_REPEAT_MAP = {
     100: 10
 }
 
-BINDING_THRESHOLD = 3.5
 SIGMA = 1.0
 BOX_SIZE = 100.0
 
 # Function to parse trajectory file and compute phi per TU
-def parse_traj(filepath, box_size=BOX_SIZE, sigma=SIGMA, binding_threshold=BINDING_THRESHOLD):
+# Distances use the minimum-image convention in the box read from the dump;
+# box_size, if given, overrides it for a cubic box. start/stop/stride select
+# frames like a slice (see traj_index.py). Raises on bad input.
+# binding_threshold may also be a sorted array of K thresholds: the distances are then
+# computed once per frame and a (K, N_TU) phi array is returned, one row per threshold.
+def compute_phi(filepath, box_size=None, sigma=SIGMA, binding_threshold=BINDING_THRESHOLD,
+                start=None, stop=None, stride=None):
+    # Only per-TU bound counts are kept, see online_stats.py
+    multi = np.ndim(binding_threshold) > 0
+    if multi:
+        acc = ThresholdAccumulator(np.asarray(binding_threshold) * sigma)
+    else:
+        acc = BindingAccumulator(track_variance=False)
+
+    # Frames are streamed in blocks; truncated frames are dropped by the reader
+    with active().hot():
+        for timesteps, tu_ids, tu, prot, on, lengths in frame_blocks(read_frames(filepath, start, stop, stride)):
+            if len(tu_ids) == 0:
+                raise ValueError(f"No TU beads in {filepath}")
+            if box_size is not None:
+                lengths = np.full_like(lengths, box_size)
+            dist = nearest_tf_distances(tu, prot, on, lengths)
+            if multi:
+                acc.update(dist, tu_ids)
+            else:
+                acc.update(dist <= binding_threshold * sigma)
+
+    if acc.n == 0:
+        raise ValueError(f"No complete frames in {filepath}")
+
+    phi_vals = acc.phi()   # fraction of time each TU is bound
+    return phi_vals
+
+# Same as compute_phi but returns None instead of raising (the error is reported on stderr
+# and counted in the active profile)
+def parse_traj(filepath, box_size=None, sigma=SIGMA, binding_threshold=BINDING_THRESHOLD,
+               start=None, stop=None, stride=None):
     try:
-        with open(filepath, 'r') as f:
-            lines = f.readlines()
-
-        frames, i = [], 0
-        while i < len(lines):
-            if "ITEM: TIMESTEP" not in lines[i]:
-                i += 1
-                continue
-            try:
-                n_atoms = int(lines[i + 3])
-                atom_lines = lines[i + 9:i + 9 + n_atoms]
-                if len(atom_lines) != n_atoms:
-                    i += 9 + n_atoms
-                    continue
-                frame = [list(map(float, ln.strip().split())) for ln in atom_lines]
-                frames.append(frame)
-                i += 9 + n_atoms
-            except Exception:
-                i += 1
-
-        if not frames:
-            return None
-
-        arr0 = np.array(frames[0])
-        types = arr0[:, 1].astype(int)
-        tu_idx = np.where(types == 2)[0]
-        tf_idx = np.where(types == 3)[0]
-
-        if len(tu_idx) == 0 or len(tf_idx) == 0:
-            return None
-
-        tu_binding = []
-        for frame in frames:
-            arr = np.array(frame)
-            coords = arr[:, 2:5] * box_size
-            tu_coords = coords[tu_idx]
-            tf_coords = coords[tf_idx]  # all TF beads
-
-            bound = [
-                1 if np.any(np.linalg.norm(tf_coords - tu, axis=1) <= binding_threshold * sigma) else 0
-                for tu in tu_coords
-            ]
-            tu_binding.append(bound)
-
-        tu_binding = np.array(tu_binding).T  # shape: [num_tus, num_timesteps]
-        phi_vals = tu_binding.mean(axis=1)   # fraction of time each TU is bound
-        return phi_vals
-
-    except Exception:
+        return compute_phi(filepath, box_size, sigma, binding_threshold, start, stop, stride)
+    except Exception as e:
+        active().count("errors")
+        print(f"Warning: skipping {filepath}: {e!r}", file=sys.stderr)
         return None
 
+# Cache parameters of a phi computation (shared with batch_phi.py)
+def phi_cache_params(binding_threshold=BINDING_THRESHOLD, sigma=SIGMA, box_size=None,
+                     start=None, stop=None, stride=None):
+    if np.ndim(binding_threshold) > 0:
+        binding_threshold = [float(t) for t in binding_threshold]
+    return {"analysis": "phi", "binding_threshold": binding_threshold,
+            "sigma": sigma, "box_size": box_size, "frames": [start, stop, stride]}
+
+# parse_traj, but reusing results stored in a ResultCache when the trajectory is unchanged
+def cached_parse_traj(filepath, cache, sigma=SIGMA, binding_threshold=BINDING_THRESHOLD,
+                      start=None, stop=None, stride=None):
+    params = phi_cache_params(binding_threshold, sigma, None, start, stop, stride)
+    key = cache_key(filepath, params)
+    hit = cache.get(key)
+    if hit is not None:
+        return hit["phi"]
+    phi = parse_traj(filepath, None, sigma, binding_threshold, start, stop, stride)
+    if phi is not None:
+        cache.put(key, filepath, params, phi=phi)
+    return phi
+
+# Summary rows of a (K, N_TU) phi array, one per threshold
+def threshold_summaries(thresholds, phi):
+    return [{"Threshold": float(t),
+             "phi_mean": round(np.mean(row), 6),
+             "phi_std": round(np.std(row), 6)} for t, row in zip(thresholds, phi)]
+
 # Run parser and generate CSVs for all spacings
-def main():
+# With a profile report, per-trajectory stage timings are written to it (see profiling.py)
+# With thresholds (an array from binding.parse_thresholds), phi is computed for all of them
+# in one pass and phi_stats_l{l}_r{n}_thresholds.csv gets one row per run and threshold
+def main(cache_dir=CACHE_DIR, start=None, stop=None, stride=None, report=None, cprofile=False,
+         thresholds=None):
+    # Only new or changed trajectories are parsed, see result_cache.py
+    cache = ResultCache(cache_dir)
+    records = []
+    binding_threshold = BINDING_THRESHOLD if thresholds is None else thresholds
+
     for l_val, n_repeats in LENGTH_REPEAT_MAP.items():
         base = Path(f"./runSep{l_val}")
         if not base.exists():
@@ -83,8 +118,16 @@ def main():
             for run in range(1, n_repeats + 1):
                 fname = f"pos_noise_Ns_30_l_{l_val}_Np_{n_tf}_run_{run}.lammpstrj"
                 for file in base.rglob(fname):
-                    phi = parse_traj(file)
-                    if phi is not None:
+                    with profile_traj(file, report is not None, cprofile) as prof:
+                        phi = cached_parse_traj(file, cache, SIGMA, binding_threshold,
+                                                start, stop, stride)
+                    if prof.enabled:
+                        records.append(prof.record())
+                        prof.dump_cprofile(profile_dir(report))
+                    if phi is not None and thresholds is not None:
+                        for row in threshold_summaries(thresholds, phi):
+                            results.append({"TFs": n_tf, "Run": run, **row, "File": file.name})
+                    elif phi is not None:
                         results.append({
                             "TFs": n_tf,
                             "Run": run,
@@ -95,8 +138,25 @@ def main():
 
         df = pd.DataFrame(results)
         out_file = f"phi_stats_l{l_val}_r{n_repeats}.csv"
+        if thresholds is not None:
+            out_file = f"phi_stats_l{l_val}_r{n_repeats}_thresholds.csv"
         df.to_csv(out_file, index=False)
         print(f"✓ Saved: {out_file} with {len(df)} entries")
 
+    cache.flush()
+
+    if report is not None:
+        for path in write_report(records, report):
+            print(f"✓ Saved profile report: {path}")
+
 if __name__ == "__main__":
-    main()
+    parser = argparse.ArgumentParser(description="Compute phi statistics for all runSep* directories")
+    parser.add_argument("--cache-dir", default=CACHE_DIR, help="Directory of the result cache")
+    parser.add_argument("--thresholds", metavar="SPEC",
+                        help="Compute phi for several binding thresholds in one pass, "
+                             "as start:stop:step (e.g. 2.5:5.0:0.1) or a comma separated list")
+    add_frame_args(parser)
+    add_profile_args(parser)
+    args = parser.parse_args()
+    main(args.cache_dir, args.start, args.stop, args.stride, report_base(args), args.profile,
+         parse_thresholds(args.thresholds) if args.thresholds else None)
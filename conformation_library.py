@@ -0,0 +1,159 @@
+#!/usr/bin/env python3
+# conformation_library.py
+# A cache of equilibrated polymer conformations to start new runs from.
+#
+# Conformations are stored per chain length, persistence length and box size
+# in <library_dir>/conf_N_{}_lp_{}_box_{}.npz as unwrapped (M, N, 3)
+# coordinates. They are added either by harvesting the last frame of the
+# equilibration dump (pos-equil_*.lammpstrj) of finished runs, or by growing
+# pre-relaxed self-avoiding chains (createPolymer.create_self_avoiding).
+# lammps_init.py --init relaxed --library DIR draws a conformation for each
+# new run, moves it by a random periodic translation and cube symmetry (so
+# runs sharing a conformation still start differently), and LAMMPS gives it
+# fresh velocities.
+#
+# Usage: conformation_library.py add <library_dir> <pos-equil_dump> [...]
+#        conformation_library.py grow <library_dir> --nbeads N --count M
+#        conformation_library.py info <library_dir>
+
+import argparse
+import glob
+import os
+import sys
+
+import numpy as np
+
+from createPolymer import self_avoiding_walk
+from traj_reader import box_lengths, read_frames, unwrapped_coords
+
+LIBRARY_DIR = "conf_library"
+POLYMER_TYPES = (1, 2)
+
+
+def library_file(library_dir, nbeads, l_p, box_size):
+    return os.path.join(library_dir,
+                        f"conf_N_{nbeads}_lp_{l_p:g}_box_{box_size:g}.npz")
+
+
+def load_conformations(library_dir, nbeads, l_p, box_size):
+    # (M, nbeads, 3) stored conformations, M = 0 if there are none
+    path = library_file(library_dir, nbeads, l_p, box_size)
+    if not os.path.exists(path):
+        return np.zeros((0, nbeads, 3))
+    with np.load(path) as data:
+        return data["coords"]
+
+
+def add_conformations(library_dir, coords, l_p, box_size):
+    # Append (M, N, 3) unwrapped conformations to the library
+    coords = np.asarray(coords, dtype=np.float64)
+    nbeads = coords.shape[1]
+    old = load_conformations(library_dir, nbeads, l_p, box_size)
+    os.makedirs(library_dir, exist_ok=True)
+    path = library_file(library_dir, nbeads, l_p, box_size)
+    tmp_file = path + ".tmp.npz"
+    np.savez(tmp_file, coords=np.concatenate([old, coords]))
+    os.replace(tmp_file, path)
+    return len(old)+len(coords)
+
+
+def harvest(dump_file):
+    # Unwrapped polymer coordinates and box size from the last frame of an
+    # equilibration dump
+    last = None
+    for last in read_frames(dump_file):
+        pass
+    if last is None:
+        raise ValueError(f"No complete frames in {dump_file}")
+    lengths = box_lengths(last.box)
+    if not np.allclose(lengths, lengths[0]):
+        raise ValueError(f"{dump_file}: only cubic boxes are supported")
+    polymer = np.isin(last.types, POLYMER_TYPES)
+    # Centre on the box so that it can be placed like a new chain
+    coords = unwrapped_coords(last)[polymer]-last.box[:, 0]-lengths/2.0
+    return coords, float(lengths[0])
+
+
+def grow(nbeads, count, sigma, l_p, box_size, seed=None):
+    # Pre-relaxed self-avoiding chains starting at the box centre
+    rng = np.random.default_rng(seed)
+    half = np.full(3, box_size/2.0)
+    return np.array([self_avoiding_walk(nbeads, sigma, half, rng, l_p=l_p)
+                     for _ in range(count)])
+
+
+def place(coords, box_size, rng):
+    # Randomly translate a conformation in the periodic box and apply one of
+    # the 48 symmetries of the cube. Returns wrapped coordinates in
+    # [-box/2, box/2) and the image flags
+    coords = coords[:, rng.permutation(3)]*rng.choice([-1.0, 1.0], 3)
+    coords = coords+rng.random(3)*box_size
+    images = np.floor((coords+box_size/2.0)/box_size).astype(np.int64)
+    return coords-images*box_size, images
+
+
+def draw_conformation(library_dir, nbeads, l_p, box_size, rng):
+    # A randomly placed conformation from the library, or None if the library
+    # has none for this chain
+    confs = load_conformations(library_dir, nbeads, l_p, box_size)
+    if len(confs) == 0:
+        return None
+    return place(confs[rng.integers(len(confs))], box_size, rng)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Manage the library of starting conformations")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    add = sub.add_parser("add", help="Add the final frames of equilibration "
+                                     "dumps")
+    add.add_argument("library_dir")
+    add.add_argument("dump_files", nargs="+")
+    add.add_argument("--lp", type=float, default=3.0,
+                     help="Persistence length used in the runs")
+
+    grow_p = sub.add_parser("grow", help="Add pre-relaxed self-avoiding "
+                                         "chains")
+    grow_p.add_argument("library_dir")
+    grow_p.add_argument("--nbeads", type=int, required=True)
+    grow_p.add_argument("--count", type=int, default=10)
+    grow_p.add_argument("--sigma", type=float, default=1.0)
+    grow_p.add_argument("--lp", type=float, default=3.0)
+    grow_p.add_argument("--box-size", type=float, default=100.0)
+    grow_p.add_argument("--seed", type=int, default=None)
+
+    info = sub.add_parser("info", help="List the stored conformations")
+    info.add_argument("library_dir")
+    args = parser.parse_args()
+
+    if args.command == "add":
+        for dump_file in args.dump_files:
+            try:
+                coords, box_size = harvest(dump_file)
+            except ValueError as e:
+                print(f"Skipping {dump_file}: {e}")
+                continue
+            n = add_conformations(args.library_dir, coords[None], args.lp,
+                                  box_size)
+            print(f"Added {dump_file} ({len(coords)} beads, {n} stored)")
+    elif args.command == "grow":
+        coords = grow(args.nbeads, args.count, args.sigma, args.lp,
+                      args.box_size, args.seed)
+        n = add_conformations(args.library_dir, coords, args.lp,
+                              args.box_size)
+        print(f"Added {args.count} chains of {args.nbeads} beads "
+              f"({n} stored)")
+    else:
+        files = sorted(glob.glob(os.path.join(args.library_dir, "conf_*.npz")))
+        if not files:
+            print(f"No conformations in {args.library_dir}")
+            sys.exit(1)
+        for path in files:
+            with np.load(path) as data:
+                print(f"{os.path.basename(path)}: {len(data['coords'])} "
+                      f"conformations")
+
+
+if __name__ == "__main__":
+    main()
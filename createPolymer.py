@@ -4,68 +4,101 @@
 # coarse-grained DNA/chromatin fibre and protein beads in a box of size
 # (lx,ly,lz). The centre of the box is at the origin and the first bead of the
 # polymeris at point (x0,y0,z0) (or at the origin by default).
+#
+# The walk is generated in blocks: step directions for many beads are drawn at
+# once, the positions follow from a cumulative sum, and if a bead would leave
+# the box only the walk from that bead onwards is recomputed. Random numbers
+# are consumed in the same order as the original one-bead-at-a-time loop (two
+# per attempted step, then three per protein), so a given seed produces the
+# same configuration file as before. The original loop is kept as
+# legacy=True (--legacy on the command line) to check this.
+#
+# The generator can also be imported, e.g. to build many configurations in
+# one process:
+#   from createPolymer import create_polymer, write_config
+#   types, coords = create_polymer(nbeads, nprots, sigma, (lx,ly,lz), seed)
+#
+# create_self_avoiding (--self-avoiding) instead grows a chain whose
+# non-bonded beads never come closer than sigma, using a cell grid for the
+# overlap checks, with bond angles drawn from the Boltzmann distribution of
+# the cosine angle potential for persistence length --lp. Proteins are then
+# placed without overlapping the chain. Such a chain needs much less
+# equilibration than the phantom random walk.
 
+import argparse
+import itertools
+import math
 import sys
 import numpy as np
 
-args = sys.argv
-nargs = len(args)
+# Define the bead type for DNA/chromatin and protein beads
+dna_type = 1
+protein_type = 2
 
-if (nargs != 9 and nargs != 12):
-    print("Usage: create_dna_protein.py nbeads nprots sigma",
-          "lx ly lz seed out_file [x0 y0 z0]")
-    sys.exit(1)
+# Maximum number of steps drawn at once, and the smallest number of steps
+# tried at once after a rejection (in a crowded box many steps are rejected
+# and redoing long cumulative sums would be wasted work)
+BLOCK_SIZE = 4096
+MIN_WINDOW = 16
 
-nbeads = int(args.pop(1))  # Number of polymer beads
-nprots = int(args.pop(1))  # Number of protein beads
-sigma = float(args.pop(1)) # The bond length between beads (or bead size)
-lx = float(args.pop(1))    # Box dimension in the x direction
-ly = float(args.pop(1))    # Box dimension in the y direction
-lz = float(args.pop(1))    # Box dimension in the z direction
-seed = int(args.pop(1))    # Seed for the random generator
-out_file = args.pop(1)     # Name of the output file
+# Offsets of a cell and its 26 neighbours
+_NEIGHBOURS = list(itertools.product((-1, 0, 1), repeat=3))
 
-xhalf = lx/2.0
-yhalf = ly/2.0
-zhalf = lz/2.0
 
-xprev = 0.0
-yprev = 0.0
-zprev = 0.0
+# A helper function to check if the coordinates lie outside the box
+def out_of_box(coords, half):
+    return np.any(np.abs(coords) > half, axis=-1)
 
-# Define the bead type for DNA/chromatin and protein beads
-dna_type = 1
-protein_type = 2
 
-# A helper function to check if the coordinates lie outside the box
-def out_of_box(x,y,z):
-    global xhalf, yhalf, zhalf
-    return abs(x) > xhalf or abs(y) > yhalf or abs(z) > zhalf
-
-# Set the initial bead of the polymer to the given coordinates (if supplied)
-if (nargs == 12):
-    x0 = float(args.pop(1))
-    y0 = float(args.pop(1))
-    z0 = float(args.pop(1))
-    # Check that this point is within the simulation box
-    if (out_of_box(x0,y0,z0)):
-        print("Error: the initial point must be within the simulation box")
-        sys.exit(1)
-    xprev = x0
-    yprev = y0
-    zprev = z0
-
-# Set up the random generator
-rng = np.random.default_rng(seed)
-
-with open(out_file,'w') as writer:
-    # Output the position of the first polymer bead
-    writer.write("{:d} {:d} {:f} {:f} {:f}\n".format(1,1,xprev,yprev,zprev))
-    # Generate the positions of the remaining polymer beads
-    for i in range(2,nbeads+1):
+def _steps(r, sigma):
+    # Bond vectors of length sigma from (N,2) uniform numbers: a random point
+    # on a sphere of diameter sigma centred at the previous bead
+    costheta = 1.0-2.0*r[:, 0]
+    sintheta = np.sqrt(1-costheta*costheta)
+    phi = 2.0*np.pi*r[:, 1]
+    return np.column_stack([sigma*sintheta*np.cos(phi),
+                            sigma*sintheta*np.sin(phi),
+                            sigma*costheta])
+
+
+def random_walk(nbeads, sigma, half, rng, start=(0.0, 0.0, 0.0),
+                block_size=BLOCK_SIZE):
+    # (nbeads,3) positions of a random walk that stays inside the box
+    coords = np.empty((nbeads, 3))
+    coords[0] = start
+    steps = np.empty((0, 3))
+    window = block_size
+    i = 1
+    while i < nbeads:
+        if len(steps) == 0:
+            # At least one attempt is needed per remaining bead, so never
+            # draw more numbers than the original loop would have
+            steps = _steps(rng.random((min(block_size, nbeads-i), 2)), sigma)
+        # Accumulate from the previous bead so that positions are summed in
+        # the same order as in the original loop
+        trial = np.cumsum(np.vstack([coords[i-1], steps[:window]]),
+                          axis=0)[1:]
+        bad = np.flatnonzero(out_of_box(trial, half))
+        if len(bad):
+            n_ok, n_used = bad[0], bad[0]+1  # Discard the rejected step
+            window = max(window//2, MIN_WINDOW)
+        else:
+            n_ok = n_used = len(trial)
+            window = min(window*2, block_size)
+        coords[i:i+n_ok] = trial[:n_ok]
+        i += n_ok
+        # Continue from the last good bead
+        steps = steps[n_used:]
+    return coords
+
+
+def _legacy_walk(nbeads, sigma, half, rng, start=(0.0, 0.0, 0.0)):
+    # The original bead-by-bead rejection loop
+    xhalf, yhalf, zhalf = half
+    coords = np.empty((nbeads, 3))
+    xprev, yprev, zprev = coords[0] = start
+    for i in range(1, nbeads):
         while (True):
-            # Generate a random position for the next bead to be anywhere on a
-            # sphere of diameter sigma that is centred at the previous bead
             r = rng.random()
             costheta = 1.0-2.0*r
             sintheta = np.sqrt(1-costheta*costheta)
@@ -74,21 +107,242 @@ with open(out_file,'w') as writer:
             x = xprev+sigma*sintheta*np.cos(phi)
             y = yprev+sigma*sintheta*np.sin(phi)
             z = zprev+sigma*costheta
-
-            # Make sure the new point is not outside the box, otherwise
-            # re-generate it
-            if (out_of_box(x,y,z)): continue
-            
-            writer.write("{:d} {:d} {:f} {:f} {:f}\n".format(i,dna_type,x,y,z))
-            xprev = x
-            yprev = y
-            zprev = z
+            if abs(x) > xhalf or abs(y) > yhalf or abs(z) > zhalf: continue
+            coords[i] = xprev, yprev, zprev = x, y, z
             break
-    
-    # Generate the positions of the protein beads
-    for i in range(1,nprots+1):
-        x = rng.random()*lx-xhalf
-        y = rng.random()*ly-yhalf
-        z = rng.random()*lz-zhalf
-        writer.write("{:d} {:d} {:f} {:f} {:f}\n".format(
-            i+nbeads,protein_type,x,y,z))
+    return coords
+
+
+def create_polymer(nbeads, nprots, sigma, box, seed=None,
+                   start=(0.0, 0.0, 0.0), rng=None, legacy=False):
+    # Generate the polymer and protein beads. Returns the (N,) bead types and
+    # (N,3) positions, polymer beads first
+    box = np.asarray(box, dtype=np.float64)
+    half = box/2.0
+    if out_of_box(np.asarray(start, dtype=np.float64), half):
+        raise ValueError("The initial point must be within the simulation box")
+    if rng is None:
+        rng = np.random.default_rng(seed)
+
+    if legacy:
+        polymer = _legacy_walk(nbeads, sigma, half, rng, start)
+    else:
+        polymer = random_walk(nbeads, sigma, half, rng, start)
+
+    # Proteins are placed uniformly in the box
+    proteins = rng.random((nprots, 3))*box-half
+    types = np.concatenate([np.full(nbeads, dna_type),
+                            np.full(nprots, protein_type)])
+    return types, np.vstack([polymer, proteins])
+
+
+class CellGrid:
+    # Spatial hash of bead positions in cubic cells of side min_dist, so that
+    # overlap checks only look at the 27 cells around a point. With a period
+    # (the box lengths) cells and distances wrap around the periodic box
+
+    def __init__(self, min_dist, period=None):
+        self.min_dist = min_dist
+        self.period = None if period is None else [float(p) for p in period]
+        self.ncells = (None if period is None else
+                       [max(int(p//min_dist), 1) for p in self.period])
+        self.cells = {}
+        self.points = {}
+
+    def _cell(self, x):
+        cell = [math.floor(xk/self.min_dist) for xk in x]
+        if self.ncells is not None:
+            cell = [c % n for c, n in zip(cell, self.ncells)]
+        return tuple(cell)
+
+    def add(self, index, x):
+        x = tuple(float(xk) for xk in x)
+        self.cells.setdefault(self._cell(x), []).append(index)
+        self.points[index] = x
+
+    def remove(self, index):
+        self.cells[self._cell(self.points[index])].remove(index)
+        del self.points[index]
+
+    def overlaps(self, x, exclude=None):
+        # Whether any stored point other than exclude is within min_dist of x
+        x = tuple(float(xk) for xk in x)
+        cx, cy, cz = self._cell(x)
+        min_dist2 = self.min_dist*self.min_dist
+        for dx, dy, dz in _NEIGHBOURS:
+            cell = (cx+dx, cy+dy, cz+dz)
+            if self.ncells is not None:
+                cell = tuple(c % n for c, n in zip(cell, self.ncells))
+            for j in self.cells.get(cell, ()):
+                if j == exclude:
+                    continue
+                d2 = 0.0
+                for k, yk in enumerate(self.points[j]):
+                    d = yk-x[k]
+                    if self.period is not None:
+                        d -= self.period[k]*round(d/self.period[k])
+                    d2 += d*d
+                if d2 < min_dist2:
+                    return True
+        return False
+
+
+def bond_directions(n, rng, direction=None, l_p=0.0):
+    # n random unit vectors. If the previous bond direction is given, the
+    # angle psi to it follows the Boltzmann distribution of the LAMMPS
+    # cosine angle potential E = l_p*(1+cos(theta)) = l_p*(1-cos(psi)), so
+    # the chain starts out with the target persistence length
+    r = rng.random((n, 2))
+    if direction is None or l_p <= 0.0:
+        cospsi = 1.0-2.0*r[:, 0]
+    else:
+        # Inverse CDF of p(cos psi) ~ exp(l_p*cos psi) on [-1, 1]
+        cospsi = 1.0+np.log1p(r[:, 0]*np.expm1(-2.0*l_p))/l_p
+    sinpsi = np.sqrt(np.maximum(1.0-cospsi*cospsi, 0.0))
+    phi = 2.0*np.pi*r[:, 1]
+    local = np.column_stack([sinpsi*np.cos(phi), sinpsi*np.sin(phi), cospsi])
+    if direction is None:
+        return local
+    # Rotate from the z axis onto the previous bond direction
+    w = direction/math.sqrt(direction@direction)
+    # Any unit vector u perpendicular to w, then v = w x u
+    u = np.array([1.0, 0.0, 0.0]) if abs(w[0]) < 0.9 else np.array(
+        [0.0, 1.0, 0.0])
+    u -= (u@w)*w
+    u /= math.sqrt(u@u)
+    v = np.array([w[1]*u[2]-w[2]*u[1], w[2]*u[0]-w[0]*u[2],
+                  w[0]*u[1]-w[1]*u[0]])
+    return local@np.vstack([u, v, w])
+
+
+def self_avoiding_walk(nbeads, sigma, half, rng, start=(0.0, 0.0, 0.0),
+                       l_p=0.0, min_dist=None, n_trials=32, backtrack=5,
+                       max_restarts=10000, grid=None):
+    # (nbeads,3) positions of a self-avoiding walk inside the box: no two
+    # non-bonded beads are closer than min_dist (sigma by default). If no
+    # trial position fits, the last few beads are removed and regrown
+    min_dist = sigma if min_dist is None else min_dist
+    if grid is None:
+        grid = CellGrid(min_dist, period=2.0*np.asarray(half))
+    coords = np.empty((nbeads, 3))
+    coords[0] = start
+    grid.add(0, coords[0])
+    i, restarts = 1, 0
+    while i < nbeads:
+        direction = coords[i-1]-coords[i-2] if i >= 2 else None
+        trials = coords[i-1]+sigma*bond_directions(n_trials, rng, direction,
+                                                   l_p)
+        for x in trials[~out_of_box(trials, half)]:
+            if not grid.overlaps(x, exclude=i-1):
+                coords[i] = x
+                grid.add(i, x)
+                i += 1
+                break
+        else:
+            restarts += 1
+            if restarts > max_restarts:
+                raise RuntimeError("Could not grow a self-avoiding chain, "
+                                   "the box is too crowded")
+            for j in range(max(i-backtrack, 1), i):
+                grid.remove(j)
+            i = max(i-backtrack, 1)
+    return coords
+
+
+def place_proteins(nprots, box, grid, rng, first_index, max_tries=1000000):
+    # Uniform positions in the periodic box that do not overlap any bead in
+    # the grid or each other
+    box = np.asarray(box, dtype=np.float64)
+    proteins = np.empty((nprots, 3))
+    n, tries = 0, 0
+    while n < nprots:
+        for x in rng.random((2*(nprots-n), 3))*box-box/2.0:
+            tries += 1
+            if not grid.overlaps(x):
+                proteins[n] = x
+                grid.add(first_index+n, x)
+                n += 1
+                if n == nprots:
+                    break
+        if tries > max_tries:
+            raise RuntimeError("Could not place the proteins without overlap")
+    return proteins
+
+
+def create_self_avoiding(nbeads, nprots, sigma, box, seed=None,
+                         start=(0.0, 0.0, 0.0), l_p=0.0, min_dist=None,
+                         rng=None):
+    # Like create_polymer, but the chain is self-avoiding with the bending
+    # statistics of persistence length l_p, and the proteins do not overlap
+    # the chain or each other
+    box = np.asarray(box, dtype=np.float64)
+    half = box/2.0
+    if out_of_box(np.asarray(start, dtype=np.float64), half):
+        raise ValueError("The initial point must be within the simulation box")
+    if rng is None:
+        rng = np.random.default_rng(seed)
+    min_dist = sigma if min_dist is None else min_dist
+
+    grid = CellGrid(min_dist, period=box)
+    polymer = self_avoiding_walk(nbeads, sigma, half, rng, start, l_p,
+                                 min_dist, grid=grid)
+    proteins = place_proteins(nprots, box, grid, rng, nbeads)
+    types = np.concatenate([np.full(nbeads, dna_type),
+                            np.full(nprots, protein_type)])
+    return types, np.vstack([polymer, proteins])
+
+
+def write_config(out_file, types, coords):
+    # Write "index type x y z" lines in one go
+    data = np.column_stack([np.arange(1, len(types)+1), types, coords])
+    with open(out_file,'w') as writer:
+        writer.write(("%d %d %f %f %f\n"*len(data)) % tuple(data.ravel()))
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        usage="create_dna_protein.py nbeads nprots sigma lx ly lz seed "
+              "out_file [x0 y0 z0] [--legacy]")
+    parser.add_argument("nbeads", type=int, help="Number of polymer beads")
+    parser.add_argument("nprots", type=int, help="Number of protein beads")
+    parser.add_argument("sigma", type=float,
+                        help="The bond length between beads (or bead size)")
+    parser.add_argument("lx", type=float, help="Box size in x")
+    parser.add_argument("ly", type=float, help="Box size in y")
+    parser.add_argument("lz", type=float, help="Box size in z")
+    parser.add_argument("seed", type=int, help="Seed for the random generator")
+    parser.add_argument("out_file", help="Name of the output file")
+    parser.add_argument("start", type=float, nargs="*",
+                        help="Position of the first polymer bead")
+    parser.add_argument("--legacy", action="store_true",
+                        help="Use the original bead-by-bead loop")
+    parser.add_argument("--self-avoiding", action="store_true",
+                        help="Grow a self-avoiding chain and place proteins "
+                             "without overlap")
+    parser.add_argument("--lp", type=float, default=0.0,
+                        help="Persistence length of the self-avoiding chain")
+    args = parser.parse_args()
+
+    if len(args.start) not in (0, 3):
+        parser.print_usage()
+        sys.exit(1)
+    start = tuple(args.start) if args.start else (0.0, 0.0, 0.0)
+    box = (args.lx, args.ly, args.lz)
+
+    try:
+        if args.self_avoiding:
+            types, coords = create_self_avoiding(
+                args.nbeads, args.nprots, args.sigma, box, args.seed, start,
+                args.lp)
+        else:
+            types, coords = create_polymer(
+                args.nbeads, args.nprots, args.sigma, box, args.seed, start,
+                legacy=args.legacy)
+    except (ValueError, RuntimeError) as e:
+        print(f"Error: {e}")
+        sys.exit(1)
+    write_config(args.out_file, types, coords)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,290 @@
+#!/usr/bin/env python3
+# dwell_times.py
+# Dwell-time and bursting statistics of the TU on/off binding matrices.
+#
+# phi only keeps the fraction of frames each TU is bound. Here every row of
+# the on/off matrix is run-length encoded to get the bound and unbound dwell
+# times (in frames), and bound episodes separated by unbound gaps of at most
+# max_gap frames are joined into bursts (max_gap = 0: every bound episode is
+# a burst). Per TU this gives the number of binding events and bursts, the
+# burst frequency (bursts per frame) and the mean dwell times and burst size
+# (bound frames per burst); per run it gives the histograms of the dwell
+# times and burst sizes.
+#
+# The run-length encoding is done for all TUs of a chunk of rows at once on
+# the flattened matrix (run starts are where a value differs from its left
+# neighbour or a row begins), and per-TU sums are bincounts over the row
+# index, so there are no Python loops over TUs or frames. The matrix is read
+# from the bit-packed (and memory-mapped) .npz store and unpacked a chunk of
+# rows at a time. Runs touching the first or last frame are censored: they
+# count as events but are left out of the dwell-time means and histograms.
+#
+# parseTraj.save_run_outputs writes the per-TU table
+# (TF_dwell_Np_{Np}_run_{run}.csv) and the histograms
+# (TF_dwell_hist_Np_{Np}_run_{run}.npz) next to the phi files. This script
+# does the same for every stored matrix of a sweep and collects the run
+# summaries and summed histograms per (l, Np).
+#
+# Usage: dwell_times.py <sweep_dir> [-j N] [--max-gap G]
+#            [-o dwell_summary.csv] [--force]
+
+import argparse
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+import pandas as pd
+
+from onoff_store import find_onoff_files, load_onoff, run_key
+
+CHUNK_ELEMENTS = 1 << 24  # Matrix entries unpacked at a time
+PER_TU_COLUMNS = ["phi", "n_bound_events", "n_bursts", "burst_frequency",
+                  "mean_bound_dwell", "mean_unbound_dwell", "mean_burst_size"]
+HISTOGRAMS = ["bound", "unbound", "burst"]
+
+
+def dwell_filename(np_value, run_value, hist=False):
+    if hist:
+        return f"TF_dwell_hist_Np_{np_value}_run_{run_value}.npz"
+    return f"TF_dwell_Np_{np_value}_run_{run_value}.csv"
+
+
+def run_lengths(states):
+    # Run-length encoding of every row of an (R, F) 0/1 array. Returns
+    # (rows, starts, lengths, values) of all runs in row-major order
+    n_rows, n_frames = states.shape
+    change = np.ones(states.shape, dtype=bool)
+    np.not_equal(states[:, 1:], states[:, :-1], out=change[:, 1:])
+    idx = np.flatnonzero(change)
+    # A row always starts a new run, so each run ends where the next begins
+    lengths = np.diff(np.append(idx, n_rows * n_frames))
+    rows, starts = np.divmod(idx, n_frames)
+    return rows, starts, lengths, states.ravel()[idx]
+
+
+def _mean(total, count):
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return total / count
+
+
+def _chunk_stats(states, max_gap):
+    # Per-row statistics and histograms of an (R, F) chunk of the matrix
+    n_rows, n_frames = states.shape
+    rows, starts, lengths, values = run_lengths(states)
+    bound = values == 1
+    censored = (starts == 0) | (starts + lengths == n_frames)
+    complete_bound = bound & ~censored
+    complete_unbound = ~bound & ~censored
+
+    # Bursts: a bound run starts a new burst unless the run before it is an
+    # unbound gap short enough to bridge (gaps are interior runs, so that run
+    # is in the same row)
+    bridge = complete_unbound & (lengths <= max_gap)
+    new_burst = bound.copy()
+    new_burst[1:] &= ~bridge[:-1]
+    burst_id = np.cumsum(new_burst)[bound] - 1
+    n_bursts_total = int(new_burst.sum())
+    burst_size = np.bincount(burst_id, lengths[bound], n_bursts_total)
+    burst_censored = np.bincount(burst_id, censored[bound],
+                                 n_bursts_total) > 0
+    burst_rows = rows[new_burst]
+
+    def per_row(mask, weights=None):
+        return np.bincount(rows[mask], None if weights is None
+                           else weights[mask], n_rows)
+
+    n_bursts = np.bincount(burst_rows, minlength=n_rows)
+    stats = {
+        "phi": per_row(bound, lengths) / n_frames,
+        "n_bound_events": per_row(bound),
+        "n_bursts": n_bursts,
+        "burst_frequency": n_bursts / n_frames,
+        "mean_bound_dwell": _mean(per_row(complete_bound, lengths),
+                                  per_row(complete_bound)),
+        "mean_unbound_dwell": _mean(per_row(complete_unbound, lengths),
+                                    per_row(complete_unbound)),
+        "mean_burst_size": _mean(
+            np.bincount(burst_rows[~burst_censored],
+                        burst_size[~burst_censored], n_rows),
+            np.bincount(burst_rows[~burst_censored], minlength=n_rows)),
+    }
+    hists = {
+        "bound": np.bincount(lengths[complete_bound], minlength=n_frames + 1),
+        "unbound": np.bincount(lengths[complete_unbound],
+                               minlength=n_frames + 1),
+        "burst": np.bincount(burst_size[~burst_censored].astype(np.int64),
+                             minlength=n_frames + 1),
+    }
+    return stats, hists
+
+
+def dwell_stats(bits, n_frames, max_gap=0):
+    # Dwell and burst statistics of a bit-packed (N_TU, ceil(F/8)) matrix
+    # (e.g. OnOff.bits, possibly memory-mapped). Returns ({column: (N_TU,)
+    # array}, {histogram: (F+1,) counts indexed by length in frames})
+    rows_per_chunk = max(1, CHUNK_ELEMENTS // max(n_frames, 1))
+    parts = []
+    hists = {name: np.zeros(n_frames + 1, dtype=np.int64)
+             for name in HISTOGRAMS}
+    for r0 in range(0, len(bits), rows_per_chunk):
+        states = np.unpackbits(bits[r0:r0 + rows_per_chunk], axis=1,
+                               count=n_frames)
+        stats, chunk_hists = _chunk_stats(states, max_gap)
+        parts.append(stats)
+        for name in HISTOGRAMS:
+            hists[name] += chunk_hists[name]
+    stats = {column: np.concatenate([p[column] for p in parts])
+             if parts else np.zeros(0) for column in PER_TU_COLUMNS}
+    return stats, hists
+
+
+def matrix_dwell_stats(matrix, max_gap=0):
+    # dwell_stats of an unpacked (N_TU, F) 0/1 matrix
+    matrix = np.asarray(matrix, dtype=bool)
+    return dwell_stats(np.packbits(matrix, axis=1), matrix.shape[1], max_gap)
+
+
+def hist_mean(counts):
+    lengths = np.arange(len(counts))
+    return float(_mean(np.dot(lengths, counts), np.sum(counts)))
+
+
+def _hist_var(counts):
+    lengths = np.arange(len(counts))
+    n = float(np.sum(counts))
+    if n == 0:
+        return np.nan
+    mean = np.dot(lengths, counts) / n
+    return float(np.dot((lengths - mean) ** 2, counts) / n)
+
+
+def run_summary(stats, hists):
+    # Run-level means: per-TU averages and dwell/burst means over all events
+    return {"phi_mean": float(np.mean(stats["phi"])),
+            "phi_std": float(np.std(stats["phi"])),
+            "burst_frequency": float(np.mean(stats["burst_frequency"])),
+            "bursts_per_tu": float(np.mean(stats["n_bursts"])),
+            "mean_bound_dwell": hist_mean(hists["bound"]),
+            "mean_unbound_dwell": hist_mean(hists["unbound"]),
+            "mean_burst_size": hist_mean(hists["burst"]),
+            "burst_size_cv": float(_mean(np.sqrt(_hist_var(hists["burst"])),
+                                         hist_mean(hists["burst"])))}
+
+
+def save_dwell_outputs(tu_ids, stats, hists, np_value, run_value, out_dir,
+                       key=(-1, -1, -1), max_gap=0):
+    # Write the per-TU table and the histograms of one run
+    os.makedirs(out_dir, exist_ok=True)
+    table_file = os.path.join(out_dir, dwell_filename(np_value, run_value))
+    table = pd.DataFrame({"TU": np.asarray(tu_ids), **stats})
+    table.to_csv(table_file, index=False)
+    hist_file = os.path.join(out_dir,
+                             dwell_filename(np_value, run_value, hist=True))
+    np.savez(hist_file, max_gap=np.int64(max_gap),
+             key=np.array([-1 if k is None else k for k in key],
+                          dtype=np.int64),
+             **{name: hists[name] for name in HISTOGRAMS})
+    return [table_file, hist_file]
+
+
+def process_onoff(on_off_file, out_dir, max_gap=0, force=False):
+    # Worker: dwell outputs of one stored matrix (skipped if newer than the
+    # matrix). Returns (key, summary, histograms)
+    onoff = load_onoff(on_off_file)
+    key = run_key(on_off_file, onoff)
+    _, np_value, run_value = key
+    hist_file = os.path.join(out_dir,
+                             dwell_filename(np_value, run_value, hist=True))
+    table_file = os.path.join(out_dir, dwell_filename(np_value, run_value))
+    up_to_date = (not force and os.path.exists(hist_file)
+                  and os.path.exists(table_file)
+                  and os.path.getmtime(hist_file) >= os.path.getmtime(on_off_file))
+    if up_to_date:
+        with np.load(hist_file) as data:
+            up_to_date = int(data["max_gap"]) == max_gap
+            hists = {name: data[name] for name in HISTOGRAMS}
+        stats = pd.read_csv(table_file)
+    if not up_to_date:
+        stats, hists = dwell_stats(onoff.bits, onoff.n_frames, max_gap)
+        save_dwell_outputs(onoff.tu_ids, stats, hists, np_value, run_value,
+                           out_dir, key, max_gap)
+    return key, run_summary({c: np.asarray(stats[c]) for c in PER_TU_COLUMNS},
+                            hists), hists
+
+
+def sum_histograms(hists_by_key):
+    # Long table (l, Np, kind, length, count) of the histograms summed over
+    # the runs of each (l, Np)
+    totals = {}
+    for (l_val, np_value, _), hists in hists_by_key.items():
+        for name in HISTOGRAMS:
+            counts = hists[name]
+            old = totals.get((l_val, np_value, name))
+            if old is not None and len(old) != len(counts):
+                size = max(len(old), len(counts))
+                old = np.pad(old, (0, size - len(old)))
+                counts = np.pad(counts, (0, size - len(counts)))
+            totals[(l_val, np_value, name)] = counts if old is None \
+                else old + counts
+    frames = []
+    for (l_val, np_value, name), counts in sorted(totals.items()):
+        lengths = np.flatnonzero(counts)
+        frames.append(pd.DataFrame({"l": l_val, "Np": np_value, "kind": name,
+                                    "length": lengths,
+                                    "count": counts[lengths]}))
+    if not frames:
+        return pd.DataFrame(columns=["l", "Np", "kind", "length", "count"])
+    return pd.concat(frames, ignore_index=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Dwell-time and burst statistics of a sweep")
+    parser.add_argument("sweep_dir", nargs="?", default=".",
+                        help="Directory searched for TF_On_Off_Matrices")
+    parser.add_argument("-j", "--workers", type=int, default=os.cpu_count(),
+                        help="Number of worker processes")
+    parser.add_argument("--max-gap", type=int, default=0,
+                        help="Join bound episodes separated by at most this "
+                             "many unbound frames into one burst")
+    parser.add_argument("-o", "--out", default="dwell_summary.csv",
+                        help="Run summaries (one row per run)")
+    parser.add_argument("--hist-out", default="dwell_distributions.csv",
+                        help="Histograms summed over the runs of each (l, Np)")
+    parser.add_argument("--force", action="store_true",
+                        help="Recompute runs whose outputs are up to date")
+    args = parser.parse_args()
+
+    files = find_onoff_files(args.sweep_dir)
+    if not files:
+        print(f"No on/off matrices found under {args.sweep_dir}")
+        return
+    print(f"Found {len(files)} runs")
+
+    records, hists_by_key = [], {}
+    with ProcessPoolExecutor(max_workers=args.workers) as pool:
+        futures = {pool.submit(process_onoff, path,
+                               os.path.join(os.path.dirname(os.path.dirname(path)),
+                                            "TF_Phi_Values"),
+                               args.max_gap, args.force): path
+                   for path in files}
+        for done, future in enumerate(as_completed(futures), 1):
+            name = os.path.basename(futures[future])
+            try:
+                key, summary, hists = future.result()
+            except Exception as e:
+                print(f"[{done}/{len(files)}] FAILED {name}: {e}")
+                continue
+            records.append({"l": key[0], "Np": key[1], "run": key[2],
+                            **summary})
+            hists_by_key[key] = hists
+            print(f"[{done}/{len(files)}] ok {name}")
+
+    summary = pd.DataFrame(records).sort_values(["l", "Np", "run"])
+    summary.to_csv(args.out, index=False)
+    sum_histograms(hists_by_key).to_csv(args.hist_out, index=False)
+    print(f"✓ Saved {args.out} ({len(summary)} runs) and {args.hist_out}")
+
+
+if __name__ == "__main__":
+    main()
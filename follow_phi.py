@@ -0,0 +1,159 @@
+#!/usr/bin/env python3
+# follow_phi.py
+# Compute phi while LAMMPS is still writing pos_*.lammpstrj.
+#
+# The dump is followed like "tail -f": every complete frame that appears is
+# run through the binding kernel (binding.py) and added to a running
+# BindingAccumulator (online_stats.py), while a partially written final frame is simply retried on
+# the next poll. A checkpoint of the running phi vector is written
+# periodically, and one line per checkpoint is appended to a convergence CSV,
+# so phi can be watched converging during the run. Following stops once the
+# run's .restart file appears (written by LAMMPS at the very end, see
+# lammps_init.sh) or after the dump has not grown for --idle-timeout seconds.
+# A done file older than the follower is left over from an earlier run and
+# ignored. LAMMPS only creates the dump after the equilibration runs, so the
+# wait for it has its own --startup-timeout, unlimited by default.
+#
+# Usage: follow_phi.py pos_noise_..._run_1.lammpstrj [options]
+
+import argparse
+import json
+import os
+import re
+import time
+
+from binding import BINDING_THRESHOLD, binding_blocks
+from online_stats import BindingAccumulator
+from traj_reader import open_traj, read_frame
+
+
+def default_done_file(traj_path):
+    # pos_<name>.lammpstrj -> <name>.restart in the same directory
+    name = re.sub(r"^pos_", "", os.path.basename(traj_path))
+    name = re.sub(r"\.lammpstrj$", "", name)
+    return os.path.join(os.path.dirname(traj_path), name + ".restart")
+
+
+def read_new_frames(f, pos):
+    # Read all complete frames after byte offset pos. Returns the frames and
+    # the offset just past the last complete one
+    frames = []
+    while True:
+        f.seek(pos)
+        frame = read_frame(f)
+        if frame is None:
+            return frames, pos
+        frames.append(frame)
+        pos = f.tell()
+
+
+def write_checkpoint(out_file, csv_file, acc, last_timestep):
+    phi, n_frames, tu_ids = acc.phi(), acc.n, acc.tu_ids
+    state = {"n_frames": n_frames, "last_timestep": int(last_timestep),
+             "phi_mean": float(phi.mean()), "phi_std": float(phi.std()),
+             "phi": dict(zip(tu_ids.tolist(), phi.tolist()))}
+    tmp_file = out_file + ".tmp"
+    with open(tmp_file, 'w') as f:
+        json.dump(state, f, indent=4)
+    os.replace(tmp_file, out_file)
+
+    new_csv = not os.path.exists(csv_file)
+    with open(csv_file, 'a') as f:
+        if new_csv:
+            f.write("timestep,n_frames,phi_mean,phi_std\n")
+        f.write(f"{last_timestep},{n_frames},{state['phi_mean']},"
+                f"{state['phi_std']}\n")
+    return state
+
+
+def follow(traj_path, out_file, csv_file, done_file,
+           binding_threshold=BINDING_THRESHOLD, poll=5.0,
+           checkpoint_every=60.0, idle_timeout=600.0, startup_timeout=None):
+    # Follow traj_path until done_file is written or it stops growing
+    acc, last_timestep = BindingAccumulator(track_variance=False), None
+    pos, last_checkpoint, checkpointed = 0, 0.0, 0
+    started = time.time()
+    if os.path.exists(csv_file):
+        os.remove(csv_file)  # Starting from the first frame again
+
+    # Wait for LAMMPS to create the dump (after the equilibration runs)
+    while not os.path.exists(traj_path):
+        if (startup_timeout is not None
+                and time.time() - started > startup_timeout):
+            raise FileNotFoundError(traj_path)
+        time.sleep(poll)
+    last_growth = time.time()
+
+    with open_traj(traj_path) as f:
+        while True:
+            # Check before reading so that no frames written just before the
+            # done file are missed
+            finished = (os.path.exists(done_file)
+                        and os.path.getmtime(done_file) >= started)
+            frames, pos = read_new_frames(f, pos)
+
+            if frames:
+                last_growth = time.time()
+                for _, ids, _, bound in binding_blocks(frames,
+                                                       binding_threshold):
+                    acc.update(bound, ids)
+                last_timestep = frames[-1].timestep
+
+            idle = time.time() - last_growth > idle_timeout
+            due = time.time() - last_checkpoint >= checkpoint_every
+            if acc.n != checkpointed and (due or finished or idle):
+                state = write_checkpoint(out_file, csv_file, acc,
+                                         last_timestep)
+                last_checkpoint, checkpointed = time.time(), acc.n
+                print(f"step {last_timestep}: {acc.n} frames, "
+                      f"phi_mean = {state['phi_mean']:.4f}, "
+                      f"phi_std = {state['phi_std']:.4f}", flush=True)
+
+            if finished:
+                print(f"Found {done_file}, done")
+                break
+            if idle:
+                print(f"No new frames for {idle_timeout:.0f}s, stopping")
+                break
+            time.sleep(poll)
+
+    if acc.n == 0:
+        return None
+    return acc.phi()
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Compute running phi statistics from a growing dump")
+    parser.add_argument("traj_file", help="pos_*.lammpstrj being written")
+    parser.add_argument("-o", "--out", default=None,
+                        help="Checkpoint JSON (default: <dump>.phi.json)")
+    parser.add_argument("--done-file", default=None,
+                        help="Stop when this file exists (default: the "
+                             "run's .restart file)")
+    parser.add_argument("--threshold", type=float, default=BINDING_THRESHOLD,
+                        help="Binding threshold")
+    parser.add_argument("--poll", type=float, default=5.0,
+                        help="Seconds between checks for new frames")
+    parser.add_argument("--checkpoint-every", type=float, default=60.0,
+                        help="Seconds between checkpoints")
+    parser.add_argument("--idle-timeout", type=float, default=600.0,
+                        help="Stop if the dump has not grown for this long")
+    parser.add_argument("--startup-timeout", type=float, default=None,
+                        help="Give up if the dump does not appear within "
+                             "this many seconds (default: wait indefinitely)")
+    args = parser.parse_args()
+
+    out_file = args.out or re.sub(r"\.lammpstrj$", "",
+                                  args.traj_file) + ".phi.json"
+    csv_file = re.sub(r"\.json$", "", out_file) + "_convergence.csv"
+    done_file = args.done_file or default_done_file(args.traj_file)
+
+    follow(args.traj_file, out_file, csv_file, done_file, args.threshold,
+           args.poll, args.checkpoint_every, args.idle_timeout,
+           args.startup_timeout)
+    print(f"Saved {out_file} and {csv_file}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,27 +1,24 @@
+# Single-run version; render_figures.py draws these figures for every run of a sweep
 import os
-import json
 import numpy as np
 import pandas as pd
 import matplotlib.pyplot as plt
 import seaborn as sns
 
+from onoff_store import load_onoff_matrix, onoff_filename
+
 def plot_run_analysis(on_off_dir, np_value, run_value, output_dir):
     #makes histogram of phis for a given run
 
-    file_name = f"TF_on_off_Matrix_Np_{np_value}_run_{run_value}.json"
-    file_path = os.path.join(on_off_dir, file_name)
-    
-    if not os.path.exists(file_path):
-        print(f"File {file_name} not found in {on_off_dir}")
+    # Load the on/off binding matrix (.npz, or the old JSON format)
+    loaded = load_onoff_matrix(on_off_dir, np_value, run_value)
+    if loaded is None:
+        print(f"File {onoff_filename(np_value, run_value)} not found in {on_off_dir}")
         return
-    
-    # Load the on/off binding matrix
-    with open(file_path, 'r') as f:
-        on_off_matrix = json.load(f)
+    tu_ids, matrix = loaded
     
     #use df to simplify process
-    df = pd.DataFrame.from_dict(on_off_matrix, orient='index')
-    df = df.sort_index()
+    df = pd.DataFrame(matrix, index=tu_ids)
     
     #Compute Phis
     phi_values = df.mean(axis=1)
@@ -1,3 +1,4 @@
+# Single-run version; render_figures.py draws these figures for every run of a sweep
 import os
 import json
 import sys
@@ -6,24 +7,23 @@ import numpy as np
 import matplotlib.pyplot as plt
 import seaborn as sns
 
+from onoff_store import load_onoff_matrix, onoff_filename
+
 def plot_run_analysis(on_off_dir, phi_dir, np_value, run_value, output_dir):
     """Generates a histogram of Phi values and a heatmap for a specific run."""
     
     # Construct file paths
-    on_off_file = os.path.join(on_off_dir, f"TF_on_off_Matrix_Np_{np_value}_run_{run_value}.json")
     phi_file = os.path.join(phi_dir, f"TF_phis_Np_{np_value}_run_{run_value}.json")
 
-    # Ensure files exist
-    if not os.path.exists(on_off_file):
-        print(f"[ERROR] On/Off matrix file {on_off_file} not found in {on_off_dir}")
+    # Load the on/off binding matrix (.npz, or the old JSON format)
+    loaded = load_onoff_matrix(on_off_dir, np_value, run_value)
+    if loaded is None:
+        print(f"[ERROR] On/Off matrix file {onoff_filename(np_value, run_value)} not found in {on_off_dir}")
         return
-
-    # Load the on/off binding matrix
-    with open(on_off_file, 'r') as f:
-        on_off_matrix = json.load(f)
+    tu_ids, matrix = loaded
 
     # Convert to DataFrame
-    df = pd.DataFrame.from_dict(on_off_matrix, orient='index').sort_index()
+    df = pd.DataFrame(matrix, index=tu_ids)
 
     # Try to load Phi values from JSON, otherwise compute from matrix
     if os.path.exists(phi_file):
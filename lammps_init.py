@@ -0,0 +1,510 @@
+#!/usr/bin/env python3
+# lammps_init.py
+# Generate the LAMMPS script and init config file, as lammps_init.sh does,
+# but for a whole parameter grid in a single process.
+#
+# For every (nsites, sep, nprots, run) this writes the same files as
+# lammps_init.sh into out_dir/noise_Ns_{}_l_{}_Np_{}_run_{}/:
+#   <name>.in          LAMMPS data file (polymer and protein beads, bonds)
+#   <name>.lam         LAMMPS driver script
+#   seed_<name>.dat    the random seeds used
+#   run_<name>.sh      script that runs LAMMPS
+# The seeds are drawn the same way and in the same order, the polymer comes
+# from createPolymer.create_polymer and every number is formatted as in the
+# shell script, so for the same seeds the files are byte-for-byte identical.
+# With --reuse-seeds the seeds of an existing seed file are used again, which
+# regenerates the inputs of an existing run exactly.
+#
+# With --init relaxed the chain is instead a pre-relaxed self-avoiding walk
+# with the target persistence length (or, with --library, an equilibrated
+# conformation from conformation_library.py) and the proteins are placed
+# without overlap. LAMMPS then gives all beads fresh velocities from an extra
+# seed, and the equilibration can be shortened with --equil-time1 and
+# --equil-time2. The default (--init random) is unchanged.
+#
+# Usage: lammps_init.py nsites out_dir --sep 10 20 --np 10 20 --runs 1 2 3
+
+import argparse
+import os
+import sys
+
+import numpy as np
+
+from conformation_library import draw_conformation
+from createPolymer import (CellGrid, create_polymer, create_self_avoiding,
+                           place_proteins)
+
+LMP_EXE = "/usr/bin/lmp"  # Path to LAMMPS executable
+
+# Simulation parameters, as set in lammps_init.sh
+BOX_SIZE = 100.0  # Simulation box size
+SIGMA = 1.0  # Bead size
+DUMP_SCREEN = True  # Whether to dump the screen output to file (*.slog)
+
+# Default cutoff distance
+RC_0 = 1.122462048309373
+
+# LJ potential
+RC = 1.8
+ELOW = 3.0
+EHIGH = 7.0
+
+# FENE bond
+K_F = 30.0
+R_0 = 1.6
+
+# Angle bond
+L_P = 3.0  # Persistence length
+
+# Simulation run times (in simulation time unit)
+DT = 0.01  # Size of each timestep
+RUN_INIT_TIME_1 = 100  # Equilibration with harmonic bonds
+RUN_INIT_TIME_2 = 10000  # Equilibration with FENE bonds
+RUN_LOOP_TIME = 100  # Run time between protein switching events
+SWITCH_TIME = 100000  # Protein switching time
+NLOOPS = 1100  # Number of protein switching events
+
+# Dump frequencies (in simulation time unit)
+DUMP_EQUIL_PRINTFREQ = 1000
+THERMO_PRINTFREQ = 1000
+DUMP_PRINTFREQ = 1000
+
+# Seeds in the order they are drawn, with their labels in the seed file
+SEED_LABELS = [("init_poly", "Init polymer seed"),
+               ("langevin_equil", "Langevin equil seed"),
+               ("langevin_main", "Langevin main seed"),
+               ("switch_on", "Protein switch on seed"),
+               ("switch_off", "Protein switch off seed")]
+# Only used with relaxed initial configurations
+VELOCITY_SEED = ("velocity", "Velocity seed")
+
+
+def run_name(nsites, sep, nprots, run):
+    return f"noise_Ns_{nsites}_l_{sep}_Np_{nprots}_run_{run}"
+
+
+# Rescale epsilon such that the minimum of the truncated and shifted LJ
+# potential actually reaches -epsilon
+def rescale_energy(e, rc, s):
+    norm = 1.0+4.0*((s/rc)**12.0-(s/rc)**6.0)
+    return e/norm if norm > 0.0 else e
+
+
+# Convert from simulation time unit to timesteps
+def get_timestep(tau, dt):
+    return int(tau/dt)
+
+
+# Generate random seeds
+def get_rand():
+    # A 4-byte random integer from urandom, keeping only the leftmost 29 bits
+    # so that the seed is positive and small enough for LAMMPS
+    return (int.from_bytes(os.urandom(4), sys.byteorder) >> 3)+1
+
+
+def new_seeds(init="random"):
+    seeds = {key: get_rand() for key, _ in SEED_LABELS}
+    if init == "relaxed":
+        seeds[VELOCITY_SEED[0]] = get_rand()
+    return seeds
+
+
+def read_seeds(seed_file):
+    # Seeds from an existing seed_<name>.dat file
+    labels = {label: key for key, label in SEED_LABELS+[VELOCITY_SEED]}
+    seeds = {}
+    with open(seed_file, 'r') as f:
+        for line in f:
+            label, _, value = line.partition(" = ")
+            if label in labels:
+                seeds[labels[label]] = int(value)
+    if any(key not in seeds for key, _ in SEED_LABELS):
+        raise ValueError(f"Incomplete seed file {seed_file}")
+    return seeds
+
+
+def n_on_proteins(nprots, seed):
+    # Use a random generator to decide how to split the proteins into the ON
+    # and OFF groups if the number of proteins is not an even number
+    rng = np.random.default_rng(seed)
+    if nprots % 2 == 1:
+        if rng.random() < 0.5:
+            return int(np.ceil(nprots/2))
+        return int(np.floor(nprots/2))
+    return int(nprots/2)
+
+
+def relaxed_config(npolys, nprots, seed, library_dir=None):
+    # Self-avoiding chain with persistence length L_P, or a conformation
+    # from the library if it has one, and non-overlapping proteins. Returns
+    # wrapped coordinates and image flags
+    box = (BOX_SIZE, BOX_SIZE, BOX_SIZE)
+    rng = np.random.default_rng(seed)
+    placed = None
+    if library_dir is not None:
+        placed = draw_conformation(library_dir, npolys, L_P, BOX_SIZE, rng)
+    if placed is None:
+        _, coords = create_self_avoiding(npolys, nprots, SIGMA, box,
+                                         rng=rng, l_p=L_P)
+        return coords, np.zeros((len(coords), 3), dtype=np.int64)
+
+    polymer, images = placed
+    grid = CellGrid(SIGMA, period=box)
+    for i, x in enumerate(polymer):
+        grid.add(i, x)
+    proteins = place_proteins(nprots, box, grid, rng, npolys)
+    return (np.vstack([polymer, proteins]),
+            np.vstack([images, np.zeros((nprots, 3), dtype=np.int64)]))
+
+
+def data_file(nsites, sep, nprots, seed, init="random", library_dir=None):
+    # Contents of the LAMMPS data file (<name>.in)
+    npolys = sep*(nsites+1)-1
+    nbonds = npolys-1
+    nangles = npolys-2
+    nbeads = npolys+nprots
+    lo, hi = -int(BOX_SIZE/2.0), int(BOX_SIZE/2.0)
+
+    if init == "relaxed":
+        coords, images = relaxed_config(npolys, nprots, seed, library_dir)
+    else:
+        _, coords = create_polymer(npolys, nprots, SIGMA,
+                                   (BOX_SIZE, BOX_SIZE, BOX_SIZE), seed)
+        images = np.zeros((nbeads, 3), dtype=np.int64)
+
+    # Bead types: TUs every sep beads along the chain, then the ON and OFF
+    # proteins
+    index = np.arange(1, nbeads+1)
+    nn = index-sep
+    btype = np.where((nn >= 0) & (nn % sep == 0), 2, 1)
+    btype[npolys:] = 4
+    btype[npolys:npolys+n_on_proteins(nprots, seed)] = 3
+
+    header = f"""LAMMPS data file via
+
+{nbeads} atoms
+4 atom types
+{nbonds} bonds
+1 bond types
+{nangles} angles
+1 angle types
+
+{lo} {hi} xlo xhi
+{lo} {hi} ylo yhi
+{lo} {hi} zlo zhi
+
+Masses
+
+1 1
+2 1
+3 1
+4 1
+
+Atoms # angle
+
+"""
+    atoms = np.column_stack([index, btype, coords, images])
+    atoms = ("%d 1 %d %f %f %f %d %d %d\n"*nbeads) % tuple(atoms.ravel())
+    i = np.arange(1, npolys)
+    bonds = ("%d 1 %d %d\n"*len(i)) % tuple(np.column_stack(
+        [i, i, i+1]).ravel())
+    i = np.arange(1, nangles+1)
+    angles = ("%d 1 %d %d %d\n"*len(i)) % tuple(np.column_stack(
+        [i, i, i+1, i+2]).ravel())
+    return (header+atoms+"\nBonds\n\n"+bonds+"\nAngles\n\n"+angles)
+
+
+def driver_script(name, seeds, equil_times=(RUN_INIT_TIME_1,
+                                            RUN_INIT_TIME_2)):
+    # Contents of the LAMMPS driver script (<name>.lam)
+    elow = rescale_energy(ELOW, RC, SIGMA)
+    ehigh = rescale_energy(EHIGH, RC, SIGMA)
+    run_init_time_1 = get_timestep(equil_times[0], DT)
+    run_init_time_2 = get_timestep(equil_times[1], DT)
+    run_loop_time = get_timestep(RUN_LOOP_TIME, DT)
+    switch_time = get_timestep(SWITCH_TIME, DT)
+    dump_equil_printfreq = get_timestep(DUMP_EQUIL_PRINTFREQ, DT)
+    dump_printfreq = get_timestep(DUMP_PRINTFREQ, DT)
+    thermo_printfreq = get_timestep(THERMO_PRINTFREQ, DT)
+
+    # Convert protein switching time into a switching probability
+    switch_prob = run_loop_time/float(switch_time)
+
+    # Fresh velocities for a (reused) relaxed starting configuration
+    velocity = ""
+    if VELOCITY_SEED[0] in seeds:
+        velocity = (f"velocity all create 1.0 {seeds[VELOCITY_SEED[0]]} "
+                    f"dist gaussian\n")
+
+    # If in doubt with any of the commands, revisit the LAMMPS tutorials
+    # and/or consult LAMMPS documentation
+    return f"""
+##################################################
+
+# Simulation basic setup
+
+units lj
+atom_style angle
+boundary p p p
+
+neighbor 1.9 bin
+neigh_modify every 1 delay 1 check yes
+
+comm_style tiled
+comm_modify mode single cutoff 4.0 vel yes
+
+read_data {name}.in
+
+##################################################
+
+# Define groups
+# There are four types of beads:
+# 1 = Non-TU chromatin beads
+# 2 = TU chromatin beads
+# 3 = ON protein beads
+# 4 = OFF protein beads
+
+group all type 1 2 3 4
+group poly type 1 2 # Chromatin beads
+group prot type 3 4 # Protein beads
+
+##################################################
+
+# Dumps
+
+compute gyr poly gyration
+thermo {thermo_printfreq}
+thermo_style custom step temp epair c_gyr
+dump 1 all custom {dump_equil_printfreq} pos-equil_{name}.lammpstrj &
+id type xs ys zs ix iy iz
+
+##################################################
+
+# Potentials
+
+bond_style harmonic
+bond_coeff 1 100.0 1.1
+
+angle_style cosine
+angle_coeff 1 10.0 # Stiff fibre to remove overlap
+
+pair_style soft {RC_0}
+pair_coeff * * 100.0 {RC_0}
+
+##################################################
+
+# Set integrator/dynamics
+
+fix 1 all nve
+fix 2 all langevin 1.0 1.0 1.0 {seeds["langevin_equil"]}
+{velocity}
+##################################################
+
+# Initial equilibration
+
+timestep {DT}
+run {run_init_time_1}
+
+##################################################
+
+# Equilibrate with FENE bonds
+
+bond_style fene
+special_bonds fene
+bond_coeff 1 {K_F} {R_0} 1.0 {SIGMA}
+
+angle_coeff 1 {L_P}
+
+pair_style lj/cut {RC_0}
+pair_coeff * * 1.0 {SIGMA} {RC_0}
+
+run {run_init_time_2}
+
+##################################################
+
+# Clear all fixes and dumps before the main simulation
+
+unfix 1
+unfix 2
+undump 1
+
+##################################################
+
+# Main simulation
+
+# Set all pairwise interactions to be purely repulsive except:
+# A weak, non-specific attractive interaction between non-TU beads and proteins
+# A strong, specific attractive interaction between TU beads and proteins
+
+pair_style lj/cut {RC_0}
+pair_coeff * * 1.0 {SIGMA} {RC_0}
+pair_coeff 1 3 {elow} {SIGMA} {RC}
+pair_coeff 2 3 {ehigh} {SIGMA} {RC}
+
+# Reset the integrator/dynamics
+
+fix 1 all nve
+fix 2 all langevin 1.0 1.0 1.0 {seeds["langevin_main"]}
+
+# Dumps
+
+dump 1 all custom {dump_printfreq} pos_{name}.lammpstrj &
+id type xs ys zs ix iy iz
+
+# Reset time and run the main simulation, which is done in a loop. Protein
+# switching (ON <-> OFF) is done between each loop period
+
+reset_timestep 0
+
+variable colourstep loop {NLOOPS}
+label switchloop
+
+run {run_loop_time} post no
+
+# Do protein switching
+
+variable seed_on equal ({seeds["switch_on"]}+${{colourstep}})
+variable seed_off equal ({seeds["switch_off"]}+${{colourstep}})
+
+group prot_on type 3
+group prot_off type 4
+
+set group prot_on type/fraction 4 {switch_prob} ${{seed_off}}
+set group prot_off type/fraction 3 {switch_prob} ${{seed_on}}
+
+group prot_on delete
+group prot_off delete
+
+next colourstep
+
+jump {name}.lam switchloop
+
+##################################################
+
+# Clean up and output end result
+
+unfix 1
+unfix 2
+undump 1
+
+# Output a restart file that stores the full final configuration of the
+# simulation in a binary format, in case we need to run the simulation for
+# longer starting from this configuration
+
+write_restart {name}.restart
+
+# Output the final configuration of the system in a human readable format
+
+write_data {name}.out nocoeff
+
+##################################################
+
+"""
+
+
+def write_inputs(nsites, sep, nprots, run, out_dir, lmp_exe=LMP_EXE,
+                 seeds=None, init="random", library_dir=None,
+                 equil_times=(RUN_INIT_TIME_1, RUN_INIT_TIME_2)):
+    # Write the input files of one simulation. Returns the simulation
+    # directory and the seeds used
+    name = run_name(nsites, sep, nprots, run)
+    sim_dir = os.path.join(out_dir, name)
+    os.makedirs(sim_dir, exist_ok=True)
+    if seeds is None:
+        seeds = new_seeds(init)
+    elif init == "relaxed" and VELOCITY_SEED[0] not in seeds:
+        seeds = dict(seeds, **{VELOCITY_SEED[0]: get_rand()})
+
+    with open(os.path.join(sim_dir, f"seed_{name}.dat"), 'w') as f:
+        for key, label in SEED_LABELS+[VELOCITY_SEED]:
+            if key in seeds:
+                f.write(f"{label} = {seeds[key]}\n")
+
+    with open(os.path.join(sim_dir, f"{name}.in"), 'w') as f:
+        f.write(data_file(nsites, sep, nprots, seeds["init_poly"], init,
+                          library_dir))
+
+    with open(os.path.join(sim_dir, f"{name}.lam"), 'w') as f:
+        f.write(driver_script(name, seeds, equil_times))
+
+    # A bash script that runs LAMMPS directly, so the simulation can be
+    # started with "bash run_<name>.sh"
+    screen_opt = f"{name}.slog" if DUMP_SCREEN else "none"
+    run_sh = os.path.join(sim_dir, f"run_{name}.sh")
+    with open(run_sh, 'w') as f:
+        f.write(f"#!/bin/bash\n{lmp_exe} -in {name}.lam -screen {screen_opt} "
+                f"-log {name}.log\n\n")
+    os.chmod(run_sh, os.stat(run_sh).st_mode | 0o111)
+    return sim_dir, seeds
+
+
+def write_grid(nsites, seps, np_values, runs, out_dir, lmp_exe=LMP_EXE,
+               reuse_seeds=False, **options):
+    # Write the inputs of every (sep, nprots, run) combination
+    sim_dirs = []
+    for sep in seps:
+        for nprots in np_values:
+            for run in runs:
+                seeds = None
+                if reuse_seeds:
+                    name = run_name(nsites, sep, nprots, run)
+                    seed_file = os.path.join(out_dir, name,
+                                             f"seed_{name}.dat")
+                    if os.path.exists(seed_file):
+                        seeds = read_seeds(seed_file)
+                sim_dir, _ = write_inputs(nsites, sep, nprots, run, out_dir,
+                                          lmp_exe, seeds, **options)
+                sim_dirs.append(sim_dir)
+    return sim_dirs
+
+
+def add_init_args(parser):
+    # Options for the initial configuration and equilibration
+    group = parser.add_argument_group("initial configuration")
+    group.add_argument("--init", choices=["random", "relaxed"],
+                       default="random",
+                       help="Phantom random walk (default) or pre-relaxed "
+                            "self-avoiding chain")
+    group.add_argument("--library", default=None,
+                       help="Draw relaxed chains from this conformation "
+                            "library (see conformation_library.py)")
+    group.add_argument("--equil-time1", type=float, default=RUN_INIT_TIME_1,
+                       help="Equilibration time with harmonic bonds (tau)")
+    group.add_argument("--equil-time2", type=float, default=RUN_INIT_TIME_2,
+                       help="Equilibration time with FENE bonds (tau)")
+
+
+def init_options(args):
+    # Keyword arguments for write_inputs from the add_init_args options
+    return {"init": args.init, "library_dir": args.library,
+            "equil_times": (args.equil_time1, args.equil_time2)}
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Generate LAMMPS inputs for a grid of simulations")
+    parser.add_argument("nsites", type=int,
+                        help="Number of transcription units (TUs)")
+    parser.add_argument("out_dir", help="Output directory")
+    parser.add_argument("--sep", type=int, nargs="+", required=True,
+                        help="Linear separations between TUs (in beads)")
+    parser.add_argument("--np", type=int, nargs="+", required=True,
+                        help="Numbers of protein beads")
+    parser.add_argument("--runs", type=int, nargs="+", required=True,
+                        help="Trial numbers")
+    parser.add_argument("--lmp-exe", default=LMP_EXE,
+                        help="LAMMPS executable used in run_*.sh")
+    parser.add_argument("--reuse-seeds", action="store_true",
+                        help="Reuse the seeds of existing seed files")
+    add_init_args(parser)
+    args = parser.parse_args()
+
+    sim_dirs = write_grid(args.nsites, args.sep, args.np, args.runs,
+                          args.out_dir, args.lmp_exe, args.reuse_seeds,
+                          **init_options(args))
+    print(f"Generated inputs for {len(sim_dirs)} simulations in "
+          f"{args.out_dir}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,8 @@
 #!/bin/bash
 # lammps_init.sh
 # A script to generate the LAMMPS script and init config file
+# (lammps_init.py writes identical files for a whole parameter grid in a
+# single process)
 
 # Make sure we are using python3
 pyx=python3
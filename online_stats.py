@@ -0,0 +1,286 @@
+#!/usr/bin/env python3
+# online_stats.py
+# Streaming per-TU statistics of the binding states.
+#
+# BindingAccumulator is fed blocks of (frames, TUs) values from the binding
+# kernel (binding.py) and keeps only O(N_TU) state: the number of frames,
+# the running mean (phi for 0/1 binding states) and, optionally, the running
+# variance (Welford/Chan update) and lagged products for the autocorrelation
+# up to max_lag frames. The full (N_TU, frames) on/off matrix is only kept
+# when keep_matrix=True, so long runs can be analysed on small nodes.
+#
+# DistanceHistogram does the same for the TU-TF distances over time: it keeps
+# a (time bin x distance bin) histogram with a bounded number of time bins,
+# doubling the frames per time bin and merging neighbouring bins whenever the
+# trajectory outgrows them, so its size does not depend on the number of
+# frames. Per-bin quantiles are interpolated from the histogram and the
+# fraction of distances below the binding threshold is counted exactly.
+#
+# ThresholdAccumulator counts, from the same distances, the bound frames of
+# every TU for a whole list of binding thresholds at once, so that phi can be
+# computed for all of them in a single pass over a trajectory.
+
+import numpy as np
+
+from binding import BINDING_THRESHOLD, threshold_counts
+
+
+class BindingAccumulator:
+
+    def __init__(self, max_lag=0, track_variance=True, keep_matrix=False):
+        self.max_lag = max_lag
+        self.track_variance = track_variance
+        self.keep_matrix = keep_matrix
+        self.n = 0
+        self.mean = None
+        self.m2 = None
+        self.tu_ids = None
+        self.timesteps = []
+        self.blocks = []
+        # Sum over t of x[t] * x[t+k] for k = 1..max_lag, plus the last
+        # max_lag frames so that products can span block boundaries
+        self.lag_sums = None
+        self.tail = None
+
+    def update(self, values, tu_ids=None, timesteps=None):
+        # Add a (F, N_TU) block of values (e.g. 0/1 binding states)
+        values = np.asarray(values, dtype=np.float64)
+        nb = len(values)
+        if nb == 0:
+            return
+        if self.mean is None:
+            ntu = values.shape[1]
+            self.mean = np.zeros(ntu)
+            self.m2 = np.zeros(ntu)
+            self.lag_sums = np.zeros((self.max_lag, ntu))
+            self.tail = np.zeros((0, ntu))
+        if tu_ids is not None:
+            self.tu_ids = np.asarray(tu_ids)
+        if timesteps is not None and self.keep_matrix:
+            self.timesteps.append(np.asarray(timesteps))
+
+        # Chan et al. parallel update of mean and sum of squared deviations
+        block_mean = values.mean(axis=0)
+        delta = block_mean - self.mean
+        total = self.n + nb
+        self.mean += delta * nb / total
+        if self.track_variance:
+            block_m2 = ((values - block_mean) ** 2).sum(axis=0)
+            self.m2 += block_m2 + delta ** 2 * self.n * nb / total
+        self.n = total
+
+        if self.max_lag:
+            joined = np.concatenate([self.tail, values])
+            start = len(self.tail)  # Index of the first new frame
+            for k in range(1, self.max_lag + 1):
+                # Pairs (t, t+k) whose later frame is new
+                lo = max(start - k, 0)
+                if lo + k < len(joined):
+                    self.lag_sums[k - 1] += np.einsum(
+                        "ij,ij->j", joined[lo:len(joined) - k],
+                        joined[lo + k:])
+            self.tail = joined[-self.max_lag:]
+
+        if self.keep_matrix:
+            self.blocks.append(values.astype(np.uint8))
+
+    def merge(self, other):
+        # Combine with an accumulator over a different set of frames of the
+        # same TUs (lagged products across the two sets are not added)
+        if other.n == 0:
+            return
+        if self.n == 0:
+            self.__dict__.update({k: (v.copy() if isinstance(v, np.ndarray)
+                                      else v)
+                                  for k, v in other.__dict__.items()})
+            return
+        delta = other.mean - self.mean
+        total = self.n + other.n
+        self.mean += delta * other.n / total
+        self.m2 += other.m2 + delta ** 2 * self.n * other.n / total
+        if self.max_lag:
+            self.lag_sums += other.lag_sums
+        self.n = total
+
+    def phi(self):
+        # Fraction of frames each TU is bound
+        return self.mean.copy()
+
+    def variance(self, ddof=0):
+        if not self.track_variance:
+            raise ValueError("Variance was not tracked")
+        return self.m2 / (self.n - ddof)
+
+    def autocorr(self):
+        # (max_lag, N_TU) normalised autocorrelation for lags 1..max_lag
+        lags = np.arange(1, self.max_lag + 1)[:, None]
+        pairs = np.maximum(self.n - lags, 1)
+        cov = self.lag_sums / pairs - self.mean ** 2
+        with np.errstate(invalid="ignore", divide="ignore"):
+            return cov / self.variance()
+
+    def matrix(self):
+        # The (N_TU, F) on/off matrix, only if keep_matrix was set
+        if not self.keep_matrix:
+            raise ValueError("Matrix was not kept, use keep_matrix=True")
+        if not self.blocks:
+            return np.zeros((0, 0), dtype=np.uint8)
+        return np.concatenate(self.blocks).T
+
+    def all_timesteps(self):
+        if not self.timesteps:
+            return np.zeros(0, dtype=np.int64)
+        return np.concatenate(self.timesteps)
+
+    def summary(self):
+        # phi mean/std across TUs, as in the phi_stats CSVs
+        phi = self.phi()
+        return {"phi_mean": float(phi.mean()), "phi_std": float(phi.std())}
+
+
+class DistanceHistogram:
+
+    def __init__(self, max_distance, n_dist_bins=400, max_time_bins=500,
+                 threshold=BINDING_THRESHOLD):
+        self.dist_edges = np.linspace(0.0, max_distance, n_dist_bins + 1)
+        self.max_time_bins = max_time_bins + max_time_bins % 2  # Even
+        self.threshold = threshold
+        self.frames_per_bin = 1
+        self.n_frames = 0
+        self.last_timestep = None
+        # Per time bin: distance histogram (the last column counts distances
+        # beyond max_distance), distances at or below the threshold, frames
+        # with no ON protein (infinite distances) and the first timestep
+        self.counts = np.zeros((self.max_time_bins, n_dist_bins + 1),
+                               dtype=np.int64)
+        self.below = np.zeros(self.max_time_bins, dtype=np.int64)
+        self.missing = np.zeros(self.max_time_bins, dtype=np.int64)
+        self.start_timesteps = np.zeros(self.max_time_bins, dtype=np.int64)
+
+    def _coarsen(self):
+        # Double the frames per time bin by summing pairs of bins
+        half = self.max_time_bins // 2
+        for name in ("counts", "below", "missing"):
+            values = getattr(self, name)
+            merged = np.zeros_like(values)
+            merged[:half] = values[0:2*half:2] + values[1:2*half:2]
+            setattr(self, name, merged)
+        starts = np.zeros_like(self.start_timesteps)
+        starts[:half] = self.start_timesteps[0:2*half:2]
+        self.start_timesteps = starts
+        self.frames_per_bin *= 2
+
+    def update(self, timesteps, dist):
+        # Add a block of (F,) timesteps and (F, N_TU) distances
+        dist = np.asarray(dist, dtype=np.float64)
+        nb = len(dist)
+        if nb == 0:
+            return
+        frame = self.n_frames + np.arange(nb)
+        while frame[-1] // self.frames_per_bin >= self.max_time_bins:
+            self._coarsen()
+        tbin = frame // self.frames_per_bin
+        first = frame % self.frames_per_bin == 0
+        self.start_timesteps[tbin[first]] = np.asarray(timesteps)[first]
+
+        finite = np.isfinite(dist)
+        n_dist = self.counts.shape[1]
+        dbin = np.searchsorted(self.dist_edges, dist[finite], side="right") - 1
+        dbin = np.minimum(dbin, n_dist - 1)
+        rows = np.broadcast_to(tbin[:, None], dist.shape)[finite]
+        self.counts += np.bincount(rows * n_dist + dbin,
+                                   minlength=self.counts.size).reshape(
+                                       self.counts.shape)
+        self.below += np.bincount(tbin, (dist <= self.threshold).sum(axis=1),
+                                  minlength=self.max_time_bins).astype(np.int64)
+        self.missing += np.bincount(tbin, (~finite).sum(axis=1),
+                                    minlength=self.max_time_bins).astype(
+                                        np.int64)
+        self.n_frames += nb
+        self.last_timestep = int(timesteps[-1])
+
+    @property
+    def n_time_bins(self):
+        return -(-self.n_frames // self.frames_per_bin)
+
+    def time_edges(self):
+        # (T+1,) timestep edges of the filled time bins
+        n = self.n_time_bins
+        return np.append(self.start_timesteps[:n], self.last_timestep)
+
+    def histogram(self):
+        # (T, n_dist_bins) counts of the filled time bins, without overflow
+        return self.counts[:self.n_time_bins, :-1]
+
+    def quantiles(self, qs):
+        # (T, len(qs)) distance quantiles per time bin, linearly interpolated
+        # within distance bins; NaN for bins without finite distances
+        counts = self.counts[:self.n_time_bins]
+        cum = np.cumsum(counts, axis=1)
+        total = cum[:, -1]
+        edges = np.append(self.dist_edges, self.dist_edges[-1])
+        out = np.full((len(counts), len(qs)), np.nan)
+        for t in np.flatnonzero(total):
+            target = np.asarray(qs) * total[t]
+            k = np.minimum(np.searchsorted(cum[t], target, side="left"),
+                           counts.shape[1] - 1)
+            before = np.where(k > 0, cum[t][k - 1], 0)
+            frac = (target - before) / np.maximum(counts[t][k], 1)
+            out[t] = edges[k] + frac * (edges[k + 1] - edges[k])
+        return out
+
+    def fraction_below(self):
+        # Fraction of finite distances at or below the threshold per time bin
+        n = self.n_time_bins
+        finite = self.counts[:n].sum(axis=1)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            return self.below[:n] / finite
+
+    def bin_table(self, qs):
+        # Columns of the per-time-bin table: timestep range, number of
+        # distances, frames without ON protein, quantiles and fraction bound
+        edges = self.time_edges()
+        table = {"timestep_start": edges[:-1], "timestep_end": edges[1:],
+                 "n_distances": self.histogram().sum(axis=1),
+                 "n_no_tf": self.missing[:self.n_time_bins]}
+        for q, values in zip(qs, self.quantiles(qs).T):
+            table[f"q{int(q * 100):02d}"] = values
+        table["fraction_below_threshold"] = self.fraction_below()
+        return table
+
+
+class ThresholdAccumulator:
+
+    def __init__(self, thresholds):
+        self.thresholds = np.sort(np.asarray(thresholds, dtype=np.float64))
+        self.n = 0
+        self.counts = None
+        self.tu_ids = None
+
+    def update(self, dist, tu_ids=None):
+        # Add an (F, N_TU) block of nearest-TF distances
+        dist = np.asarray(dist)
+        if len(dist) == 0:
+            return
+        counts = threshold_counts(dist, self.thresholds)
+        if self.counts is None:
+            self.counts = np.zeros_like(counts)
+        self.counts += counts
+        if tu_ids is not None:
+            self.tu_ids = np.asarray(tu_ids)
+        self.n += len(dist)
+
+    def merge(self, other):
+        # Combine with an accumulator over other frames of the same TUs
+        if other.n == 0:
+            return
+        if self.n == 0:
+            self.counts = other.counts.copy()
+            self.tu_ids = other.tu_ids
+        else:
+            self.counts += other.counts
+        self.n += other.n
+
+    def phi(self):
+        # (K, N_TU) fraction of frames each TU is bound, per threshold
+        return self.counts / self.n
@@ -0,0 +1,189 @@
+#!/usr/bin/env python3
+# onoff_store.py
+# Compact binary storage for the TU on/off binding matrices written by
+# parseTraj.py.
+#
+# Each run is stored as an uncompressed .npz file holding the bit-packed
+# matrix (np.packbits along time, one row per TU) together with the TU ids,
+# the timesteps and the (l, Np, run) key of the run. That is 1 bit per entry
+# rather than ~10 bytes in the old indent=4 JSON files. Because the .npz is
+# uncompressed the packed matrix can be memory-mapped straight from disk.
+#
+# Usage:
+#   onoff_store.py to-json <matrix.npz> [out.json]  # Export the old format
+#   onoff_store.py from-json <matrix.json> [out.npz] # Convert old files
+
+import glob
+import json
+import os
+import re
+import sys
+import zipfile
+from collections import namedtuple
+
+import numpy as np
+
+# A stored on/off matrix
+#   bits      : (N_TU, ceil(F/8)) uint8 array, np.packbits of the matrix
+#   n_frames  : number of frames F
+#   tu_ids    : (N_TU,) int array of TU atom ids
+#   timesteps : (F,) int array of timesteps
+#   key       : (l, Np, run), -1 where unknown
+OnOff = namedtuple("OnOff", ["bits", "n_frames", "tu_ids", "timesteps",
+                             "key"])
+
+# Set bits of every byte value, and the packed bytes counted at a time
+POPCOUNT = np.unpackbits(np.arange(256, dtype=np.uint8)[:, None],
+                         axis=1).sum(axis=1).astype(np.uint8)
+COUNT_CHUNK_BYTES = 1 << 24
+
+
+def onoff_filename(np_value, run_value, ext=".npz"):
+    return f"TF_on_off_Matrix_Np_{np_value}_run_{run_value}{ext}"
+
+
+def find_onoff_files(root):
+    # All stored .npz matrices under root (e.g. a sweep's runSep*/
+    # TF_On_Off_Matrices directories)
+    return sorted(glob.glob(os.path.join(root, "**",
+                                         onoff_filename("*", "*")),
+                            recursive=True))
+
+
+def run_key(file_path, onoff):
+    # (l, Np, run) of a stored matrix, taking Np and run from the file name
+    # for matrices saved without a key
+    l_value, np_value, run_value = onoff.key
+    if np_value < 0:
+        match = re.search(r"Np_(\d+)_run_(\d+)", os.path.basename(file_path))
+        np_value, run_value = int(match.group(1)), int(match.group(2))
+    return l_value, np_value, run_value
+
+
+def save_onoff(file_path, matrix, tu_ids, timesteps, key=(-1, -1, -1)):
+    # Save an (N_TU, F) 0/1 matrix in bit-packed form
+    matrix = np.asarray(matrix, dtype=bool)
+    np.savez(file_path,
+             bits=np.packbits(matrix, axis=1),
+             n_frames=np.int64(matrix.shape[1]),
+             tu_ids=np.asarray(tu_ids, dtype=np.int64),
+             timesteps=np.asarray(timesteps, dtype=np.int64),
+             key=np.array([-1 if k is None else k for k in key],
+                          dtype=np.int64))
+
+
+def _mmap_member(file_path, name):
+    # Memory-map an array stored (uncompressed) inside an .npz file
+    with zipfile.ZipFile(file_path) as zf:
+        info = zf.getinfo(name + ".npy")
+    if info.compress_type != zipfile.ZIP_STORED:
+        return None
+    with open(file_path, "rb") as f:
+        # Skip the zip local file header to reach the .npy data
+        f.seek(info.header_offset + 26)
+        name_len, extra_len = np.frombuffer(f.read(4), dtype="<u2")
+        f.seek(info.header_offset + 30 + int(name_len) + int(extra_len))
+        version = np.lib.format.read_magic(f)
+        if version == (1, 0):
+            shape, fortran, dtype = np.lib.format.read_array_header_1_0(f)
+        else:
+            shape, fortran, dtype = np.lib.format.read_array_header_2_0(f)
+        offset = f.tell()
+    if shape == () or 0 in shape:
+        return None
+    return np.memmap(file_path, dtype=dtype, mode="r", offset=offset,
+                     shape=shape, order="F" if fortran else "C")
+
+
+def load_onoff(file_path, mmap=True):
+    # Load a stored matrix. With mmap=True the packed bits are memory-mapped
+    # rather than read into memory
+    with np.load(file_path) as data:
+        n_frames = int(data["n_frames"])
+        tu_ids = data["tu_ids"]
+        timesteps = data["timesteps"]
+        key = tuple(int(k) for k in data["key"])
+        bits = _mmap_member(file_path, "bits") if mmap else None
+        if bits is None:
+            bits = data["bits"]
+    return OnOff(bits, n_frames, tu_ids, timesteps, key)
+
+
+def unpack(onoff, rows=slice(None)):
+    # Unpack (a subset of rows of) the matrix into a uint8 0/1 array
+    return np.unpackbits(onoff.bits[rows], axis=1, count=onoff.n_frames)
+
+
+def phi_from_onoff(onoff):
+    # Fraction of frames each TU is bound, counted from the packed bytes (a
+    # chunk of rows at a time, so a memory-mapped matrix is read once and
+    # never unpacked). Padding bits past n_frames are masked off
+    n_bytes = -(-onoff.n_frames // 8)
+    last_mask = np.uint8((0xFF << (8 * n_bytes - onoff.n_frames)) & 0xFF)
+    rows_per_chunk = max(1, COUNT_CHUNK_BYTES // max(n_bytes, 1))
+    counts = np.zeros(len(onoff.bits), dtype=np.int64)
+    for r0 in range(0, len(onoff.bits), rows_per_chunk):
+        chunk = np.array(onoff.bits[r0:r0 + rows_per_chunk, :n_bytes])
+        if n_bytes:
+            chunk[:, -1] &= last_mask
+        counts[r0:r0 + rows_per_chunk] = POPCOUNT[chunk].sum(axis=1,
+                                                             dtype=np.int64)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return counts / onoff.n_frames
+
+
+def to_json(onoff, json_path):
+    # Export in the old {TU id: [0/1, ...]} JSON layout
+    matrix = unpack(onoff)
+    on_off_matrix = {int(tu): row.tolist()
+                     for tu, row in zip(onoff.tu_ids, matrix)}
+    with open(json_path, 'w') as f:
+        json.dump(on_off_matrix, f, indent=4)
+
+
+def from_json(json_path, npz_path, key=(-1, -1, -1)):
+    # Convert an old JSON on/off matrix (timesteps are not stored there, so
+    # frame indices are used instead)
+    with open(json_path, 'r') as f:
+        on_off_matrix = json.load(f)
+    tu_ids = sorted(on_off_matrix, key=int)
+    matrix = np.array([on_off_matrix[tu] for tu in tu_ids], dtype=np.uint8)
+    save_onoff(npz_path, matrix, [int(tu) for tu in tu_ids],
+               np.arange(matrix.shape[1]), key)
+
+
+def load_onoff_matrix(on_off_dir, np_value, run_value):
+    # Load the matrix of one run for plotting, preferring the .npz store and
+    # falling back to the old JSON file. Returns (tu_ids, matrix) or None
+    npz_file = os.path.join(on_off_dir, onoff_filename(np_value, run_value))
+    json_file = os.path.join(on_off_dir,
+                             onoff_filename(np_value, run_value, ".json"))
+    if os.path.exists(npz_file):
+        onoff = load_onoff(npz_file)
+        return onoff.tu_ids, unpack(onoff)
+    if os.path.exists(json_file):
+        with open(json_file, 'r') as f:
+            on_off_matrix = json.load(f)
+        tu_ids = sorted(on_off_matrix, key=int)
+        matrix = np.array([on_off_matrix[tu] for tu in tu_ids],
+                          dtype=np.uint8)
+        return np.array([int(tu) for tu in tu_ids]), matrix
+    return None
+
+
+if __name__ == "__main__":
+    if len(sys.argv) not in (3, 4) or sys.argv[1] not in ("to-json",
+                                                          "from-json"):
+        print("Usage: onoff_store.py to-json|from-json <in_file> [out_file]")
+        sys.exit(1)
+
+    in_file = sys.argv[2]
+    if sys.argv[1] == "to-json":
+        out_file = sys.argv[3] if len(sys.argv) == 4 else \
+            os.path.splitext(in_file)[0] + ".json"
+        to_json(load_onoff(in_file), out_file)
+    else:
+        out_file = sys.argv[3] if len(sys.argv) == 4 else \
+            os.path.splitext(in_file)[0] + ".npz"
+        from_json(in_file, out_file)
+    print(f"Saved {out_file}")
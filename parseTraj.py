@@ -1,120 +1,246 @@
+import argparse
 import numpy as np
 import os
 import json
 import sys
 import re
 
-if len(sys.argv) != 2:
-    print("Usage: python script.py <trajectory_filename>")
-    sys.exit(1)
+from binding import BINDING_THRESHOLD, binding_blocks, parse_thresholds
+from dwell_times import matrix_dwell_stats, save_dwell_outputs
+from onoff_store import onoff_filename, save_onoff
+from online_stats import BindingAccumulator, ThresholdAccumulator
+from profiling import active, add_profile_args, profile_dir, profile_traj, report_base, \
+    write_report
+from result_cache import CACHE_DIR, ResultCache, cache_key
+from traj_reader import add_frame_args, read_frames
 
 # Define directory paths
-SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))  
-TRAJ_DIR = os.path.join(SCRIPT_DIR, "trajs")  
-ON_OFF_DIR = os.path.join(SCRIPT_DIR, "TF_On_Off_Matrices")  
-PHI_DIR = os.path.join(SCRIPT_DIR, "TF_Phi_Values")  
-
-#make directories if not there
-os.makedirs(ON_OFF_DIR, exist_ok=True)
-os.makedirs(PHI_DIR, exist_ok=True)
-
-traj_filename = sys.argv[1]
-traj_file_path = os.path.join(TRAJ_DIR, traj_filename)
-
-if not os.path.exists(traj_file_path):
-    print(f"Error: File '{traj_filename}' not found in '{TRAJ_DIR}'")
-    sys.exit(1)
-
-#find right file using generic form 
-match = re.search(r'Np_(\d+)_run_(\d+)', traj_filename)
-if match:
-    np_value, run_value = int(match.group(1)), int(match.group(2))
-else:
-    print("Error: Could not extract Np and run number from filename.")
-    sys.exit(1)
-
-#parseing traj file w real distance 
-def parse_lammpstrj_with_box(file_path, binding_threshold=3.5):
-
-    with open(file_path, 'r') as f:
-        lines = f.readlines()
-    
-    timestep_data = {} 
-    timestep = None
-    reading_atoms = False
-    box_bounds = {}  
-    
-    for i, line in enumerate(lines):
-        if "ITEM: TIMESTEP" in line:
-            timestep = int(lines[i + 1].strip())
-            timestep_data[timestep] = []
-            reading_atoms = False
-        
-        elif "ITEM: BOX BOUNDS" in line:
-            #read the next three lines as x, y, z bounds
-            box_bounds["x"] = list(map(float, lines[i + 1].strip().split()))
-            box_bounds["y"] = list(map(float, lines[i + 2].strip().split()))
-            box_bounds["z"] = list(map(float, lines[i + 3].strip().split()))
-
-        elif "ITEM: ATOMS" in line:
-            reading_atoms = True
-            continue
-
-        elif reading_atoms:
-            parts = line.strip().split()
-            if len(parts) < 5:
-                continue  
-            bead_id, bead_type = int(parts[0]), int(parts[1])
-            x_scaled, y_scaled, z_scaled = map(float, parts[2:5])
-
-            #getting real coords 
-            x_real = x_scaled * (box_bounds["x"][1] - box_bounds["x"][0]) + box_bounds["x"][0]
-            y_real = y_scaled * (box_bounds["y"][1] - box_bounds["y"][0]) + box_bounds["y"][0]
-            z_real = z_scaled * (box_bounds["z"][1] - box_bounds["z"][0]) + box_bounds["z"][0]
-
-            timestep_data[timestep].append((bead_id, bead_type, x_real, y_real, z_real))
-
-    total_timesteps = len(timestep_data)
-    tu_binding_states = {}  
-
-    for timestep, beads in timestep_data.items():
-        tu_positions = [(b[0], b[2:]) for b in beads if b[1] == 2]  # TUs (type 2)
-        tf_positions = [b[2:] for b in beads if b[1] == 3]  # TFs (type 3)
-
-        for tu_id, tu_pos in tu_positions:
-            if tu_id not in tu_binding_states:
-                tu_binding_states[tu_id] = []
-            
-            bound = any(np.linalg.norm(np.array(tu_pos) - np.array(tf_pos)) <= binding_threshold 
-                        for tf_pos in tf_positions)
-
-            tu_binding_states[tu_id].append(1 if bound else 0)
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+TRAJ_DIR = os.path.join(SCRIPT_DIR, "trajs")
+ON_OFF_DIR = os.path.join(SCRIPT_DIR, "TF_On_Off_Matrices")
+PHI_DIR = os.path.join(SCRIPT_DIR, "TF_Phi_Values")
 
-    # Compute Phi values
-    phi_values = {tu: sum(states) / total_timesteps for tu, states in tu_binding_states.items()}
+#parseing traj file w real distance (minimum image, see binding.py)
+#feeds the binding states into a BindingAccumulator (see online_stats.py), which only
+#keeps the full on/off matrix if keep_matrix is set
+#start/stop/stride select frames like a slice (see traj_index.py)
+def accumulate_binding(file_path, binding_threshold=BINDING_THRESHOLD, start=None, stop=None, stride=None,
+                       keep_matrix=True, max_lag=0):
+
+    acc = BindingAccumulator(max_lag=max_lag, keep_matrix=keep_matrix)
+
+    #frames are streamed and processed in blocks so memory does not grow with the run
+    with active().hot():
+        for steps, tu_ids, _, bound in binding_blocks(read_frames(file_path, start, stop, stride), binding_threshold):
+            acc.update(bound, tu_ids, steps)
+
+    return acc
+
+
+#bound counts of every TU for a whole (sorted) list of thresholds, from one pass over the
+#trajectory: each nearest-TF distance is computed once and compared to all thresholds
+def accumulate_thresholds(file_path, thresholds, start=None, stop=None, stride=None):
+
+    acc = ThresholdAccumulator(thresholds)
+
+    with active().hot():
+        for _, tu_ids, dist, _ in binding_blocks(read_frames(file_path, start, stop, stride), acc.thresholds[-1]):
+            acc.update(dist, tu_ids)
+
+    return acc
 
-    return tu_binding_states, phi_values
 
+#returns TU ids, timesteps and the (N_TU, frames) uint8 on/off matrix
+def parse_binding_matrix(file_path, binding_threshold=BINDING_THRESHOLD, start=None, stop=None, stride=None):
 
-on_off_matrix, phi_dict = parse_lammpstrj_with_box(traj_file_path, binding_threshold=3.5)
+    acc = accumulate_binding(file_path, binding_threshold, start, stop, stride)
+    if acc.n == 0:
+        return np.zeros(0, dtype=int), np.zeros(0, dtype=int), np.zeros((0, 0), dtype=np.uint8)
+    return acc.tu_ids, acc.all_timesteps(), acc.matrix()
 
-# save on off 
-on_off_file = os.path.join(ON_OFF_DIR, f"TF_on_off_Matrix_Np_{np_value}_run_{run_value}.json")
-with open(on_off_file, 'w') as f:
-    json.dump(on_off_matrix, f, indent=4)
 
-# save pgi values
-phi_file = os.path.join(PHI_DIR, f"TF_phis_Np_{np_value}_run_{run_value}.json")
-with open(phi_file, 'w') as f:
-    json.dump(phi_dict, f, indent=4)
+#parse_binding_matrix, reusing the (bit-packed) matrix from a ResultCache if the trajectory is unchanged
+def cached_binding_matrix(file_path, cache, binding_threshold=BINDING_THRESHOLD, start=None, stop=None, stride=None):
+
+    params = {"analysis": "binding_matrix", "binding_threshold": binding_threshold,
+              "frames": [start, stop, stride]}
+    key = cache_key(file_path, params)
+    hit = cache.get(key)
+    if hit is not None:
+        matrix = np.unpackbits(hit["bits"], axis=1, count=int(hit["n_frames"]))
+        return hit["tu_ids"], hit["timesteps"], matrix
+
+    tu_ids, timesteps, matrix = parse_binding_matrix(file_path, binding_threshold, start, stop, stride)
+    if matrix.size:
+        cache.put(key, file_path, params, tu_ids=tu_ids, timesteps=timesteps,
+                  bits=np.packbits(matrix, axis=1), n_frames=matrix.shape[1])
+    return tu_ids, timesteps, matrix
+
+
+#same as parse_binding_matrix but as {TU: [0/1, ...]} and {TU: phi} dicts
+def parse_lammpstrj_with_box(file_path, binding_threshold=BINDING_THRESHOLD):
+
+    tu_ids, _, matrix = parse_binding_matrix(file_path, binding_threshold)
+    tu_binding_states = {tu: row.tolist() for tu, row in zip(tu_ids.tolist(), matrix)}
+
+    # Compute Phi values
+    phi_values = {tu: sum(states) / len(states) for tu, states in tu_binding_states.items()}
+
+    return tu_binding_states, phi_values
 
-phi_csv_file = os.path.join(PHI_DIR, f"TF_phis_Np_{np_value}_run_{run_value}.csv")
-with open(phi_csv_file, 'w') as f:
-    f.write("TU,Phi\n")
-    for tu, phi in phi_dict.items():
-        f.write(f"{tu},{phi}\n")
 
-print(f"Processed {traj_filename} and saved results to:")
-print(f"- {on_off_file}")
-print(f"- {phi_file}")
-print(f"- {phi_csv_file}")
+def save_run_outputs(tu_ids, timesteps, matrix, np_value, run_value, on_off_dir=ON_OFF_DIR, phi_dir=PHI_DIR,
+                     l_value=None, write_json=False):
+    prof = active()
+    #make directories if not there
+    os.makedirs(on_off_dir, exist_ok=True)
+
+    # save on off as a bit-packed matrix (see onoff_store.py)
+    on_off_file = os.path.join(on_off_dir, onoff_filename(np_value, run_value))
+    with prof.stage("serialize"):
+        save_onoff(on_off_file, matrix, tu_ids, timesteps, (l_value, np_value, run_value))
+    saved = [on_off_file]
+
+    # old JSON layout, kept for backward compatibility
+    if write_json:
+        on_off_json = os.path.join(on_off_dir, onoff_filename(np_value, run_value, ".json"))
+        with prof.stage("serialize"), open(on_off_json, 'w') as f:
+            json.dump({tu: row.tolist() for tu, row in zip(tu_ids.tolist(), matrix)}, f, indent=4)
+        saved.append(on_off_json)
+
+    phi_dict = dict(zip(tu_ids.tolist(), matrix.mean(axis=1).tolist()))
+    saved += save_phi_outputs(phi_dict, np_value, run_value, phi_dir)
+
+    # dwell times and bursts of each TU (see dwell_times.py)
+    with prof.stage("dwell"):
+        stats, hists = matrix_dwell_stats(matrix)
+    with prof.stage("serialize"):
+        saved += save_dwell_outputs(tu_ids, stats, hists, np_value, run_value, phi_dir,
+                                    (l_value, np_value, run_value))
+    return phi_dict, saved
+
+
+def save_phi_outputs(phi_dict, np_value, run_value, phi_dir=PHI_DIR):
+    os.makedirs(phi_dir, exist_ok=True)
+
+    # save pgi values
+    phi_file = os.path.join(phi_dir, f"TF_phis_Np_{np_value}_run_{run_value}.json")
+    phi_csv_file = os.path.join(phi_dir, f"TF_phis_Np_{np_value}_run_{run_value}.csv")
+    with active().stage("serialize"):
+        with open(phi_file, 'w') as f:
+            json.dump(phi_dict, f, indent=4)
+
+        with open(phi_csv_file, 'w') as f:
+            f.write("TU,Phi\n")
+            for tu, phi in phi_dict.items():
+                f.write(f"{tu},{phi}\n")
+
+    return [phi_file, phi_csv_file]
+
+
+def threshold_filename(np_value, run_value):
+    return f"TF_phis_thresholds_Np_{np_value}_run_{run_value}.csv"
+
+
+#threshold-indexed phi table: one row per threshold, one column per TU
+def save_threshold_table(tu_ids, thresholds, phi, np_value, run_value, phi_dir=PHI_DIR):
+    os.makedirs(phi_dir, exist_ok=True)
+    table_file = os.path.join(phi_dir, threshold_filename(np_value, run_value))
+    with active().stage("serialize"), open(table_file, 'w') as f:
+        f.write("Threshold," + ",".join(str(tu) for tu in tu_ids) + "\n")
+        for threshold, row in zip(thresholds, phi):
+            f.write(f"{threshold:g}," + ",".join(str(p) for p in row) + "\n")
+    return table_file
+
+
+#per-TU binding autocorrelation for lags 1..max_lag (stats-only mode)
+def save_autocorr(acc, np_value, run_value, phi_dir=PHI_DIR):
+    autocorr_file = os.path.join(phi_dir, f"TF_phi_autocorr_Np_{np_value}_run_{run_value}.csv")
+    with open(autocorr_file, 'w') as f:
+        f.write("TU," + ",".join(f"lag_{k}" for k in range(1, acc.max_lag + 1)) + "\n")
+        for tu, row in zip(acc.tu_ids.tolist(), acc.autocorr().T):
+            f.write(f"{tu}," + ",".join(str(c) for c in row) + "\n")
+    return autocorr_file
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compute TU on/off matrices and phi values for a trajectory")
+    parser.add_argument("traj_filename", help=f"Trajectory file (relative to {TRAJ_DIR})")
+    parser.add_argument("--json", action="store_true", help="Also write the on/off matrix in the old JSON format")
+    parser.add_argument("--cache-dir", default=CACHE_DIR, help="Directory of the result cache")
+    parser.add_argument("--no-cache", action="store_true", help="Always re-parse the trajectory")
+    parser.add_argument("--stats-only", action="store_true",
+                        help="Only compute phi with O(N_TU) memory, without the on/off matrix")
+    parser.add_argument("--max-lag", type=int, default=0,
+                        help="With --stats-only, also save binding autocorrelations up to this lag")
+    parser.add_argument("--threshold", type=float, default=BINDING_THRESHOLD,
+                        help="Binding threshold (distance to the nearest ON protein)")
+    parser.add_argument("--thresholds", metavar="SPEC",
+                        help="Only write the phi of every TU for several binding thresholds "
+                             "(start:stop:step, e.g. 2.5:5.0:0.1, or a comma separated list), "
+                             "computed in one pass")
+    add_frame_args(parser)
+    add_profile_args(parser)
+    args = parser.parse_args()
+
+    traj_filename = args.traj_filename
+    traj_file_path = os.path.join(TRAJ_DIR, traj_filename)
+
+    if not os.path.exists(traj_file_path):
+        print(f"Error: File '{traj_filename}' not found in '{TRAJ_DIR}'")
+        sys.exit(1)
+
+    #find right file using generic form
+    match = re.search(r'Np_(\d+)_run_(\d+)', traj_filename)
+    if match:
+        np_value, run_value = int(match.group(1)), int(match.group(2))
+    else:
+        print("Error: Could not extract Np and run number from filename.")
+        sys.exit(1)
+    match = re.search(r'_l_(\d+)_', traj_filename)
+    l_value = int(match.group(1)) if match else None
+
+    report = report_base(args)
+    #stage timings of this trajectory, if requested (see profiling.py)
+    with profile_traj(traj_file_path, report is not None, args.profile) as prof:
+        if args.thresholds:
+            acc = accumulate_thresholds(traj_file_path, parse_thresholds(args.thresholds),
+                                        args.start, args.stop, args.stride)
+            if acc.n == 0:
+                print(f"Error: No complete frames in '{traj_filename}'")
+                sys.exit(1)
+            saved = [save_threshold_table(acc.tu_ids, acc.thresholds, acc.phi(), np_value, run_value)]
+        elif args.stats_only:
+            acc = accumulate_binding(traj_file_path, args.threshold, args.start, args.stop, args.stride,
+                                     keep_matrix=False, max_lag=args.max_lag)
+            if acc.n == 0:
+                print(f"Error: No complete frames in '{traj_filename}'")
+                sys.exit(1)
+            saved = save_phi_outputs(dict(zip(acc.tu_ids.tolist(), acc.phi().tolist())), np_value, run_value)
+            if args.max_lag:
+                saved.append(save_autocorr(acc, np_value, run_value))
+        elif args.no_cache:
+            tu_ids, timesteps, matrix = parse_binding_matrix(traj_file_path, args.threshold, args.start, args.stop, args.stride)
+        else:
+            cache = ResultCache(args.cache_dir)
+            tu_ids, timesteps, matrix = cached_binding_matrix(traj_file_path, cache, args.threshold, args.start, args.stop, args.stride)
+            cache.flush()
+        if not (args.stats_only or args.thresholds):
+            if matrix.size == 0:
+                print(f"Error: No complete frames in '{traj_filename}'")
+                sys.exit(1)
+            _, saved = save_run_outputs(tu_ids, timesteps, matrix, np_value, run_value,
+                                        l_value=l_value, write_json=args.json)
+
+    if prof.enabled:
+        saved += write_report([prof.record()], report)
+        if args.profile:
+            saved.append(prof.dump_cprofile(profile_dir(report)))
+
+    print(f"Processed {traj_filename} and saved results to:")
+    for path in saved:
+        print(f"- {path}")
+
+
+if __name__ == "__main__":
+    main()
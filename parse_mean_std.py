@@ -1,9 +1,12 @@
+import argparse
 import os
 import json
 import pandas as pd
 import numpy as np
 import re
 
+from results_store import RESULTS_DIR, ResultsStore
+
 def extract_np_run(file_name):
     """Extracts Np (number of proteins) and run number from the file name."""
     match = re.search(r'Np_(\d+)_run_(\d+)', file_name)
@@ -12,9 +15,15 @@ def extract_np_run(file_name):
     else:
         raise ValueError("File name does not match expected format: Np_{Np}_run_{run}")
 
-def compute_phi_stats(phi_dir, output_csv):
-    """Processes all Phi JSON files, computes mean and standard deviation, and saves to CSV."""
+def compute_phi_stats(phi_dir, output_csv, store=None, ns=None, l_value=None):
+    """Processes all Phi JSON files, computes mean and standard deviation, and saves to CSV.
+
+    Rows already in output_csv for the same (Np, Run) are replaced, so rerunning does not
+    duplicate them. If a ResultsStore is given (with the run's Ns and l), the per-TU phi
+    values and summaries are upserted into it as well.
+    """
     data_records = []
+    runs = {}
     
     for file_name in os.listdir(phi_dir):
         if file_name.endswith(".json"):
@@ -33,19 +42,43 @@ def compute_phi_stats(phi_dir, output_csv):
                 if phi_values.size > 0:
                     mean_phi = np.mean(phi_values)
                     std_phi = np.std(phi_values, ddof=0)  # Population std deviation
+                    # Ordered by TU id for the store
+                    runs[(ns, l_value, np_value, run_value)] = [
+                        phi_dict[tu] for tu in sorted(phi_dict, key=int)]
                 else:
                     mean_phi = None
                     std_phi = None
                 
                 data_records.append([np_value, run_value, mean_phi, std_phi])
     
-    # Convert to DataFrame and save to CSV
+    # Convert to DataFrame and merge into the CSV, replacing rows of the same run
     df = pd.DataFrame(data_records, columns=["Np", "Run", "Mean", "Standard Deviation"])
-    df.to_csv(output_csv, index=False, mode='a', header=not os.path.exists(output_csv))
-    
+    if os.path.exists(output_csv):
+        df = pd.concat([pd.read_csv(output_csv), df], ignore_index=True)
+    df = df.drop_duplicates(subset=["Np", "Run"], keep="last").sort_values(["Np", "Run"])
+    df.to_csv(output_csv, index=False)
+
     print(f"Saved Phi statistics to {output_csv}")
 
+    if store is not None:
+        store.upsert_runs(runs)
+        print(f"Stored {len(runs)} runs in {store.root}")
+
 if __name__ == "__main__":
-    phi_values_dir = "TF_Phi_Values"  # Folder containing Phi JSON files
-    output_csv_file = "phi_statistics.csv"  # Output CSV file
-    compute_phi_stats(phi_values_dir, output_csv_file)
+    parser = argparse.ArgumentParser(description="Summarise the per-run Phi JSON files")
+    parser.add_argument("phi_dir", nargs="?", default="TF_Phi_Values",
+                        help="Folder containing Phi JSON files")
+    parser.add_argument("-o", "--out", default="phi_statistics.csv", help="Output CSV file")
+    parser.add_argument("--store", default=None,
+                        help=f"Also upsert into this results store (e.g. {RESULTS_DIR}); "
+                             "needs --ns and --l")
+    parser.add_argument("--ns", type=int, default=None, help="Number of TUs of the runs")
+    parser.add_argument("--l", type=int, default=None, help="TU spacing of the runs")
+    args = parser.parse_args()
+
+    store = None
+    if args.store:
+        if args.ns is None or args.l is None:
+            parser.error("--store needs --ns and --l")
+        store = ResultsStore(args.store)
+    compute_phi_stats(args.phi_dir, args.out, store, args.ns, args.l)
@@ -0,0 +1,443 @@
+#!/usr/bin/env python3
+# pipeline.py
+# Run several analyses of a trajectory from a single read.
+#
+# Each analysis script (parseTraj.py, computePhiStats2.py,
+# TU-TF_dist_grapher.py, tf_clusters.py, polymer_structure.py) reads and
+# parses the whole trajectory on its own. Here the analyses are stages that
+# consume one stream of frames: every trajectory is decoded once, grouped into
+# blocks of frames (stacked as in binding.frame_blocks), and every block is
+# handed to each enabled stage in turn. The nearest-TF distances of a block
+# are computed the first time a stage asks for them and shared by the others,
+# so the read, parse and distance costs are paid once however many stages run.
+#
+# Stages (STAGES, selected with --stages):
+#   binding     on/off matrix, phi and dwell times (parseTraj.save_run_outputs)
+#               and the phi_stats_l{l}_r{n}.csv rows of batch_phi.py
+#   thresholds  threshold-indexed phi table (--thresholds, see parseTraj.py)
+#   distances   per-time-bin TU-TF distance quantiles (TU-TF_dist_grapher.py)
+#   clusters    protein cluster statistics (tf_clusters.py)
+#   structure   radius of gyration and contact maps (polymer_structure.py)
+# Outputs are written under <out_dir>/runSep{l}/ in the layout of the
+# corresponding script, and every stage adds its run summary to
+# pipeline_summary.csv. A new stage is a Stage subclass with update(block)
+# and finish() and, if it takes options, add_args(parser), registered in
+# STAGES.
+#
+# Usage: pipeline.py <sweep_dir> --stages binding clusters structure
+#            [-o pipeline_out] [-j N] [--profile-report FILE]
+
+import argparse
+import os
+import re
+import sys
+import time
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+import pandas as pd
+
+from batch_phi import merge_results, scan_sweep
+from binding import BINDING_THRESHOLD, BLOCK_SIZE, frame_blocks, \
+    nearest_tf_distances, parse_thresholds
+from online_stats import BindingAccumulator, DistanceHistogram, \
+    ThresholdAccumulator
+from parseTraj import save_run_outputs, save_threshold_table
+from polymer_structure import CONTACT_CUTOFF, StructureState, chain_indices, \
+    structure_filename, unwrapped_chain
+from polymer_structure import run_summary as structure_summary
+from profiling import active, add_profile_args, profile_dir, profile_traj, \
+    report_base, write_report
+from tf_clusters import CLUSTER_CUTOFF, MIN_SIZE, ClusterStats, \
+    label_clusters, save_cluster_outputs
+from tf_clusters import run_summary as cluster_summary
+from traj_reader import add_frame_args, box_lengths, read_frames
+
+# The trajectory a stage works on: its key and the runSep{l} output directory
+RunInfo = namedtuple("RunInfo", ["path", "l", "Np", "run", "out_dir"])
+
+
+class Block:
+    # A block of consecutive frames: the frames themselves, the stacked
+    # arrays of binding.frame_blocks, and the nearest-TF distances computed
+    # on first use
+
+    def __init__(self, frames):
+        self.frames = frames
+        (self.timesteps, self.tu_ids, self.tu, self.prot, self.on,
+         self.lengths) = next(frame_blocks(frames, len(frames)))
+        self._dist = None
+
+    @property
+    def dist(self):
+        if self._dist is None:
+            self._dist = nearest_tf_distances(self.tu, self.prot, self.on,
+                                              self.lengths)
+        return self._dist
+
+
+def blocks(frames, block_size=BLOCK_SIZE):
+    batch = []
+    for frame in frames:
+        batch.append(frame)
+        if len(batch) == block_size:
+            yield Block(batch)
+            batch = []
+    if batch:
+        yield Block(batch)
+
+
+def frame_params(options):
+    # The frame selection as stored with the tf_clusters.py and
+    # polymer_structure.py outputs, so that those scripts reuse them
+    return [-1 if f is None else f
+            for f in (options.start, options.stop, options.stride)]
+
+
+class Stage:
+    # Consumer of the blocks of one trajectory. finish() writes the outputs
+    # and returns (summary dict, saved paths)
+
+    def __init__(self, run, options):
+        self.run = run
+        self.options = options
+
+    @staticmethod
+    def add_args(parser):
+        pass
+
+    def update(self, block):
+        raise NotImplementedError
+
+    def finish(self):
+        raise NotImplementedError
+
+
+class BindingStage(Stage):
+
+    @staticmethod
+    def add_args(parser):
+        parser.add_argument("--threshold", type=float,
+                            default=BINDING_THRESHOLD,
+                            help="Binding threshold (binding stage)")
+        parser.add_argument("--json", action="store_true",
+                            help="Also write on/off JSON files "
+                                 "(binding stage)")
+
+    def __init__(self, run, options):
+        super().__init__(run, options)
+        self.acc = BindingAccumulator(keep_matrix=True)
+
+    def update(self, block):
+        self.acc.update(block.dist <= self.options.threshold, block.tu_ids,
+                        block.timesteps)
+
+    def finish(self):
+        run = self.run
+        phi_dict, saved = save_run_outputs(
+            self.acc.tu_ids, self.acc.all_timesteps(), self.acc.matrix(),
+            run.Np, run.run, os.path.join(run.out_dir, "TF_On_Off_Matrices"),
+            os.path.join(run.out_dir, "TF_Phi_Values"), l_value=run.l,
+            write_json=self.options.json)
+        phi = np.array(list(phi_dict.values()))
+        return {"phi_mean": round(np.mean(phi), 6),
+                "phi_std": round(np.std(phi), 6)}, saved
+
+
+class ThresholdStage(Stage):
+
+    @staticmethod
+    def add_args(parser):
+        parser.add_argument("--thresholds", metavar="SPEC",
+                            default="2.5:5.0:0.1",
+                            help="Binding thresholds as start:stop:step or a "
+                                 "comma separated list (thresholds stage)")
+
+    def __init__(self, run, options):
+        super().__init__(run, options)
+        self.acc = ThresholdAccumulator(parse_thresholds(options.thresholds))
+
+    def update(self, block):
+        self.acc.update(block.dist, block.tu_ids)
+
+    def finish(self):
+        run = self.run
+        saved = save_threshold_table(self.acc.tu_ids, self.acc.thresholds,
+                                     self.acc.phi(), run.Np, run.run,
+                                     os.path.join(run.out_dir,
+                                                  "TF_Phi_Values"))
+        return {}, [saved]
+
+
+class DistanceStage(Stage):
+
+    QUANTILES = [0.05, 0.25, 0.5, 0.75, 0.95]
+
+    @staticmethod
+    def add_args(parser):
+        parser.add_argument("--dist-bins", type=int, default=400,
+                            help="Distance bins (distances stage)")
+        parser.add_argument("--time-bins", type=int, default=500,
+                            help="Maximum number of time bins "
+                                 "(distances stage)")
+
+    def __init__(self, run, options):
+        super().__init__(run, options)
+        self.hist = None
+
+    def update(self, block):
+        if self.hist is None:
+            # No minimum-image distance exceeds half the box diagonal
+            max_distance = np.linalg.norm(
+                box_lengths(block.frames[0].box) / 2.0)
+            self.hist = DistanceHistogram(max_distance,
+                                          self.options.dist_bins,
+                                          self.options.time_bins,
+                                          self.options.threshold)
+        self.hist.update(block.timesteps, block.dist)
+
+    def finish(self):
+        out_dir = os.path.join(self.run.out_dir, "TF_Distances")
+        os.makedirs(out_dir, exist_ok=True)
+        name = re.sub(r"\.(lammpstrj(\.gz)?|lta)$", "",
+                      os.path.basename(self.run.path))
+        table_file = os.path.join(out_dir, f"TU_TF_distance_bins_{name}.csv")
+        table = pd.DataFrame(self.hist.bin_table(self.QUANTILES))
+        with active().stage("serialize"):
+            table.to_csv(table_file, index=False)
+        counts = self.hist.histogram().sum(axis=0)
+        centres = (self.hist.dist_edges[:-1] + self.hist.dist_edges[1:]) / 2
+        mean = float(centres @ counts / counts.sum()) if counts.sum() \
+            else np.nan
+        return {"mean_tu_tf_distance": mean}, [table_file]
+
+
+class ClusterStage(Stage):
+
+    @staticmethod
+    def add_args(parser):
+        parser.add_argument("--cluster-cutoff", type=float,
+                            default=CLUSTER_CUTOFF,
+                            help="Protein-protein contact distance "
+                                 "(clusters stage)")
+        parser.add_argument("--min-size", type=int, default=MIN_SIZE,
+                            help="Smallest cluster counted and tracked "
+                                 "(clusters stage)")
+        parser.add_argument("--include-off", action="store_true",
+                            help="Also cluster OFF proteins (clusters stage)")
+
+    def __init__(self, run, options):
+        super().__init__(run, options)
+        self.stats = ClusterStats(options.min_size)
+
+    def update(self, block):
+        members = np.ones_like(block.on) if self.options.include_off \
+            else block.on
+        with active().stage("distance"):
+            labels, tu_labels = label_clusters(
+                block.tu, block.prot, members, block.lengths,
+                self.options.cluster_cutoff, self.options.threshold)
+        self.stats.update(block.timesteps, labels, tu_labels)
+
+    def finish(self):
+        run, options = self.run, self.options
+        self.stats.finish()
+        params = [options.cluster_cutoff, options.threshold, options.min_size,
+                  options.include_off] + frame_params(options)
+        saved = save_cluster_outputs(self.stats, run.Np, run.run,
+                                     os.path.join(run.out_dir, "TF_Clusters"),
+                                     (run.l, run.Np, run.run), params)
+        summary = cluster_summary(self.stats.frame_series(),
+                                  self.stats.hists, self.stats.n_censored)
+        return {f"cluster_{k}": v for k, v in summary.items()
+                if k != "n_frames"}, saved
+
+
+class StructureStage(Stage):
+
+    @staticmethod
+    def add_args(parser):
+        parser.add_argument("--contact-cutoff", type=float,
+                            default=CONTACT_CUTOFF,
+                            help="Bead-bead contact distance "
+                                 "(structure stage)")
+        parser.add_argument("--cg-beads", type=int, default=None,
+                            help="Beads per block of the coarse-grained "
+                                 "contact map (structure stage)")
+
+    def __init__(self, run, options):
+        super().__init__(run, options)
+        self.state = None
+        self.timesteps, self.rgs = [], []
+
+    def update(self, block):
+        for frame in block.frames:
+            if self.state is None:
+                self.chain_idx, self.tu_pos = chain_indices(frame)
+                self.state = StructureState(len(self.tu_pos),
+                                            len(self.chain_idx),
+                                            self.options.contact_cutoff,
+                                            self.options.cg_beads)
+            chain = unwrapped_chain(frame, self.chain_idx)
+            self.rgs.append(self.state.update(chain, self.tu_pos))
+        self.timesteps.extend(block.timesteps.tolist())
+
+    def finish(self):
+        run, options = self.run, self.options
+        out_dir = os.path.join(run.out_dir, "Structure")
+        os.makedirs(out_dir, exist_ok=True)
+        state_file = os.path.join(out_dir,
+                                  structure_filename(run.Np, run.run))
+        rg_file = os.path.join(out_dir,
+                               structure_filename(run.Np, run.run, rg=True))
+        params = [options.contact_cutoff, options.cg_beads or 0] \
+            + frame_params(options)
+        with active().stage("serialize"):
+            self.state.save(state_file,
+                            key=np.array([run.l, run.Np, run.run]),
+                            params=np.array(params, dtype=np.float64))
+            pd.DataFrame({"timestep": self.timesteps,
+                          "Rg": self.rgs}).to_csv(rg_file, index=False)
+        summary = structure_summary(self.state, np.array(self.rgs))
+        return {k: v for k, v in summary.items() if k != "n_frames"}, \
+            [state_file, rg_file]
+
+
+# name -> Stage class
+STAGES = {
+    "binding": BindingStage,
+    "thresholds": ThresholdStage,
+    "distances": DistanceStage,
+    "clusters": ClusterStage,
+    "structure": StructureStage,
+}
+
+
+def run_pipeline(path, key, out_root, stage_names, options,
+                 frames=(None, None, None), block_size=BLOCK_SIZE):
+    # Worker: feed one read of a trajectory to every stage. Returns
+    # (summary, saved paths)
+    l_val, np_value, run_value = key
+    run = RunInfo(path, l_val, np_value, run_value,
+                  os.path.join(out_root, f"runSep{l_val}"))
+    stages = [STAGES[name](run, options) for name in stage_names]
+    n_frames = 0
+    with active().hot():
+        for block in blocks(read_frames(path, *frames), block_size):
+            for stage in stages:
+                stage.update(block)
+            n_frames += len(block.frames)
+    if n_frames == 0:
+        raise ValueError(f"No complete frames in {path}")
+
+    summary, saved = {"n_frames": n_frames}, []
+    for stage in stages:
+        stage_summary, stage_saved = stage.finish()
+        summary.update(stage_summary)
+        saved += stage_saved
+    return summary, saved
+
+
+def profiled_pipeline(path, cprofile_dir, *args):
+    # Worker: run_pipeline with per-stage timings (see profiling.py). Returns
+    # (summary, saved paths, profile record)
+    with profile_traj(path, cprofile=cprofile_dir is not None) as prof:
+        summary, saved = run_pipeline(path, *args)
+    if cprofile_dir is not None:
+        prof.dump_cprofile(cprofile_dir)
+    return summary, saved, prof.record()
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Run several analyses of every trajectory of a sweep "
+                    "from a single read")
+    parser.add_argument("sweep_dir", nargs="?", default=".",
+                        help="Directory containing the runSep* directories")
+    parser.add_argument("--stages", nargs="+", choices=list(STAGES),
+                        default=["binding"], help="Analyses to run")
+    parser.add_argument("-o", "--out-dir", default="pipeline_out",
+                        help="Where to write the outputs")
+    parser.add_argument("-j", "--workers", type=int, default=os.cpu_count(),
+                        help="Number of worker processes")
+    parser.add_argument("--l", type=int, nargs="+", dest="l_values",
+                        help="Only process these spacings")
+    parser.add_argument("--block-size", type=int, default=BLOCK_SIZE,
+                        help="Frames handed to the stages at a time")
+    stage_args = parser.add_argument_group("stage options")
+    for stage in STAGES.values():
+        stage.add_args(stage_args)
+    add_frame_args(parser)
+    add_profile_args(parser)
+    args = parser.parse_args()
+
+    jobs = scan_sweep(args.sweep_dir)
+    if args.l_values:
+        jobs = jobs[jobs["l"].isin(args.l_values)]
+    if jobs.empty:
+        print(f"No trajectories found in {args.sweep_dir}")
+        sys.exit(1)
+    stage_names = list(dict.fromkeys(args.stages))
+    print(f"Found {len(jobs)} trajectories, stages: {', '.join(stage_names)}")
+
+    report = report_base(args)
+    if report is not None:
+        report = os.path.join(args.out_dir, report)
+    cprofile_dir = profile_dir(report) if args.profile else None
+    frames = (args.start, args.stop, args.stride)
+    job_args = (stage_names, args, frames, args.block_size)
+
+    start = time.time()
+    records, profile_records, n_failed = [], [], 0
+    with ProcessPoolExecutor(max_workers=args.workers) as pool:
+        futures = {}
+        for job in jobs.itertuples(index=False):
+            key = (job.l, job.Np, job.run)
+            if report is not None:
+                future = pool.submit(profiled_pipeline, job.path,
+                                     cprofile_dir, key, args.out_dir,
+                                     *job_args)
+            else:
+                future = pool.submit(run_pipeline, job.path, key,
+                                     args.out_dir, *job_args)
+            futures[future] = job
+        for done, future in enumerate(as_completed(futures), 1):
+            job = futures[future]
+            name = os.path.basename(job.path)
+            try:
+                result = future.result()
+            except Exception as e:
+                n_failed += 1
+                print(f"[{done}/{len(jobs)}] FAILED {name}: {e!r}")
+                continue
+            if report is not None:
+                profile_records.append(result[2])
+            records.append({"Ns": job.Ns, "l": job.l, "Np": job.Np,
+                            "run": job.run, **result[0], "File": name})
+            elapsed = time.time() - start
+            print(f"[{done}/{len(jobs)}] ok {name} ({len(result[1])} files, "
+                  f"elapsed {elapsed:.0f}s)", flush=True)
+
+    os.makedirs(args.out_dir, exist_ok=True)
+    summary = pd.DataFrame(records)
+    if not summary.empty:
+        summary = summary.sort_values(["Ns", "l", "Np", "run"])
+    summary_file = os.path.join(args.out_dir, "pipeline_summary.csv")
+    summary.to_csv(summary_file, index=False)
+    print(f"✓ Saved {summary_file} ({len(summary)} runs)")
+    if "binding" in stage_names and not summary.empty:
+        results = summary.rename(columns={"Np": "TFs", "run": "Run"})[
+            ["Ns", "l", "TFs", "Run", "phi_mean", "phi_std", "File"]]
+        for out_file, n in merge_results(results, args.out_dir):
+            print(f"✓ Saved: {out_file} with {n} entries")
+    if report is not None:
+        for path in write_report(profile_records, report):
+            print(f"✓ Saved profile report: {path}")
+    if n_failed:
+        print(f"{n_failed} trajectories failed")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
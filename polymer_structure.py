@@ -0,0 +1,322 @@
+#!/usr/bin/env python3
+# polymer_structure.py
+# Conformation of the chromatin polymer: radius of gyration of every frame
+# and TU-TU (and coarse-grained bead-bead) contact probabilities.
+#
+# The dumps are written with image flags (ix iy iz), so the chain is unwrapped
+# across the periodic boundaries (traj_reader.unwrapped_coords) before
+# anything is measured. The chain is every chromatin bead (types 1 and 2) in
+# id order. A frame with a bond longer than half the box means the image flags
+# are missing or wrong, and the run is rejected rather than giving a
+# meaningless Rg.
+#
+# Two beads are in contact if their unwrapped distance is below --cutoff.
+# Contacts come from a cKDTree neighbour search over the chain of each frame
+# (query_pairs), never from an all-pairs distance matrix, and are added to the
+# count matrices with a single bincount. With --cg-beads B the whole chain is
+# also mapped onto blocks of B consecutive beads and a block-block contact
+# map is accumulated.
+#
+# StructureState holds the frame count, the contact count matrices and the
+# Rg sums. States of runs with the same chain add up (merge), and are saved as
+# .npz files, so the maps of a whole Np x run ensemble are reduced from the
+# per-run states that the worker processes return.
+#
+# Per run this writes, under <out_dir>/runSep{l}/Structure/,
+#   structure_Np_{Np}_run_{run}.npz   StructureState of the run
+#   Rg_Np_{Np}_run_{run}.csv          timestep, Rg of every frame
+# and for the sweep structure_summary.csv (one row per run), the merged
+# state of every (l, Np), structure_l{l}_Np_{Np}.npz, and its TU-TU contact
+# probability matrix, tu_contacts_l{l}_Np_{Np}.csv.
+#
+# Usage: polymer_structure.py <sweep_dir> [-o structure] [-j N]
+#            [--cutoff 2.0] [--cg-beads 10] [--force]
+
+import argparse
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+import pandas as pd
+from scipy.spatial import cKDTree
+
+from batch_phi import scan_sweep
+from binding import TU_TYPE
+from profiling import active
+from traj_reader import add_frame_args, box_lengths, read_frames, \
+    unwrapped_coords
+
+CHROMATIN_TYPES = (1, 2)
+CONTACT_CUTOFF = 2.0  # Bead-bead contact distance (in sigma)
+
+
+def structure_filename(np_value, run_value, rg=False):
+    if rg:
+        return f"Rg_Np_{np_value}_run_{run_value}.csv"
+    return f"structure_Np_{np_value}_run_{run_value}.npz"
+
+
+def radius_of_gyration(coords):
+    centred = coords - coords.mean(axis=0)
+    return float(np.sqrt(np.einsum("ij,ij->", centred, centred)
+                         / len(coords)))
+
+
+def _pair_counts(pairs, index, n):
+    # (n, n) symmetric counts of the (i, j) pairs mapped through index
+    a, b = index[pairs[:, 0]], index[pairs[:, 1]]
+    counts = np.bincount(a * n + b, minlength=n * n).reshape(n, n)
+    counts += counts.T
+    # A pair inside one block was counted on the diagonal twice
+    counts[np.diag_indices(n)] //= 2
+    return counts
+
+
+class StructureState:
+
+    def __init__(self, n_tus, n_beads, cutoff=CONTACT_CUTOFF, cg_beads=None):
+        self.cutoff = cutoff
+        self.cg_beads = cg_beads
+        self.n_beads = n_beads
+        self.n = 0
+        self.rg_sum = 0.0
+        self.rg_sq_sum = 0.0
+        self.tu_contacts = np.zeros((n_tus, n_tus), dtype=np.int64)
+        n_blocks = -(-n_beads // cg_beads) if cg_beads else 0
+        self.cg_contacts = np.zeros((n_blocks, n_blocks), dtype=np.int64)
+
+    def update(self, chain, tu_pos):
+        # Add one frame: chain is the (N_beads, 3) unwrapped chain and tu_pos
+        # the positions of the TUs along it. Returns the Rg of the frame
+        rg = radius_of_gyration(chain)
+        self.rg_sum += rg
+        self.rg_sq_sum += rg * rg
+        with active().stage("distance"):
+            if self.cg_beads:
+                # TU pairs are a subset of the bead pairs
+                pairs = cKDTree(chain).query_pairs(self.cutoff,
+                                                   output_type="ndarray")
+                self.cg_contacts += _pair_counts(
+                    pairs, np.arange(self.n_beads) // self.cg_beads,
+                    len(self.cg_contacts))
+                tu_index = np.full(self.n_beads, -1)
+                tu_index[tu_pos] = np.arange(len(tu_pos))
+                tu_pairs = tu_index[pairs]
+                pairs = tu_pairs[np.all(tu_pairs >= 0, axis=1)]
+            else:
+                pairs = cKDTree(chain[tu_pos]).query_pairs(
+                    self.cutoff, output_type="ndarray")
+            self.tu_contacts += _pair_counts(pairs, np.arange(len(tu_pos)),
+                                             len(tu_pos))
+        self.n += 1
+        return rg
+
+    def merge(self, other):
+        # Add the frames of another state of the same chain and parameters
+        if (self.tu_contacts.shape != other.tu_contacts.shape
+                or self.cg_contacts.shape != other.cg_contacts.shape
+                or self.cutoff != other.cutoff
+                or self.cg_beads != other.cg_beads):
+            raise ValueError("Cannot merge structure states of different "
+                             "chains or parameters")
+        self.n += other.n
+        self.rg_sum += other.rg_sum
+        self.rg_sq_sum += other.rg_sq_sum
+        self.tu_contacts += other.tu_contacts
+        self.cg_contacts += other.cg_contacts
+        return self
+
+    def rg_mean(self):
+        return self.rg_sum / self.n if self.n else np.nan
+
+    def rg_std(self):
+        if not self.n:
+            return np.nan
+        return float(np.sqrt(max(self.rg_sq_sum / self.n
+                                 - self.rg_mean() ** 2, 0.0)))
+
+    def contact_probability(self, coarse=False):
+        # Fraction of frames in which each pair is in contact
+        counts = self.cg_contacts if coarse else self.tu_contacts
+        return counts / self.n if self.n else np.full(counts.shape, np.nan)
+
+    def save(self, path, **extra):
+        np.savez(path, n=np.int64(self.n), n_beads=np.int64(self.n_beads),
+                 cutoff=np.float64(self.cutoff),
+                 cg_beads=np.int64(self.cg_beads or 0),
+                 rg_sum=np.float64(self.rg_sum),
+                 rg_sq_sum=np.float64(self.rg_sq_sum),
+                 tu_contacts=self.tu_contacts, cg_contacts=self.cg_contacts,
+                 **extra)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            state = cls(len(data["tu_contacts"]), int(data["n_beads"]),
+                        float(data["cutoff"]), int(data["cg_beads"]) or None)
+            state.n = int(data["n"])
+            state.rg_sum = float(data["rg_sum"])
+            state.rg_sq_sum = float(data["rg_sq_sum"])
+            state.tu_contacts = data["tu_contacts"]
+            state.cg_contacts = data["cg_contacts"]
+        return state
+
+
+def merge_states(states):
+    # One state of all the given states (None if there are none)
+    merged = None
+    for state in states:
+        if merged is None:
+            merged = StructureState(len(state.tu_contacts), state.n_beads,
+                                    state.cutoff, state.cg_beads)
+        merged.merge(state)
+    return merged
+
+
+def chain_indices(frame):
+    # Indices of the chain beads in the frame, and the positions of the TUs
+    # along the chain
+    chain_idx = np.flatnonzero(np.isin(frame.types, CHROMATIN_TYPES))
+    return chain_idx, np.flatnonzero(frame.types[chain_idx] == TU_TYPE)
+
+
+def unwrapped_chain(frame, chain_idx):
+    # (N_beads, 3) unwrapped chain; raises if a bond spans more than half the
+    # box, i.e. the image flags are missing or wrong
+    chain = unwrapped_coords(frame)[chain_idx]
+    bonds = np.linalg.norm(np.diff(chain, axis=0), axis=1)
+    if len(bonds) and bonds.max() > box_lengths(frame.box).min() / 2:
+        raise ValueError(f"Bond longer than half the box at timestep "
+                         f"{frame.timestep} (missing image flags?)")
+    return chain
+
+
+def structure_traj(path, cutoff=CONTACT_CUTOFF, cg_beads=None,
+                   frames=(None, None, None)):
+    # StructureState and (timesteps, Rg) of one trajectory, streamed frame
+    # by frame
+    state, timesteps, rgs = None, [], []
+    with active().hot():
+        for frame in read_frames(path, *frames):
+            if state is None:
+                chain_idx, tu_pos = chain_indices(frame)
+                state = StructureState(len(tu_pos), len(chain_idx), cutoff,
+                                       cg_beads)
+            rgs.append(state.update(unwrapped_chain(frame, chain_idx), tu_pos))
+            timesteps.append(frame.timestep)
+    if state is None:
+        raise ValueError(f"No complete frames in {path}")
+    return state, np.array(timesteps), np.array(rgs)
+
+
+def run_summary(state, rgs):
+    n_pairs = len(state.tu_contacts) * (len(state.tu_contacts) - 1) // 2
+    return {"n_frames": state.n, "rg_mean": float(np.mean(rgs)),
+            "rg_std": float(np.std(rgs)),
+            "tu_contacts_per_frame": float(np.triu(state.tu_contacts, 1).sum()
+                                           / state.n),
+            "tu_contact_fraction": float(np.triu(state.tu_contacts, 1).sum()
+                                         / state.n / n_pairs)
+            if n_pairs else np.nan}
+
+
+def process_traj(path, key, out_dir, cutoff=CONTACT_CUTOFF, cg_beads=None,
+                 frames=(None, None, None), force=False):
+    # Worker: structure outputs of one trajectory (skipped if newer than the
+    # trajectory and computed with the same parameters). Returns
+    # (summary, state)
+    _, np_value, run_value = key
+    state_file = os.path.join(out_dir, structure_filename(np_value, run_value))
+    rg_file = os.path.join(out_dir,
+                           structure_filename(np_value, run_value, rg=True))
+    params = [cutoff, cg_beads or 0] + [-1 if f is None else f
+                                        for f in frames]
+    if (not force and os.path.exists(state_file) and os.path.exists(rg_file)
+            and os.path.getmtime(state_file) >= os.path.getmtime(path)):
+        with np.load(state_file) as data:
+            fresh = np.array_equal(data["params"], params)
+        if fresh:
+            state = StructureState.load(state_file)
+            return run_summary(state, pd.read_csv(rg_file)["Rg"]), state
+
+    state, timesteps, rgs = structure_traj(path, cutoff, cg_beads, frames)
+    os.makedirs(out_dir, exist_ok=True)
+    with active().stage("serialize"):
+        state.save(state_file, key=np.array(key, dtype=np.int64),
+                   params=np.array(params, dtype=np.float64))
+        pd.DataFrame({"timestep": timesteps, "Rg": rgs}).to_csv(rg_file,
+                                                                index=False)
+    return run_summary(state, rgs), state
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Radius of gyration and contact maps of a sweep")
+    parser.add_argument("sweep_dir", nargs="?", default=".",
+                        help="Directory containing the runSep* directories")
+    parser.add_argument("-o", "--out-dir", default="structure",
+                        help="Where to write the outputs")
+    parser.add_argument("-j", "--workers", type=int, default=os.cpu_count(),
+                        help="Number of worker processes")
+    parser.add_argument("--l", type=int, nargs="+", dest="l_values",
+                        help="Only process these spacings")
+    parser.add_argument("--cutoff", type=float, default=CONTACT_CUTOFF,
+                        help="Bead-bead contact distance")
+    parser.add_argument("--cg-beads", type=int, default=None,
+                        help="Also accumulate a contact map of blocks of this "
+                             "many consecutive beads")
+    parser.add_argument("--force", action="store_true",
+                        help="Recompute runs whose outputs are up to date")
+    add_frame_args(parser)
+    args = parser.parse_args()
+
+    jobs = scan_sweep(args.sweep_dir)
+    if args.l_values:
+        jobs = jobs[jobs["l"].isin(args.l_values)]
+    if jobs.empty:
+        print(f"No trajectories found in {args.sweep_dir}")
+        return
+    print(f"Found {len(jobs)} trajectories")
+
+    frames = (args.start, args.stop, args.stride)
+    records, states = [], {}
+    with ProcessPoolExecutor(max_workers=args.workers) as pool:
+        futures = {}
+        for job in jobs.itertuples(index=False):
+            key = (job.l, job.Np, job.run)
+            out_dir = os.path.join(args.out_dir, f"runSep{job.l}", "Structure")
+            futures[pool.submit(process_traj, job.path, key, out_dir,
+                                args.cutoff, args.cg_beads, frames,
+                                args.force)] = (key, job.path)
+        for done, future in enumerate(as_completed(futures), 1):
+            key, path = futures[future]
+            name = os.path.basename(path)
+            try:
+                summary, state = future.result()
+            except Exception as e:
+                print(f"[{done}/{len(jobs)}] FAILED {name}: {e}")
+                continue
+            records.append({"l": key[0], "Np": key[1], "run": key[2],
+                            **summary})
+            states.setdefault(key[:2], []).append(state)
+            print(f"[{done}/{len(jobs)}] ok {name}")
+
+    os.makedirs(args.out_dir, exist_ok=True)
+    for (l_val, np_value), run_states in sorted(states.items()):
+        merged = merge_states(run_states)
+        base = os.path.join(args.out_dir, f"structure_l{l_val}_Np_{np_value}")
+        merged.save(base + ".npz", n_runs=np.int64(len(run_states)))
+        np.savetxt(os.path.join(args.out_dir,
+                                f"tu_contacts_l{l_val}_Np_{np_value}.csv"),
+                   merged.contact_probability(), delimiter=",", fmt="%.6g")
+    summary_file = os.path.join(args.out_dir, "structure_summary.csv")
+    summary = pd.DataFrame(records)
+    if not summary.empty:
+        summary = summary.sort_values(["l", "Np", "run"])
+    summary.to_csv(summary_file, index=False)
+    print(f"✓ Saved {summary_file} ({len(summary)} runs) and "
+          f"{len(states)} merged contact maps")
+
+
+if __name__ == "__main__":
+    main()
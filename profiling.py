@@ -0,0 +1,258 @@
+#!/usr/bin/env python3
+# profiling.py
+# Opt-in per-stage timing and throughput counters for the trajectory
+# analysis.
+#
+# The reader (traj_reader.py), the binding kernel (binding.py) and the
+# per-run writers report to the active profile of their process through
+# active().stage(name) and active().count(name). Normally that is a no-op
+# profile, so uninstrumented runs only pay for a shared null context per
+# call. Inside `with profile_traj(path) as prof:` it is a TrajProfile that
+# accumulates
+#   stages : wall time of read (file I/O), parse (float parsing of the atom
+#            block), distance (binding kernel), dwell (dwell-time statistics),
+#            serialize (writing results) and plot (drawing and saving
+#            figures); whatever is left is reported as "other". Every report
+#            has a column for each of these, 0 where the stage did not run
+#   counts : frames analysed, bytes of frame data read, frames skipped by
+#            the frame selection, truncated or malformed frames that ended the
+#            read, and errors
+# and its record() adds frames/s, bytes/s and the memory of the trajectory:
+#   peak_rss_mb     : peak resident set size while the trajectory was
+#                     analysed. On Linux the process high-water mark is reset
+#                     when the profile starts, so this is per trajectory even
+#                     in a reused pool worker; elsewhere it is the peak of the
+#                     process so far, and so covers earlier jobs of the worker
+#   rss_increase_mb : how far that peak rose above the RSS at the start of
+#                     the trajectory (elsewhere: how far this trajectory raised
+#                     the peak of the process, a lower bound) With cprofile=True the hot stage (the frame loop, marked
+# with active().hot()) also runs under cProfile and its stats are dumped to
+# a .prof file next to the report.
+#
+# The entry points (parseTraj.py, computePhiStats2.py, batch_phi.py,
+# pipeline.py, and for the plot stage TU-TF_dist_grapher.py and
+# render_figures.py) take --profile-report FILE to write the records as FILE.json and FILE.csv, and
+# --profile to also dump cProfile output.
+
+import contextlib
+import cProfile
+import io
+import json
+import os
+import pstats
+import re
+import resource
+import sys
+import time
+from collections import defaultdict
+
+import pandas as pd
+
+STAGES = ["read", "parse", "distance", "dwell", "serialize", "plot"]
+COUNTS = ["frames", "bytes", "skipped", "truncated", "errors"]
+TOP_FUNCTIONS = 25  # Functions listed in the cProfile text summary
+
+
+def _proc_status_mb(field):
+    # A VmRSS/VmHWM line of /proc/self/status in MiB, or None off Linux
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith(field + ":"):
+                    return int(line.split()[1]) / 2**10
+    except OSError:
+        pass
+    return None
+
+
+def rss_mb():
+    # Current resident set size, or None if unknown
+    return _proc_status_mb("VmRSS")
+
+
+def reset_peak_rss():
+    # Reset the peak RSS (VmHWM) of this process to its current RSS (Linux
+    # 4.0+). Returns whether it was reset
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+
+def peak_rss_mb():
+    # Peak resident set size of this process since the last reset_peak_rss,
+    # or ever if it cannot be reset (ru_maxrss is in KiB on Linux and bytes
+    # on macOS)
+    peak = _proc_status_mb("VmHWM")
+    if peak is not None:
+        return peak
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 2**20 if sys.platform == "darwin" else peak / 2**10
+
+
+class NullProfile:
+    # The profile used when instrumentation is off
+    enabled = False
+    _null = contextlib.nullcontext()
+
+    def stage(self, name):
+        return self._null
+
+    def hot(self):
+        return self._null
+
+    def count(self, name, n=1):
+        pass
+
+
+class TrajProfile:
+
+    enabled = True
+
+    def __init__(self, path, cprofile=False):
+        self.path = str(path)
+        self.stages = defaultdict(float)
+        self.counts = defaultdict(int)
+        self.cprofile = cProfile.Profile() if cprofile else None
+        # Memory baseline: the RSS now if the peak can be reset, otherwise
+        # the peak of the process so far
+        self.peak_reset = reset_peak_rss()
+        self.rss_start = rss_mb() if self.peak_reset else peak_rss_mb()
+        self.start = time.perf_counter()
+        self.wall = None
+        self.peak_rss = None
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stages[name] += time.perf_counter() - t0
+
+    @contextlib.contextmanager
+    def hot(self):
+        # The frame loop: profiled with cProfile if requested
+        if self.cprofile is None:
+            yield
+            return
+        self.cprofile.enable()
+        try:
+            yield
+        finally:
+            self.cprofile.disable()
+
+    def count(self, name, n=1):
+        self.counts[name] += n
+
+    def finish(self):
+        self.wall = time.perf_counter() - self.start
+        self.peak_rss = peak_rss_mb()
+
+    def record(self):
+        # Flat dict of the stage times, counts and rates
+        wall = self.wall if self.wall is not None \
+            else time.perf_counter() - self.start
+        rec = {"path": self.path, "wall_s": wall}
+        for name in STAGES + sorted(set(self.stages) - set(STAGES)):
+            rec[f"{name}_s"] = self.stages.get(name, 0.0)
+        rec["other_s"] = max(wall - sum(self.stages.values()), 0.0)
+        for name in COUNTS:
+            rec[name] = self.counts.get(name, 0)
+        # Frames parsed but dropped while streaming (compressed dumps)
+        rec["skipped"] += max(self.counts.get("parsed", 0) - rec["frames"], 0)
+        rec["frames_per_s"] = rec["frames"] / wall if wall > 0 else None
+        rec["bytes_per_s"] = rec["bytes"] / wall if wall > 0 else None
+        rec["peak_rss_mb"] = self.peak_rss if self.peak_rss is not None \
+            else peak_rss_mb()
+        rec["rss_increase_mb"] = max(rec["peak_rss_mb"] - self.rss_start, 0.0)
+        return rec
+
+    def dump_cprofile(self, out_dir):
+        # Write <out_dir>/<trajectory>.prof and a text summary of the top
+        # functions by cumulative time. Returns the .prof path
+        if self.cprofile is None:
+            return None
+        os.makedirs(out_dir, exist_ok=True)
+        name = re.sub(r"\.(lammpstrj(\.gz)?|lta|npz|json)$", "",
+                      os.path.basename(self.path))
+        prof_file = os.path.join(out_dir, f"{name}.prof")
+        self.cprofile.dump_stats(prof_file)
+        text = io.StringIO()
+        pstats.Stats(self.cprofile, stream=text).sort_stats(
+            "cumulative").print_stats(TOP_FUNCTIONS)
+        with open(prof_file[:-len(".prof")] + ".prof.txt", 'w') as f:
+            f.write(text.getvalue())
+        return prof_file
+
+
+_NULL = NullProfile()
+_active = _NULL
+
+
+def active():
+    # The profile of the trajectory being analysed, or a no-op profile
+    return _active
+
+
+@contextlib.contextmanager
+def profile_traj(path, enabled=True, cprofile=False):
+    # Make a TrajProfile of path the active profile for the duration of the
+    # block (a NullProfile if not enabled)
+    global _active
+    if not enabled:
+        yield _NULL
+        return
+    prof = TrajProfile(path, cprofile)
+    previous, _active = _active, prof
+    try:
+        yield prof
+    finally:
+        prof.finish()
+        _active = previous
+
+
+def write_report(records, out_base):
+    # Write the per-trajectory records as <out_base>.json (with totals) and
+    # <out_base>.csv. Returns the two paths
+    out_base = re.sub(r"\.(json|csv)$", "", out_base)
+    os.makedirs(os.path.dirname(out_base) or ".", exist_ok=True)
+    df = pd.DataFrame(records)
+    totals = {}
+    if not df.empty:
+        totals = {c: float(df[c].sum()) for c in df.columns
+                  if c.endswith("_s") or c in COUNTS}
+        totals["frames_per_s"] = (totals["frames"] / totals["wall_s"]
+                                  if totals.get("wall_s") else None)
+        totals["bytes_per_s"] = (totals["bytes"] / totals["wall_s"]
+                                 if totals.get("wall_s") else None)
+        totals["peak_rss_mb"] = float(df["peak_rss_mb"].max())
+        totals["rss_increase_mb"] = float(df["rss_increase_mb"].max())
+    with open(out_base + ".json", 'w') as f:
+        json.dump({"trajectories": records, "totals": totals}, f, indent=4)
+    df.to_csv(out_base + ".csv", index=False)
+    return out_base + ".json", out_base + ".csv"
+
+
+def add_profile_args(parser):
+    # Add the --profile-report/--profile options to an argparse parser
+    group = parser.add_argument_group("profiling")
+    group.add_argument("--profile-report", metavar="FILE", default=None,
+                       help="Write per-stage timings and throughput to "
+                            "FILE.json and FILE.csv")
+    group.add_argument("--profile", action="store_true",
+                       help="Also run the frame loop under cProfile and dump "
+                            "the stats next to the report")
+
+
+def report_base(args):
+    # The report path requested on the command line (--profile alone writes
+    # profile_report.json/.csv), or None if profiling is off
+    return args.profile_report or ("profile_report" if args.profile else None)
+
+
+def profile_dir(report):
+    # Directory for the cProfile dumps of a report
+    return re.sub(r"\.(json|csv)$", "", report) + "_cprofile"
@@ -0,0 +1,277 @@
+#!/usr/bin/env python3
+# render_figures.py
+# Render the phi histogram and binding heatmap of every run in a sweep.
+#
+# Batch version of histogram_heatmap.py / histogram_and_heatmap.py: the sweep
+# directory is scanned for TF_on_off_Matrix_Np_{Np}_run_{run}.{npz,json}
+# files (as written by parseTraj.py or batch_phi.py --save-runs) and the
+# figures of all runs are drawn across a pool of worker processes with the
+# non-interactive Agg backend. A figure is only redrawn if it is missing or
+# older than its source files (the on/off matrix and, for the histogram, the
+# TF_phis_*.json next to it), so rerunning after a partial sweep only renders
+# the new runs.
+#
+# The heatmap is drawn with imshow. Matrices with more frames than
+# --max-columns are averaged over blocks of frames first (the colour is then
+# the bound fraction within the block), which keeps the time and memory of a
+# figure independent of the trajectory length.
+#
+# With --profile-report, the time spent loading the matrices ("read") and
+# drawing and saving the figures ("plot") is recorded per run (see
+# profiling.py).
+#
+# Usage: render_figures.py <sweep_dir> [-o figures] [-j N] [--force]
+#            [--profile-report FILE]
+
+import argparse
+import json
+import os
+import re
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import matplotlib
+matplotlib.use("Agg")
+import matplotlib.pyplot as plt
+import numpy as np
+from scipy.stats import gaussian_kde
+
+from onoff_store import OnOff, load_onoff, phi_from_onoff
+from profiling import active, add_profile_args, profile_dir, profile_traj, \
+    report_base, write_report
+
+ONOFF_RE = re.compile(r"^TF_on_off_Matrix_Np_(\d+)_run_(\d+)\.(npz|json)$")
+MAX_COLUMNS = 2000  # Heatmap columns before frames are averaged in blocks
+ROW_CHUNK = 256  # TUs unpacked at a time when downsampling
+DPI = 100
+
+
+def scan_runs(root):
+    # (on_off_file, phi_file or None, Np, run) for every on/off matrix under
+    # root, preferring the .npz file where both formats exist
+    runs = {}
+    for dirpath, _, filenames in os.walk(root):
+        for name in filenames:
+            match = ONOFF_RE.match(name)
+            if not match:
+                continue
+            n_tf, run = int(match.group(1)), int(match.group(2))
+            key = (dirpath, n_tf, run)
+            if key in runs and match.group(3) == "json":
+                continue
+            phi_file = os.path.join(os.path.dirname(dirpath), "TF_Phi_Values",
+                                    f"TF_phis_Np_{n_tf}_run_{run}.json")
+            runs[key] = (os.path.join(dirpath, name),
+                         phi_file if os.path.exists(phi_file) else None,
+                         n_tf, run)
+    return [runs[key] for key in sorted(runs)]
+
+
+def is_stale(figure, sources):
+    # Whether a figure is missing or older than any of its source files
+    if not os.path.exists(figure):
+        return True
+    mtime = os.path.getmtime(figure)
+    return any(os.path.getmtime(s) > mtime for s in sources if s)
+
+
+def load_run(on_off_file):
+    # OnOff of a .npz matrix or of an old JSON matrix (frame indices as
+    # timesteps)
+    if on_off_file.endswith(".npz"):
+        return load_onoff(on_off_file)
+    with open(on_off_file, 'r') as f:
+        on_off_matrix = json.load(f)
+    tu_ids = sorted(on_off_matrix, key=int)
+    matrix = np.array([on_off_matrix[tu] for tu in tu_ids], dtype=bool)
+    return OnOff(np.packbits(matrix, axis=1), matrix.shape[1],
+                 np.array([int(tu) for tu in tu_ids]),
+                 np.arange(matrix.shape[1]), (-1, -1, -1))
+
+
+def downsample(onoff, max_columns=MAX_COLUMNS):
+    # (N_TU, <= max_columns) float32 matrix of the bound fraction in blocks of
+    # consecutive frames, and the block length. Rows are unpacked a chunk at a
+    # time so the full matrix is never held in memory
+    n_frames = onoff.n_frames
+    block = max(1, -(-n_frames // max_columns))
+    starts = np.arange(0, n_frames, block)
+    widths = np.diff(np.append(starts, n_frames))
+    out = np.empty((len(onoff.tu_ids), len(starts)), dtype=np.float32)
+    for r0 in range(0, len(onoff.tu_ids), ROW_CHUNK):
+        rows = np.unpackbits(onoff.bits[r0:r0+ROW_CHUNK], axis=1,
+                             count=n_frames)
+        if block == 1:
+            out[r0:r0+ROW_CHUNK] = rows
+        else:
+            out[r0:r0+ROW_CHUNK] = np.add.reduceat(rows, starts, axis=1,
+                                                   dtype=np.int64) / widths
+    return out, block
+
+
+def plot_histogram(phi_values, np_value, run_value, path):
+    fig, ax = plt.subplots(figsize=(8, 6))
+    ax.hist(phi_values, bins=20, color='blue', edgecolor='black', alpha=0.6)
+    if len(phi_values) > 1 and np.ptp(phi_values) > 0:
+        # Density estimate scaled to counts, as sns.histplot(kde=True)
+        edges = np.histogram_bin_edges(phi_values, bins=20)
+        x = np.linspace(edges[0], edges[-1], 200)
+        ax.plot(x, gaussian_kde(phi_values)(x) * len(phi_values)
+                * (edges[1] - edges[0]), color='blue')
+    ax.set_xlabel("Phi (Activity)")
+    ax.set_ylabel("Count")
+    ax.set_title(f"Histogram of Phi Values for Np={np_value}, Run={run_value}")
+    ax.grid(True)
+    fig.savefig(path, dpi=DPI)
+    plt.close(fig)
+
+
+def time_axis(onoff):
+    # (left, right, label) of the heatmap x axis: the stored timesteps if
+    # they are evenly spaced, otherwise frame indices (also used for old JSON
+    # matrices, which have no timesteps)
+    n_frames = onoff.n_frames
+    timesteps = np.asarray(onoff.timesteps)
+    if (n_frames > 1 and len(timesteps) == n_frames
+            and not np.array_equal(timesteps, np.arange(n_frames))):
+        steps = np.diff(timesteps)
+        if steps[0] > 0 and np.all(steps == steps[0]):
+            return timesteps[0], timesteps[-1] + steps[0], "Timestep"
+    return 0, n_frames, "Frame"
+
+
+def plot_heatmap(onoff, np_value, run_value, path, max_columns=MAX_COLUMNS):
+    image, block = downsample(onoff, max_columns)
+    left, right, label = time_axis(onoff)
+    fig, ax = plt.subplots(figsize=(10, 6))
+    im = ax.imshow(image, aspect="auto", interpolation="nearest",
+                   cmap="coolwarm", vmin=0, vmax=1,
+                   extent=(left, right, len(onoff.tu_ids), 0))
+    fig.colorbar(im, ax=ax)
+    n_ticks = min(len(onoff.tu_ids), 10)
+    ticks = np.linspace(0, len(onoff.tu_ids) - 1, n_ticks).astype(int)
+    ax.set_yticks(ticks + 0.5)
+    ax.set_yticklabels(onoff.tu_ids[ticks])
+    ax.set_xlabel(label if block == 1
+                  else f"{label} (bound fraction per {block} frames)")
+    ax.set_ylabel("Transcription Units (TUs)")
+    ax.set_title(f"Heatmap of TU Binding Over Time (Np={np_value}, Run={run_value})")
+    fig.savefig(path, dpi=DPI)
+    plt.close(fig)
+
+
+def render_run(on_off_file, phi_file, np_value, run_value, out_dir,
+               force=False, max_columns=MAX_COLUMNS, profile=False,
+               cprofile_dir=None):
+    # Worker: draw the stale figures of one run. Returns the paths drawn and
+    # the profile record of the run (None unless profile)
+    with profile_traj(on_off_file, profile,
+                      cprofile_dir is not None) as prof:
+        drawn = _render_run(on_off_file, phi_file, np_value, run_value,
+                            out_dir, force, max_columns)
+    if not prof.enabled:
+        return drawn, None
+    if cprofile_dir is not None:
+        prof.dump_cprofile(cprofile_dir)
+    return drawn, prof.record()
+
+
+def _render_run(on_off_file, phi_file, np_value, run_value, out_dir, force,
+                max_columns):
+    prof = active()
+    os.makedirs(out_dir, exist_ok=True)
+    hist_path = os.path.join(out_dir, f"phi_histogram_Np_{np_value}_run_{run_value}.png")
+    heatmap_path = os.path.join(out_dir, f"heatmap_Np_{np_value}_run_{run_value}.png")
+    draw_hist = force or is_stale(hist_path, [on_off_file, phi_file])
+    draw_heatmap = force or is_stale(heatmap_path, [on_off_file])
+    if not (draw_hist or draw_heatmap):
+        return []
+
+    with prof.stage("read"):
+        onoff = load_run(on_off_file)
+    prof.count("frames", onoff.n_frames)
+    prof.count("bytes", os.path.getsize(on_off_file))
+    drawn = []
+    with prof.hot():
+        if draw_hist:
+            with prof.stage("read"):
+                if phi_file:
+                    with open(phi_file, 'r') as f:
+                        phi_values = np.array(list(json.load(f).values()),
+                                              dtype=float)
+                else:
+                    phi_values = phi_from_onoff(onoff)
+            with prof.stage("plot"):
+                plot_histogram(phi_values, np_value, run_value, hist_path)
+            drawn.append(hist_path)
+        if draw_heatmap:
+            with prof.stage("plot"):
+                plot_heatmap(onoff, np_value, run_value, heatmap_path,
+                             max_columns)
+            drawn.append(heatmap_path)
+    return drawn
+
+
+def output_dir_for(on_off_file, root, out_root):
+    # Mirror the sweep layout: <root>/runSep10/TF_On_Off_Matrices/x.npz is
+    # drawn into <out_root>/runSep10/
+    rel = os.path.relpath(os.path.dirname(os.path.dirname(on_off_file)), root)
+    return os.path.normpath(os.path.join(out_root, rel))
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Render phi histograms and binding heatmaps of a sweep")
+    parser.add_argument("sweep_dir", nargs="?", default=".",
+                        help="Directory searched for TF_On_Off_Matrices")
+    parser.add_argument("-o", "--out-dir", default="figures",
+                        help="Where to write the figures")
+    parser.add_argument("-j", "--workers", type=int, default=os.cpu_count(),
+                        help="Number of worker processes")
+    parser.add_argument("--force", action="store_true",
+                        help="Redraw figures that are up to date")
+    parser.add_argument("--max-columns", type=int, default=MAX_COLUMNS,
+                        help="Heatmap columns before frames are averaged")
+    add_profile_args(parser)
+    args = parser.parse_args()
+    report = report_base(args)
+    cprofile_dir = profile_dir(report) if args.profile else None
+
+    runs = scan_runs(args.sweep_dir)
+    if not runs:
+        print(f"No on/off matrices found under {args.sweep_dir}")
+        return
+    print(f"Found {len(runs)} runs, rendering with {args.workers} workers")
+
+    t0 = time.time()
+    n_drawn, n_failed, records = 0, 0, []
+    with ProcessPoolExecutor(max_workers=args.workers) as pool:
+        futures = {pool.submit(render_run, on_off_file, phi_file, n_tf, run,
+                               output_dir_for(on_off_file, args.sweep_dir,
+                                              args.out_dir),
+                               args.force, args.max_columns,
+                               report is not None, cprofile_dir): on_off_file
+                   for on_off_file, phi_file, n_tf, run in runs}
+        for done, future in enumerate(as_completed(futures), 1):
+            name = os.path.basename(futures[future])
+            try:
+                drawn, record = future.result()
+            except Exception as e:
+                n_failed += 1
+                print(f"[{done}/{len(runs)}] FAILED {name}: {e}")
+                continue
+            n_drawn += len(drawn)
+            if record is not None:
+                records.append(record)
+            status = f"drew {len(drawn)}" if drawn else "up to date"
+            print(f"[{done}/{len(runs)}] {status} {name}")
+
+    print(f"✓ Drew {n_drawn} figures in {time.time() - t0:.1f}s"
+          + (f", {n_failed} runs failed" if n_failed else ""))
+    if report is not None:
+        json_file, csv_file = write_report(records, report)
+        print(f"✓ Saved {json_file} and {csv_file}")
+
+
+if __name__ == "__main__":
+    main()
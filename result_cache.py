@@ -0,0 +1,166 @@
+#!/usr/bin/env python3
+# result_cache.py
+# A persistent on-disk cache of per-trajectory analysis results.
+#
+# Entries are keyed by the trajectory path, its size and modification time
+# (or, optionally, a hash of its contents) and the analysis parameters
+# (binding threshold, sigma, box, ...). A changed or regrown trajectory or a
+# change of parameters therefore gives a new key, and only new or changed
+# trajectories have to be parsed again. Each entry is an .npz file of arrays;
+# an index.json keeps track of sizes and last use so that the cache can be
+# kept below a size limit by evicting the least recently used entries.
+#
+# Usage:
+#   result_cache.py info  [cache_dir]
+#   result_cache.py clear [cache_dir] [trajectory ...]
+
+import hashlib
+import json
+import os
+import sys
+import time
+
+import numpy as np
+
+CACHE_DIR = ".phi_cache"
+CACHE_MAX_MB = 1024
+# Bump when the stored results change meaning so old entries are ignored
+CACHE_VERSION = 1
+
+
+def file_digest(file_path, chunk_size=1 << 24):
+    # SHA-1 of the file contents
+    sha = hashlib.sha1()
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+def cache_key(traj_path, params, content_hash=False):
+    # Key for the results of analysing traj_path with the given parameters
+    traj_path = os.path.abspath(traj_path)
+    stat = os.stat(traj_path)
+    if content_hash:
+        identity = [file_digest(traj_path)]
+    else:
+        identity = [traj_path, stat.st_size, stat.st_mtime_ns]
+    blob = json.dumps([CACHE_VERSION, identity, params_tag(params)])
+    return hashlib.sha1(blob.encode()).hexdigest()
+
+
+def params_tag(params):
+    # Canonical string form of a parameter dict
+    return json.dumps(params, sort_keys=True)
+
+
+class ResultCache:
+    # Size-bounded, least recently used cache of .npz result files
+
+    def __init__(self, cache_dir=CACHE_DIR, max_mb=CACHE_MAX_MB):
+        self.cache_dir = cache_dir
+        self.max_bytes = int(max_mb * 1024 * 1024)
+        self.index_file = os.path.join(cache_dir, "index.json")
+        os.makedirs(cache_dir, exist_ok=True)
+        self.index = self._load_index()
+
+    def _load_index(self):
+        if not os.path.exists(self.index_file):
+            return {}
+        try:
+            with open(self.index_file, 'r') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}  # A corrupt index just means a cold cache
+
+    def _save_index(self):
+        tmp_file = self.index_file + ".tmp"
+        with open(tmp_file, 'w') as f:
+            json.dump(self.index, f, indent=1)
+        os.replace(tmp_file, self.index_file)
+
+    def _entry_file(self, key):
+        return os.path.join(self.cache_dir, key + ".npz")
+
+    def get(self, key):
+        # Return the cached arrays as a dict, or None on a miss. Access times
+        # are only written to disk on the next put() or flush()
+        entry_file = self._entry_file(key)
+        if key not in self.index or not os.path.exists(entry_file):
+            return None
+        with np.load(entry_file) as data:
+            arrays = {name: data[name] for name in data.files}
+        self.index[key]["last_used"] = time.time()
+        return arrays
+
+    def flush(self):
+        self._save_index()
+
+    def put(self, key, traj_path, params, **arrays):
+        # Store arrays for key and evict old entries if over the size limit.
+        # Older entries for the same trajectory and parameters are stale
+        # (the file has changed) and are dropped
+        traj_path, tag = os.path.abspath(traj_path), params_tag(params)
+        for old_key, entry in list(self.index.items()):
+            if entry["traj"] == traj_path and entry.get("params") == tag:
+                self._remove(old_key)
+
+        entry_file = self._entry_file(key)
+        tmp_file = entry_file + ".tmp.npz"
+        np.savez(tmp_file, **arrays)
+        os.replace(tmp_file, entry_file)
+        self.index[key] = {"traj": traj_path, "params": tag,
+                           "bytes": os.path.getsize(entry_file),
+                           "last_used": time.time()}
+        self.evict()
+        self._save_index()
+
+    def evict(self, max_bytes=None):
+        # Drop least recently used entries until the cache fits max_bytes
+        max_bytes = self.max_bytes if max_bytes is None else max_bytes
+        total = sum(e["bytes"] for e in self.index.values())
+        for key in sorted(self.index, key=lambda k: self.index[k]["last_used"]):
+            if total <= max_bytes:
+                break
+            total -= self.index[key]["bytes"]
+            self._remove(key)
+
+    def _remove(self, key):
+        self.index.pop(key, None)
+        try:
+            os.remove(self._entry_file(key))
+        except FileNotFoundError:
+            pass
+
+    def invalidate(self, traj_paths=None):
+        # Remove all entries, or only those for the given trajectories.
+        # Returns the number of entries removed
+        if traj_paths is None:
+            keys = list(self.index)
+        else:
+            paths = {os.path.abspath(p) for p in traj_paths}
+            keys = [k for k, e in self.index.items() if e["traj"] in paths]
+        for key in keys:
+            self._remove(key)
+        self._save_index()
+        return len(keys)
+
+    def info(self):
+        return {"entries": len(self.index),
+                "bytes": sum(e["bytes"] for e in self.index.values()),
+                "max_bytes": self.max_bytes}
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2 or sys.argv[1] not in ("info", "clear"):
+        print("Usage: result_cache.py info|clear [cache_dir] [trajectory ...]")
+        sys.exit(1)
+
+    cache = ResultCache(sys.argv[2] if len(sys.argv) > 2 else CACHE_DIR)
+    if sys.argv[1] == "info":
+        info = cache.info()
+        print(f"{info['entries']} entries, {info['bytes'] / 1e6:.1f} MB "
+              f"(limit {info['max_bytes'] / 1e6:.0f} MB)")
+    else:
+        n = cache.invalidate(sys.argv[3:] or None)
+        print(f"Removed {n} cache entries")
@@ -0,0 +1,314 @@
+#!/usr/bin/env python3
+# results_store.py
+# One columnar store for the phi results of all sweeps, replacing the mix of
+# TF_Phi_Values/*.json, phi_statistics.csv and phi_stats_l{l}_r{n}.csv.
+#
+# Three tables, keyed by (Ns, l, Np, run):
+#   per_tu      phi of every TU (tu = position of the TU along the chain, so
+#               the TU bead id is (tu+1)*l in the lammps_init.sh layout),
+#               partitioned by Ns/l/Np
+#   runs        run-level summaries (n_tus, phi_mean, phi_std, ...),
+#               partitioned by Ns/l
+#   thresholds  the same summaries for every binding threshold of a
+#               multi-threshold pass (batch_phi.py --thresholds), keyed by
+#               (Ns, l, Np, run, threshold) and partitioned by Ns/l
+# Each partition is a single file under <root>/<table>/Ns=../l=../[Np=..]/,
+# Parquet if pyarrow or fastparquet is installed and a NumPy .npz with one
+# array per column otherwise. Partition columns are stored only in the
+# directory names (hive layout), so pandas/pyarrow can also read the Parquet
+# tables directly. Writes are upserts: rows with the same key replace the old
+# ones (all rows of a rerun run, or of a rerun run and threshold), so rerunning
+# an analysis never duplicates rows. load() reads only the
+# partitions matching the filters and only the requested columns.
+#
+# Usage: results_store.py info [--store DIR]
+#        results_store.py query runs [--l 10 20] [--columns Np phi_mean]
+#        results_store.py import-csv phi_stats_l10_r30.csv --ns 30 --l 10
+#        results_store.py import-phi-dir TF_Phi_Values --ns 30 --l 30
+
+import argparse
+import glob
+import importlib
+import json
+import os
+import re
+import sys
+
+import numpy as np
+import pandas as pd
+
+RESULTS_DIR = "results_store"
+RUN_KEY = ["Ns", "l", "Np", "run"]
+
+TABLES = {
+    "per_tu": {"partition": ["Ns", "l", "Np"],
+               "key": ["Ns", "l", "Np", "run", "tu"]},
+    "runs": {"partition": ["Ns", "l"],
+             "key": ["Ns", "l", "Np", "run"]},
+    # Rows replaced by an upsert are those of the same run and threshold, so
+    # sweeps over different threshold ranges add up
+    "thresholds": {"partition": ["Ns", "l"],
+                   "key": ["Ns", "l", "Np", "run", "threshold"],
+                   "replace": ["Ns", "l", "Np", "run", "threshold"]},
+}
+
+# Column names of the older CSV schemas
+LEGACY_COLUMNS = {"TFs": "Np", "Run": "run", "Mean": "phi_mean",
+                  "Standard Deviation": "phi_std", "Threshold": "threshold"}
+
+
+def _parquet_engine():
+    for name in ("pyarrow", "fastparquet"):
+        try:
+            importlib.import_module(name)
+            return name
+        except ImportError:
+            pass
+    return None
+
+
+FORMAT = "parquet" if _parquet_engine() else "npz"
+
+
+def normalize_stats(df):
+    # Bring a phi_stats_l*.csv or phi_statistics.csv table to the store's
+    # column names (Np, run, phi_mean, phi_std)
+    return df.rename(columns=LEGACY_COLUMNS)
+
+
+def summarize_phi(phi):
+    phi = np.asarray(phi, dtype=np.float64)
+    return {"n_tus": len(phi), "phi_mean": float(np.mean(phi)),
+            "phi_std": float(np.std(phi))}
+
+
+def _read_file(path, columns=None):
+    if path.endswith(".parquet"):
+        return pd.read_parquet(path, columns=columns)
+    with np.load(path) as data:
+        names = data.files if columns is None else [c for c in columns
+                                                   if c in data.files]
+        return pd.DataFrame({name: data[name] for name in names})
+
+
+def _write_file(path_base, df):
+    # Write path_base.{parquet,npz} atomically and remove the other format
+    path = f"{path_base}.{FORMAT}"
+    tmp_file = f"{path_base}.tmp.{FORMAT}"
+    if FORMAT == "parquet":
+        df.to_parquet(tmp_file, index=False)
+    else:
+        np.savez(tmp_file, **{c: df[c].to_numpy() for c in df.columns})
+    os.replace(tmp_file, path)
+    for other in ("parquet", "npz"):
+        if other != FORMAT and os.path.exists(f"{path_base}.{other}"):
+            os.remove(f"{path_base}.{other}")
+
+
+class ResultsStore:
+
+    def __init__(self, root=RESULTS_DIR):
+        self.root = root
+
+    def _partition_dir(self, table, values):
+        parts = [f"{c}={v}" for c, v in zip(TABLES[table]["partition"],
+                                            values)]
+        return os.path.join(self.root, table, *parts)
+
+    def partitions(self, table, **filters):
+        # (values, file) of the stored partitions matching the filters on
+        # partition columns (a value or a list of values each)
+        partition = TABLES[table]["partition"]
+        table_dir = os.path.join(self.root, table)
+        pattern = [f"{column}=*" for column in partition]
+        found = []
+        for path in sorted(glob.glob(os.path.join(table_dir, *pattern,
+                                                  "part.*"))):
+            if not path.endswith((".parquet", ".npz")) or ".tmp." in path:
+                continue
+            dirs = os.path.relpath(path, table_dir).split(os.sep)[:-1]
+            values = [int(d.split("=", 1)[1]) for d in dirs]
+            if all(_matches(v, filters.get(c))
+                   for c, v in zip(partition, values)):
+                found.append((values, path))
+        return found
+
+    def upsert(self, table, df):
+        # Insert rows, replacing all stored rows of the same runs, or of the
+        # same values of the table's "replace" columns (so that a rerun never
+        # leaves stale rows behind). Returns the number of rows written
+        partition, key = TABLES[table]["partition"], TABLES[table]["key"]
+        missing = [c for c in key if c not in df.columns]
+        if missing:
+            raise ValueError(f"Missing key columns {missing} for {table}")
+        run_cols = [c for c in TABLES[table].get("replace", RUN_KEY)
+                    if c not in partition]
+        rest = [c for c in key if c not in partition]
+        for values, new in df.groupby(partition):
+            path_base = os.path.join(self._partition_dir(table, values),
+                                     "part")
+            os.makedirs(os.path.dirname(path_base), exist_ok=True)
+            new = new.drop(columns=partition).drop_duplicates(
+                subset=rest, keep="last")
+            old = [p for p in (f"{path_base}.parquet", f"{path_base}.npz")
+                   if os.path.exists(p)]
+            if old:
+                stored = _read_file(old[0])
+                replaced = pd.MultiIndex.from_frame(stored[run_cols]).isin(
+                    pd.MultiIndex.from_frame(new[run_cols]))
+                new = pd.concat([stored[~replaced], new], ignore_index=True)
+            _write_file(path_base, new.sort_values(rest)
+                        .reset_index(drop=True))
+        return len(df)
+
+    def upsert_runs(self, runs, **extra):
+        # Store per-TU phi and summaries for {(Ns, l, Np, run): phi}; extra
+        # columns (e.g. binding_threshold) are added to the summary rows
+        per_tu, summaries = [], []
+        for (ns, l_val, n_tf, run), phi in runs.items():
+            phi = np.asarray(phi, dtype=np.float64)
+            per_tu.append(pd.DataFrame({"Ns": ns, "l": l_val, "Np": n_tf,
+                                        "run": run,
+                                        "tu": np.arange(len(phi)),
+                                        "phi": phi}))
+            summaries.append({"Ns": ns, "l": l_val, "Np": n_tf, "run": run,
+                              **summarize_phi(phi), **extra})
+        if not runs:
+            return 0
+        self.upsert("per_tu", pd.concat(per_tu, ignore_index=True))
+        return self.upsert("runs", pd.DataFrame(summaries))
+
+    def upsert_thresholds(self, runs, thresholds, **extra):
+        # Store summaries for {(Ns, l, Np, run): (K, N_TU) phi} computed for
+        # the K binding thresholds
+        thresholds = np.round(np.asarray(thresholds, dtype=np.float64), 6)
+        summaries = []
+        for (ns, l_val, n_tf, run), phi in runs.items():
+            for threshold, row in zip(thresholds, np.asarray(phi)):
+                summaries.append({"Ns": ns, "l": l_val, "Np": n_tf,
+                                  "run": run, "threshold": threshold,
+                                  **summarize_phi(row), **extra})
+        if not summaries:
+            return 0
+        return self.upsert("thresholds", pd.DataFrame(summaries))
+
+    def load(self, table, columns=None, **filters):
+        # Rows of a table, reading only the partitions that match the
+        # filters and only the requested columns. Filters on any column take
+        # a single value or a list of values
+        partition = TABLES[table]["partition"]
+        frames = []
+        for values, path in self.partitions(table, **filters):
+            read_cols = None
+            if columns is not None:
+                read_cols = [c for c in columns if c not in partition]
+                read_cols += [c for c, v in filters.items()
+                              if v is not None and c not in partition
+                              and c not in read_cols]
+                # At least one stored column, for the number of rows
+                read_cols = read_cols or TABLES[table]["key"][-1:]
+            df = _read_file(path, read_cols)
+            for column, value in zip(partition, values):
+                if columns is None or column in columns:
+                    df[column] = value
+            for column, value in filters.items():
+                if column not in partition and value is not None:
+                    df = df[df[column].isin(np.atleast_1d(value))]
+            frames.append(df)
+        if not frames:
+            return pd.DataFrame(columns=columns)
+        df = pd.concat(frames, ignore_index=True)
+        if columns is None:
+            ordered = TABLES[table]["key"]
+            columns = ordered + [c for c in df.columns if c not in ordered]
+        return df[list(columns)]
+
+    def info(self):
+        # Rows and partitions per table
+        summary = {}
+        for table in TABLES:
+            parts = self.partitions(table)
+            rows = sum(len(_read_file(path, TABLES[table]["key"][-1:]))
+                       for _, path in parts)
+            summary[table] = {"partitions": len(parts), "rows": rows}
+        return summary
+
+
+def _matches(value, wanted):
+    return wanted is None or value in np.atleast_1d(wanted)
+
+
+def import_stats_csv(store, csv_file, ns, l_val):
+    # Import the run summaries of a phi_stats_l*.csv/phi_statistics.csv file
+    df = normalize_stats(pd.read_csv(csv_file)).dropna(
+        subset=["phi_mean", "phi_std"])
+    df = df[["Np", "run", "phi_mean", "phi_std"]].assign(Ns=ns, l=l_val)
+    return store.upsert("runs", df.drop_duplicates(["Np", "run"],
+                                                   keep="last"))
+
+
+def import_phi_dir(store, phi_dir, ns, l_val):
+    # Import the per-TU phi of the TF_phis_Np_{}_run_{}.json files in phi_dir
+    runs = {}
+    for path in glob.glob(os.path.join(phi_dir, "*.json")):
+        match = re.search(r"Np_(\d+)_run_(\d+)", os.path.basename(path))
+        if not match:
+            continue
+        with open(path, 'r') as f:
+            phi_dict = {int(tu): phi for tu, phi in json.load(f).items()}
+        n_tf, run = map(int, match.groups())
+        runs[(ns, l_val, n_tf, run)] = [phi_dict[tu]
+                                        for tu in sorted(phi_dict)]
+    return store.upsert_runs(runs)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Query and fill the "
+                                                 "results store")
+    parser.add_argument("--store", default=RESULTS_DIR,
+                        help="Store directory")
+    sub = parser.add_subparsers(dest="command", required=True)
+    sub.add_parser("info", help="Rows and partitions per table")
+
+    query = sub.add_parser("query", help="Print (part of) a table")
+    query.add_argument("table", choices=list(TABLES))
+    query.add_argument("--columns", nargs="+", default=None)
+    for column in ("Ns", "l", "Np", "run"):
+        query.add_argument(f"--{column}", type=int, nargs="+", default=None)
+    query.add_argument("-o", "--out", default=None,
+                       help="Write the rows to this CSV instead")
+
+    for name, help_text in (("import-csv", "Import a phi_stats CSV"),
+                            ("import-phi-dir", "Import TF_phis_*.json")):
+        imp = sub.add_parser(name, help=help_text)
+        imp.add_argument("path")
+        imp.add_argument("--ns", type=int, required=True)
+        imp.add_argument("--l", type=int, required=True)
+    args = parser.parse_args()
+
+    store = ResultsStore(args.store)
+    if args.command in ("info", "query") and not os.path.isdir(args.store):
+        print(f"No store at {args.store}")
+        sys.exit(1)
+    if args.command == "info":
+        for table, summary in store.info().items():
+            print(f"{table}: {summary['rows']} rows in "
+                  f"{summary['partitions']} partitions")
+    elif args.command == "query":
+        filters = {c: getattr(args, c) for c in ("Ns", "l", "Np", "run")}
+        df = store.load(args.table, args.columns, **filters)
+        if args.out:
+            df.to_csv(args.out, index=False)
+            print(f"Saved {len(df)} rows to {args.out}")
+        else:
+            print(df.to_string(index=False))
+    elif args.command == "import-csv":
+        n = import_stats_csv(store, args.path, args.ns, args.l)
+        print(f"Imported {n} runs from {args.path}")
+    else:
+        n = import_phi_dir(store, args.path, args.ns, args.l)
+        print(f"Imported {n} runs from {args.path}")
+
+
+if __name__ == "__main__":
+    main()
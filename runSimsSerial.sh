@@ -10,8 +10,15 @@ n_max=$4      # Maximum number of proteins (e.g., 100)
 n_runs=$5     # Number of repetitions per protein count
 out_dir=$6   # Directory to store trajectory files
 
+# Runs are done one after another; run_sweep.py runs the same sweep with
+# several LAMMPS processes at once and can resume an interrupted sweep
+
 original_dir=$(pwd)
 
+# Set FOLLOW_PHI=1 to compute running phi statistics while each simulation
+# is running (see follow_phi.py)
+follow_phi=${FOLLOW_PHI:-0}
+
 # Looping over protein counts
 for nprots in $(seq $n_min 10 $n_max); do
     # Looping for multiple runs at protein count
@@ -51,8 +58,25 @@ for nprots in $(seq $n_min 10 $n_max); do
         fi
 
         chmod +x "$script_name"
+
+        if [[ $follow_phi == 1 ]]; then
+            python3 "${original_dir}/follow_phi.py" \
+                "pos_noise_Ns_${nsites}_l_${sep}_Np_${nprots}_run_${run}.lammpstrj" \
+                > "follow_phi.log" 2>&1 &
+            follow_pid=$!
+        fi
+
         ./"$script_name"
 
+        if [[ $follow_phi == 1 ]]; then
+            # The follower waits for the dump without a time limit, so stop
+            # it if LAMMPS exited without creating one
+            if [[ ! -e "pos_noise_Ns_${nsites}_l_${sep}_Np_${nprots}_run_${run}.lammpstrj" ]]; then
+                kill $follow_pid 2>/dev/null
+            fi
+            wait $follow_pid
+        fi
+
         cd "$original_dir"
 
     done
@@ -0,0 +1,217 @@
+#!/usr/bin/env python3
+# run_sweep.py
+# Parallel replacement for runSimsSerial.sh.
+#
+# Builds the full (Ns, l, Np, run) parameter grid, generates the inputs of
+# every simulation with lammps_init.py and runs up to --jobs LAMMPS processes
+# at once, each pinned to its own set of --threads-per-job cores. The state of
+# every job (pending/running/done/failed) is kept in sweep_state.json in the
+# output directory, so an interrupted sweep can simply be restarted: runs
+# whose .restart and pos_*.lammpstrj outputs exist are not run again.
+#
+# Usage: run_sweep.py --nsites 30 --sep 10 20 --np-min 10 --np-max 100 \
+#            --runs 30 --jobs 32 out_dir
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+
+from lammps_init import add_init_args, init_options, run_name, write_inputs
+
+LMP_EXE = os.environ.get("LMP_EXE", "/usr/bin/lmp")
+STATE_FILE = "sweep_state.json"
+
+PENDING, RUNNING, DONE, FAILED = "pending", "running", "done", "failed"
+
+
+def build_grid(nsites, seps, np_values, n_runs):
+    return [(nsites, sep, nprots, run)
+            for sep in seps for nprots in np_values
+            for run in range(1, n_runs + 1)]
+
+
+def is_complete(sim_dir, name):
+    # A run is finished once LAMMPS has written the restart file at the very
+    # end of the .lam script and the dump is not empty
+    pos_file = os.path.join(sim_dir, f"pos_{name}.lammpstrj")
+    return (os.path.exists(os.path.join(sim_dir, f"{name}.restart"))
+            and os.path.exists(pos_file) and os.path.getsize(pos_file) > 0)
+
+
+def generate_inputs(params, out_dir, lmp_exe=LMP_EXE, init_opts=None):
+    # Write the inputs unless they already exist (regenerating would draw
+    # new random seeds)
+    name = run_name(*params)
+    sim_dir = os.path.join(out_dir, name)
+    if os.path.exists(os.path.join(sim_dir, f"{name}.lam")):
+        return sim_dir
+    sim_dir, _ = write_inputs(*params, out_dir, lmp_exe, **(init_opts or {}))
+    return sim_dir
+
+
+def core_slots(n_jobs, threads_per_job):
+    # Split the cores available to this process into n_jobs disjoint sets
+    cores = sorted(os.sched_getaffinity(0))
+    n_slots = max(1, min(n_jobs, len(cores) // threads_per_job))
+    return [cores[k * threads_per_job:(k + 1) * threads_per_job]
+            for k in range(n_slots)]
+
+
+class SweepState:
+    # Job states persisted as JSON after every change
+
+    def __init__(self, path):
+        self.path = path
+        self.jobs = {}
+        if os.path.exists(path):
+            with open(path, 'r') as f:
+                self.jobs = json.load(f)
+
+    def save(self):
+        tmp_file = self.path + ".tmp"
+        with open(tmp_file, 'w') as f:
+            json.dump(self.jobs, f, indent=1)
+        os.replace(tmp_file, self.path)
+
+    def set(self, name, status, **info):
+        self.jobs.setdefault(name, {}).update(status=status, **info)
+        self.save()
+
+    def status(self, name):
+        return self.jobs.get(name, {}).get("status", PENDING)
+
+    def counts(self):
+        counts = {}
+        for job in self.jobs.values():
+            counts[job["status"]] = counts.get(job["status"], 0) + 1
+        return counts
+
+
+def start_job(name, sim_dir, lmp_exe, cores, pin):
+    env = dict(os.environ, OMP_NUM_THREADS=str(len(cores)))
+    preexec = (lambda: os.sched_setaffinity(0, cores)) if pin else None
+    return subprocess.Popen(
+        [lmp_exe, "-in", f"{name}.lam", "-screen", f"{name}.slog",
+         "-log", f"{name}.log"],
+        cwd=sim_dir, env=env, preexec_fn=preexec,
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+def run_sweep(grid, out_dir, lmp_exe=LMP_EXE, n_jobs=1, threads_per_job=1,
+              pin=True, retry_failed=False, poll=2.0, init_opts=None):
+    os.makedirs(out_dir, exist_ok=True)
+    out_dir = os.path.abspath(out_dir)
+    state = SweepState(os.path.join(out_dir, STATE_FILE))
+
+    # Work out what still needs running. Jobs left "running" by an
+    # interrupted sweep are checked against their outputs like any other
+    queue = []
+    for params in grid:
+        name = run_name(*params)
+        sim_dir = os.path.join(out_dir, name)
+        if is_complete(sim_dir, name):
+            if state.status(name) != DONE:
+                state.set(name, DONE)
+        elif state.status(name) == FAILED and not retry_failed:
+            continue
+        else:
+            state.set(name, PENDING)
+            queue.append(params)
+    print(f"{len(grid)} runs in grid, {len(queue)} to run", flush=True)
+
+    slots = core_slots(n_jobs, threads_per_job)
+    free = list(range(len(slots)))
+    running = {}  # slot -> (name, sim_dir, Popen)
+
+    try:
+        while queue or running:
+            while queue and free:
+                params = queue.pop(0)
+                name = run_name(*params)
+                try:
+                    sim_dir = generate_inputs(params, out_dir, lmp_exe,
+                                              init_opts)
+                except (OSError, ValueError) as e:
+                    state.set(name, FAILED, error=f"input generation: {e}")
+                    print(f"FAILED {name} (input generation)", flush=True)
+                    continue
+                slot = free.pop(0)
+                proc = start_job(name, sim_dir, lmp_exe, slots[slot], pin)
+                running[slot] = (name, sim_dir, proc)
+                state.set(name, RUNNING, cores=slots[slot],
+                          started=time.time())
+                print(f"started {name} on cores {slots[slot]}", flush=True)
+
+            time.sleep(poll)
+            for slot, (name, sim_dir, proc) in list(running.items()):
+                returncode = proc.poll()
+                if returncode is None:
+                    continue
+                del running[slot]
+                free.append(slot)
+                if returncode == 0 and is_complete(sim_dir, name):
+                    state.set(name, DONE, finished=time.time())
+                    status = "done"
+                else:
+                    state.set(name, FAILED, returncode=returncode,
+                              finished=time.time())
+                    status = f"FAILED (exit code {returncode})"
+                counts = state.counts()
+                print(f"{status} {name} [{counts.get(DONE, 0)} done, "
+                      f"{counts.get(FAILED, 0)} failed, "
+                      f"{len(running)} running, {len(queue)} queued]",
+                      flush=True)
+    except KeyboardInterrupt:
+        # Leave interrupted runs pending so the next invocation redoes them
+        for name, _, proc in running.values():
+            proc.terminate()
+            proc.wait()
+            state.set(name, PENDING)
+        print("Interrupted, state saved")
+        raise
+
+    return state.counts()
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Run a LAMMPS parameter sweep in parallel")
+    parser.add_argument("out_dir", help="Directory for the simulation runs")
+    parser.add_argument("--nsites", type=int, default=30,
+                        help="Number of TUs")
+    parser.add_argument("--sep", type=int, nargs="+", required=True,
+                        help="TU separations (l) to simulate")
+    parser.add_argument("--np-min", type=int, default=10)
+    parser.add_argument("--np-max", type=int, default=100)
+    parser.add_argument("--np-step", type=int, default=10)
+    parser.add_argument("--runs", type=int, required=True,
+                        help="Number of repeats per (l, Np)")
+    parser.add_argument("-j", "--jobs", type=int, default=os.cpu_count(),
+                        help="Number of simultaneous LAMMPS processes")
+    parser.add_argument("--threads-per-job", type=int, default=1,
+                        help="Cores (and OMP threads) per LAMMPS process")
+    parser.add_argument("--no-pin", action="store_true",
+                        help="Do not pin LAMMPS processes to cores")
+    parser.add_argument("--lmp-exe", default=LMP_EXE,
+                        help="LAMMPS executable")
+    parser.add_argument("--retry-failed", action="store_true",
+                        help="Also rerun jobs that failed previously")
+    add_init_args(parser)
+    args = parser.parse_args()
+
+    np_values = range(args.np_min, args.np_max + 1, args.np_step)
+    grid = build_grid(args.nsites, args.sep, np_values, args.runs)
+    counts = run_sweep(grid, args.out_dir, args.lmp_exe, args.jobs,
+                       args.threads_per_job, not args.no_pin,
+                       args.retry_failed, init_opts=init_options(args))
+    print(f"Sweep finished: {counts.get(DONE, 0)} done, "
+          f"{counts.get(FAILED, 0)} failed")
+    if counts.get(FAILED, 0):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+# synthetic_traj.py
+# Write synthetic trajectories in the same "dump custom" layout as the
+# pos_*.lammpstrj files from lammps_init.sh
+# (dump ... custom id type xs ys zs ix iy iz), for testing and benchmarking
+# the analysis scripts without running LAMMPS.
+#
+# The system has the same composition as a real run: a chain of
+# sep*(nsites+1)-1 beads with a TU (type 2) every sep beads, and nprots
+# proteins split into ON (type 3) and OFF (type 4). Beads start from
+# createPolymer.create_polymer and move by Gaussian steps between frames, so
+# image flags change as beads cross the periodic boundaries. Proteins switch
+# between ON and OFF with probability switch_prob per frame, and the first
+# n_bound proteins stay within binding distance of a TU so that there are
+# binding events to analyse. Atoms are written in a shuffled order each frame,
+# as LAMMPS does not sort the dump by id.
+#
+# Usage: synthetic_traj.py <out_file> [--frames N] [--nsites N] [--sep L]
+#            [--nprots N] [--seed S]     # a .gz out_file is gzipped
+
+import argparse
+import gzip
+
+import numpy as np
+
+from createPolymer import create_polymer
+
+BOX_SIZE = 100.0
+DUMP_EVERY = 100000  # Timesteps between frames, as in lammps_init.sh
+
+
+def synthetic_frames(n_frames, nsites=30, sep=10, nprots=50,
+                     box_size=BOX_SIZE, step=0.3, switch_prob=0.01,
+                     n_bound=None, seed=0):
+    # Generator of (ids, types, unwrapped coords) for each frame
+    rng = np.random.default_rng(seed)
+    npolys = sep*(nsites+1)-1
+    _, coords = create_polymer(npolys, nprots, 1.0,
+                               (box_size, box_size, box_size), rng=rng)
+    ids = np.arange(1, npolys+nprots+1)
+    nn = ids[:npolys]-sep
+    types = np.concatenate([np.where((nn >= 0) & (nn % sep == 0), 2, 1),
+                            np.where(np.arange(nprots) < nprots//2, 3, 4)])
+    tus = np.flatnonzero(types == 2)
+    if n_bound is None:
+        n_bound = nprots//4
+    targets = rng.choice(tus, n_bound)
+
+    for _ in range(n_frames):
+        coords += rng.normal(scale=step, size=coords.shape)
+        # Keep the bound proteins next to their TU
+        offset = rng.normal(size=(n_bound, 3))
+        offset *= rng.uniform(1.0, 3.0, (n_bound, 1))/np.linalg.norm(
+            offset, axis=1, keepdims=True)
+        coords[npolys:npolys+n_bound] = coords[targets]+offset
+        switch = rng.random(nprots) < switch_prob
+        types[npolys:][switch] = 7-types[npolys:][switch]  # 3 <-> 4
+        yield ids, types, coords
+
+
+def format_frame(timestep, ids, types, coords, box_size=BOX_SIZE, order=None):
+    # One frame as LAMMPS writes it (%g for the scaled coordinates)
+    lo = -box_size/2.0
+    scaled = (coords-lo)/box_size
+    images = np.floor(scaled)
+    scaled -= images
+    if order is not None:
+        ids, types, scaled, images = (ids[order], types[order],
+                                      scaled[order], images[order])
+    n = len(ids)
+    bounds = f"{lo:.16e} {-lo:.16e}\n"
+    header = (f"ITEM: TIMESTEP\n{timestep}\nITEM: NUMBER OF ATOMS\n{n}\n"
+              f"ITEM: BOX BOUNDS pp pp pp\n{bounds*3}"
+              f"ITEM: ATOMS id type xs ys zs ix iy iz\n")
+    data = np.column_stack([ids, types, scaled, images])
+    return header+("%d %d %g %g %g %d %d %d\n"*n) % tuple(data.ravel())
+
+
+def write_synthetic_traj(out_file, n_frames, nsites=30, sep=10, nprots=50,
+                         box_size=BOX_SIZE, seed=0, shuffle=True, **kwargs):
+    # Write a synthetic trajectory, gzipped if out_file ends in .gz
+    rng = np.random.default_rng(seed+1)
+    opener = gzip.open if str(out_file).endswith(".gz") else open
+    frames = synthetic_frames(n_frames, nsites, sep, nprots, box_size,
+                              seed=seed, **kwargs)
+    with opener(out_file, "wt") as f:
+        for k, (ids, types, coords) in enumerate(frames):
+            order = rng.permutation(len(ids)) if shuffle else None
+            f.write(format_frame(k*DUMP_EVERY, ids, types, coords, box_size,
+                                 order))
+    return out_file
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Write a synthetic LAMMPS trajectory")
+    parser.add_argument("out_file", help="Output .lammpstrj (or .gz) file")
+    parser.add_argument("--frames", type=int, default=1000)
+    parser.add_argument("--nsites", type=int, default=30,
+                        help="Number of TUs")
+    parser.add_argument("--sep", type=int, default=10,
+                        help="Linear separation between TUs")
+    parser.add_argument("--nprots", type=int, default=50,
+                        help="Number of proteins")
+    parser.add_argument("--box-size", type=float, default=BOX_SIZE)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--sorted", action="store_true",
+                        help="Write atoms in id order")
+    args = parser.parse_args()
+
+    write_synthetic_traj(args.out_file, args.frames, args.nsites, args.sep,
+                         args.nprots, args.box_size, args.seed,
+                         not args.sorted)
+    print(f"Saved {args.frames} frames to {args.out_file}")
+
+
+if __name__ == "__main__":
+    main()
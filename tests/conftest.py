@@ -0,0 +1,20 @@
+# conftest.py
+# The analysis modules are scripts at the top of the repository; make them
+# importable from the tests, and provide a small synthetic trajectory.
+
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from synthetic_traj import write_synthetic_traj  # noqa: E402
+
+
+@pytest.fixture
+def dump(tmp_path):
+    # A 12-frame trajectory with 3 TUs and 10 proteins
+    return str(write_synthetic_traj(tmp_path / "pos_test.lammpstrj", 12,
+                                    nsites=3, sep=5, nprots=10,
+                                    switch_prob=0.2, seed=3))
@@ -0,0 +1,45 @@
+# test_batch_phi.py
+# Merging of per-run results into the phi_stats CSV files of batch_phi.py.
+
+import pandas as pd
+
+from batch_phi import merge_results
+
+
+def results(rows):
+    return pd.DataFrame(rows, columns=["Ns", "l", "TFs", "Run", "phi_mean",
+                                       "phi_std", "File"])
+
+
+def test_merge_replaces_reruns(tmp_path):
+    merge_results(results([(30, 10, 10, 1, 0.1, 0.1, "a"),
+                           (30, 10, 20, 1, 0.2, 0.1, "b")]), str(tmp_path))
+    merge_results(results([(30, 10, 10, 1, 0.5, 0.1, "a")]), str(tmp_path))
+    df = pd.read_csv(tmp_path / "phi_stats_l10_r30.csv")
+    assert df[["TFs", "phi_mean"]].values.tolist() == [[10, 0.5], [20, 0.2]]
+
+
+def test_merge_keeps_each_ns(tmp_path):
+    # Two Ns at the same l must not overwrite each other
+    merge_results(results([(30, 10, 10, 1, 0.1, 0.1, "a"),
+                           (50, 10, 10, 1, 0.9, 0.1, "b")]), str(tmp_path))
+    for ns, phi in ((30, 0.1), (50, 0.9)):
+        df = pd.read_csv(tmp_path / f"phi_stats_Ns{ns}_l10_r30.csv")
+        assert df["Ns"].tolist() == [ns] and df["phi_mean"].tolist() == [phi]
+
+    # A single-Ns merge into a file holding another Ns keeps both
+    merge_results(results([(30, 10, 10, 1, 0.1, 0.1, "a")]), str(tmp_path))
+    merge_results(results([(50, 10, 10, 1, 0.9, 0.1, "b")]), str(tmp_path))
+    df = pd.read_csv(tmp_path / "phi_stats_l10_r30.csv")
+    assert sorted(df["Ns"].tolist()) == [30, 50]
+
+
+def test_merge_into_file_without_ns(tmp_path):
+    # Files written by computePhiStats2.py have no Ns column
+    pd.DataFrame({"TFs": [10, 20], "Run": [1, 1], "phi_mean": [0.1, 0.2],
+                  "phi_std": [0.1, 0.1], "File": ["a", "b"]}).to_csv(
+        tmp_path / "phi_stats_l10_r30.csv", index=False)
+    merge_results(results([(30, 10, 10, 1, 0.5, 0.1, "a")]), str(tmp_path))
+    df = pd.read_csv(tmp_path / "phi_stats_l10_r30.csv")
+    assert df[["Ns", "TFs", "phi_mean"]].values.tolist() == \
+        [[30, 10, 0.5], [30, 20, 0.2]]
@@ -0,0 +1,67 @@
+# test_binding.py
+# The binding kernel of binding.py against direct loops over TU-protein
+# pairs.
+
+import numpy as np
+import pytest
+
+from binding import nearest_tf_distances, parse_thresholds, threshold_counts
+
+
+def brute_nearest(tu_scaled, prot_scaled, on_mask, lengths):
+    F, ntu, _ = tu_scaled.shape
+    out = np.full((F, ntu), np.inf)
+    for f in range(F):
+        for i in range(ntu):
+            for j in np.flatnonzero(on_mask[f]):
+                d = tu_scaled[f, i] - prot_scaled[f, j]
+                d -= np.round(d)
+                out[f, i] = min(out[f, i], np.linalg.norm(d * lengths[f]))
+    return out
+
+
+@pytest.mark.parametrize("method", ["dense", "tree"])
+def test_nearest_tf_distances(method):
+    rng = np.random.default_rng(1)
+    F, ntu, nprot = 5, 12, 30
+    # Scaled coordinates slightly outside [0, 1), as in LAMMPS dumps
+    tu = rng.uniform(-0.05, 1.05, (F, ntu, 3))
+    prot = rng.uniform(-0.05, 1.05, (F, nprot, 3))
+    on = rng.random((F, nprot)) < 0.4
+    on[2] = False  # A frame without ON proteins
+    lengths = np.array([[20.0, 25.0, 30.0]] * F)
+    dist = nearest_tf_distances(tu, prot, on, lengths, method)
+    expected = brute_nearest(tu, prot, on, lengths)
+    assert np.all(np.isinf(dist[2]))
+    np.testing.assert_allclose(dist, expected, rtol=1e-12)
+
+
+def test_dense_and_tree_agree():
+    rng = np.random.default_rng(2)
+    tu = rng.random((3, 50, 3))
+    prot = rng.random((3, 200, 3))
+    on = rng.random((3, 200)) < 0.5
+    lengths = np.full((3, 3), 100.0)
+    np.testing.assert_allclose(
+        nearest_tf_distances(tu, prot, on, lengths, "dense"),
+        nearest_tf_distances(tu, prot, on, lengths, "tree"), rtol=1e-12)
+
+
+def test_threshold_counts():
+    rng = np.random.default_rng(3)
+    dist = rng.uniform(0.0, 8.0, (40, 7))
+    dist[3] = np.inf
+    thresholds = parse_thresholds("2:6:0.5")
+    # Distances exactly at a threshold count as bound
+    dist[5, 0] = thresholds[2]
+    expected = np.array([(dist <= t).sum(axis=0) for t in thresholds])
+    np.testing.assert_array_equal(threshold_counts(dist, thresholds),
+                                  expected)
+
+
+def test_parse_thresholds():
+    np.testing.assert_allclose(parse_thresholds("2.5:3.5:0.1"),
+                               np.round(np.arange(25, 36) / 10, 6))
+    np.testing.assert_allclose(parse_thresholds("4,3.5,3.5"), [3.5, 4.0])
+    with pytest.raises(ValueError):
+        parse_thresholds("3:2:0.5")
@@ -0,0 +1,22 @@
+# test_binding_correlations.py
+# Integrated autocorrelation times of binding_correlations.py.
+
+import numpy as np
+
+from binding_correlations import integrated_time
+
+
+def test_integrated_time_without_lags():
+    # A single-frame run has no lags
+    np.testing.assert_array_equal(integrated_time(np.ones((3, 1))),
+                                  np.ones(3))
+
+
+def test_integrated_time():
+    # Exponential autocorrelation rho(k) = a^k: tau = (1+a)/(1-a) once the
+    # window is long enough; constant rows (NaN autocorrelation) give NaN
+    a = 0.5
+    rho = np.vstack([a ** np.arange(60), np.full(60, np.nan)])
+    tau = integrated_time(rho)
+    np.testing.assert_allclose(tau[0], (1 + a) / (1 - a), rtol=1e-3)
+    assert np.isnan(tau[1])
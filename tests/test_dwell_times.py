@@ -0,0 +1,64 @@
+# test_dwell_times.py
+# Dwell and burst statistics of dwell_times.py against a loop over the runs
+# of each TU.
+
+from itertools import groupby
+
+import numpy as np
+import pytest
+
+from dwell_times import matrix_dwell_stats
+
+
+def brute_row(row, max_gap):
+    # Runs as (value, start, length); runs touching either end are censored
+    runs, start = [], 0
+    for value, group in groupby(row):
+        n = len(list(group))
+        runs.append((value, start, n))
+        start += n
+    n_frames = len(row)
+    censored = [s == 0 or s + n == n_frames for _, s, n in runs]
+    bound = [n for (v, _, n), c in zip(runs, censored) if v and not c]
+    unbound = [n for (v, _, n), c in zip(runs, censored) if not v and not c]
+
+    # Bursts: bound runs joined across complete unbound gaps <= max_gap
+    bursts = []  # [size, censored]
+    for k, ((v, _, n), c) in enumerate(zip(runs, censored)):
+        if not v:
+            continue
+        bridged = (k >= 1 and not censored[k-1] and runs[k-1][2] <= max_gap)
+        if bursts and bridged:
+            bursts[-1][0] += n
+            bursts[-1][1] |= c
+        else:
+            bursts.append([n, c])
+    sizes = [size for size, c in bursts if not c]
+    mean = lambda x: np.mean(x) if x else np.nan  # noqa: E731
+    return {"phi": np.mean(row),
+            "n_bound_events": sum(v for v, _, _ in runs),
+            "n_bursts": len(bursts),
+            "mean_bound_dwell": mean(bound),
+            "mean_unbound_dwell": mean(unbound),
+            "mean_burst_size": mean(sizes)}, bound, unbound, sizes
+
+
+@pytest.mark.parametrize("max_gap", [0, 2])
+def test_dwell_stats(max_gap):
+    rng = np.random.default_rng(4)
+    matrix = (rng.random((9, 61)) < 0.4).astype(np.uint8)
+    matrix[0] = 1  # Always bound: a single censored run
+    matrix[1] = 0
+    stats, hists = matrix_dwell_stats(matrix, max_gap)
+    hist_expected = {name: np.zeros(62, dtype=np.int64)
+                     for name in ("bound", "unbound", "burst")}
+    for i, row in enumerate(matrix):
+        expected, bound, unbound, sizes = brute_row(list(row), max_gap)
+        for column, value in expected.items():
+            np.testing.assert_allclose(stats[column][i], value,
+                                       err_msg=f"{column} of row {i}")
+        for name, values in (("bound", bound), ("unbound", unbound),
+                             ("burst", sizes)):
+            np.add.at(hist_expected[name], values, 1)
+    for name, counts in hist_expected.items():
+        np.testing.assert_array_equal(hists[name], counts)
@@ -0,0 +1,45 @@
+# test_follow_phi.py
+# follow_phi.follow on a dump written while it runs.
+
+import os
+import threading
+import time
+
+import numpy as np
+
+from binding import binding_blocks
+from follow_phi import follow
+from online_stats import BindingAccumulator
+from traj_reader import read_frames
+
+
+def test_follow_waits_and_ignores_stale_done_file(dump, tmp_path):
+    text = open(dump).read()
+    growing = tmp_path / "pos_growing.lammpstrj"
+    done = tmp_path / "growing.restart"
+    done.touch()  # Left over from an earlier run
+    os.utime(done, (time.time() - 60, time.time() - 60))
+
+    def lammps():
+        # Equilibration longer than the idle timeout, then the production
+        # run in two writes and the restart file
+        time.sleep(0.3)
+        half = text.index("ITEM: TIMESTEP", len(text) // 2)
+        growing.write_text(text[:half] + text[half:half + 40])
+        time.sleep(0.1)
+        with open(growing, "a") as f:
+            f.write(text[half + 40:])
+        time.sleep(0.1)
+        done.touch()
+
+    writer = threading.Thread(target=lammps)
+    writer.start()
+    phi = follow(str(growing), str(tmp_path / "phi.json"),
+                 str(tmp_path / "phi.csv"), str(done), poll=0.01,
+                 checkpoint_every=0.0, idle_timeout=0.2)
+    writer.join()
+
+    acc = BindingAccumulator(track_variance=False)
+    for _, ids, _, bound in binding_blocks(read_frames(dump)):
+        acc.update(bound, ids)
+    np.testing.assert_allclose(phi, acc.phi())
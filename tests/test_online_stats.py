@@ -0,0 +1,32 @@
+# test_online_stats.py
+# The streaming accumulators of online_stats.py against direct computations.
+
+import numpy as np
+import pytest
+
+from online_stats import DistanceHistogram
+
+
+@pytest.mark.parametrize("max_time_bins", [7, 8, 1])
+def test_distance_histogram_coarsens_any_bin_count(max_time_bins):
+    # 7 and 1 are rounded up to an even number of time bins
+    rng = np.random.default_rng(0)
+    n_frames, n_tu = 53, 4
+    dist = rng.uniform(0.0, 12.0, (n_frames, n_tu))
+    dist[5, :] = np.inf
+    timesteps = np.arange(n_frames) * 100
+    hist = DistanceHistogram(10.0, n_dist_bins=20,
+                             max_time_bins=max_time_bins, threshold=3.5)
+    for lo in range(0, n_frames, 6):
+        hist.update(timesteps[lo:lo+6], dist[lo:lo+6])
+
+    assert hist.n_time_bins <= hist.max_time_bins
+    assert hist.max_time_bins % 2 == 0
+    finite = dist[np.isfinite(dist)]
+    expected, _ = np.histogram(finite[finite <= 10.0], hist.dist_edges)
+    np.testing.assert_array_equal(hist.histogram().sum(axis=0), expected)
+    assert hist.below.sum() == (dist <= 3.5).sum()
+    assert hist.missing.sum() == n_tu
+    edges = hist.time_edges()
+    assert edges[0] == 0 and edges[-1] == timesteps[-1]
+    assert np.all(np.diff(edges) > 0)
@@ -0,0 +1,70 @@
+# test_onoff_store.py
+# Round trip of on/off matrices through the bit-packed .npz store, with and
+# without memory mapping, and the old JSON layout.
+
+import json
+
+import numpy as np
+import pytest
+
+import onoff_store
+from onoff_store import (from_json, load_onoff, phi_from_onoff, save_onoff,
+                         to_json, unpack)
+
+
+def random_matrix(n_tu=7, n_frames=29, seed=0):
+    # A frame count that is not a multiple of 8 exercises the padding bits
+    rng = np.random.default_rng(seed)
+    return (rng.random((n_tu, n_frames)) < 0.4).astype(np.uint8)
+
+
+@pytest.mark.parametrize("mmap", [True, False])
+def test_round_trip(tmp_path, mmap):
+    matrix = random_matrix()
+    tu_ids = np.arange(100, 107)
+    timesteps = np.arange(29) * 1000
+    path = str(tmp_path / "m.npz")
+    save_onoff(path, matrix, tu_ids, timesteps, key=(10, 5, 2))
+
+    onoff = load_onoff(path, mmap=mmap)
+    assert isinstance(onoff.bits, np.memmap) == mmap
+    assert onoff.n_frames == 29
+    assert onoff.key == (10, 5, 2)
+    np.testing.assert_array_equal(onoff.tu_ids, tu_ids)
+    np.testing.assert_array_equal(onoff.timesteps, timesteps)
+    np.testing.assert_array_equal(unpack(onoff), matrix)
+    np.testing.assert_array_equal(unpack(onoff, slice(2, 4)), matrix[2:4])
+    np.testing.assert_allclose(phi_from_onoff(onoff), matrix.mean(axis=1))
+
+
+def test_unknown_key_is_stored_as_minus_one(tmp_path):
+    path = str(tmp_path / "m.npz")
+    save_onoff(path, random_matrix(), np.arange(7), np.arange(29),
+               key=(None, 5, 2))
+    assert load_onoff(path).key == (-1, 5, 2)
+
+
+def test_phi_counts_in_chunks(tmp_path, monkeypatch):
+    # A chunk smaller than the matrix must give the same fractions
+    matrix = random_matrix(n_tu=50, n_frames=64, seed=1)
+    path = str(tmp_path / "m.npz")
+    save_onoff(path, matrix, np.arange(50), np.arange(64))
+    monkeypatch.setattr(onoff_store, "COUNT_CHUNK_BYTES", 24)
+    np.testing.assert_allclose(phi_from_onoff(load_onoff(path)),
+                               matrix.mean(axis=1))
+
+
+def test_json_round_trip(tmp_path):
+    matrix = random_matrix()
+    path = str(tmp_path / "m.npz")
+    save_onoff(path, matrix, np.arange(100, 107), np.arange(29))
+    json_path = str(tmp_path / "m.json")
+    to_json(load_onoff(path), json_path)
+    with open(json_path) as f:
+        assert json.load(f)["100"] == matrix[0].tolist()
+
+    back = str(tmp_path / "back.npz")
+    from_json(json_path, back)
+    onoff = load_onoff(back)
+    np.testing.assert_array_equal(onoff.tu_ids, np.arange(100, 107))
+    np.testing.assert_array_equal(unpack(onoff), matrix)
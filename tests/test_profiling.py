@@ -0,0 +1,29 @@
+# test_profiling.py
+# Per-trajectory records of profiling.py.
+
+import numpy as np
+import pytest
+
+from profiling import STAGES, profile_traj, reset_peak_rss
+
+
+@pytest.mark.skipif(not reset_peak_rss(), reason="peak RSS cannot be reset")
+def test_peak_rss_is_per_trajectory():
+    # As in a reused pool worker: a large trajectory, then a small one
+    with profile_traj("large") as large:
+        block = np.ones(2**25)  # 256 MiB
+        del block
+    with profile_traj("small") as small:
+        pass
+    large, small = large.record(), small.record()
+    assert large["rss_increase_mb"] > 200
+    assert small["rss_increase_mb"] < 50
+    assert small["peak_rss_mb"] < large["peak_rss_mb"] - 200
+
+
+def test_record_has_every_stage():
+    with profile_traj("traj") as prof:
+        with prof.stage("dwell"):
+            pass
+    rec = prof.record()
+    assert all(f"{name}_s" in rec for name in STAGES)
@@ -0,0 +1,83 @@
+# test_result_cache.py
+# Hits and misses of the on-disk result cache as trajectories change, and
+# least recently used eviction.
+
+import os
+import time
+
+import numpy as np
+
+from result_cache import ResultCache, cache_key
+
+PARAMS = {"binding_threshold": 2.0, "sigma": 1.0}
+
+
+def test_hit_after_reopen(dump, tmp_path):
+    cache_dir = str(tmp_path / "cache")
+    cache = ResultCache(cache_dir)
+    key = cache_key(dump, PARAMS)
+    assert cache.get(key) is None
+    cache.put(key, dump, PARAMS, phi=np.arange(5.0))
+
+    cache = ResultCache(cache_dir)
+    arrays = cache.get(key)
+    np.testing.assert_array_equal(arrays["phi"], np.arange(5.0))
+    assert cache_key(dump, dict(PARAMS, sigma=1.5)) != key
+
+
+def test_miss_after_trajectory_changes(dump, tmp_path):
+    cache = ResultCache(str(tmp_path / "cache"))
+    key = cache_key(dump, PARAMS)
+    cache.put(key, dump, PARAMS, phi=np.zeros(3))
+
+    # A new modification time alone gives a new key
+    stat = os.stat(dump)
+    os.utime(dump, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+    touched = cache_key(dump, PARAMS)
+    assert touched != key
+    assert cache.get(touched) is None
+
+    # So does a regrown file, and storing it drops the stale entry
+    with open(dump, "a") as f:
+        f.write("\n")
+    grown = cache_key(dump, PARAMS)
+    assert grown not in (key, touched)
+    assert cache.get(grown) is None
+    cache.put(grown, dump, PARAMS, phi=np.ones(3))
+    assert cache.get(key) is None
+    assert not os.path.exists(os.path.join(cache.cache_dir, key + ".npz"))
+    assert cache.info()["entries"] == 1
+
+
+def test_content_hash_ignores_mtime(dump):
+    key = cache_key(dump, PARAMS, content_hash=True)
+    stat = os.stat(dump)
+    os.utime(dump, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+    assert cache_key(dump, PARAMS, content_hash=True) == key
+
+
+def test_lru_eviction(dump, tmp_path):
+    cache = ResultCache(str(tmp_path / "cache"))
+    keys = []
+    for i in range(3):
+        params = dict(PARAMS, binding_threshold=float(i))
+        keys.append(cache_key(dump, params))
+        cache.put(keys[-1], dump, params, phi=np.zeros(1000))
+        time.sleep(0.01)  # Distinct last use times
+    entry_bytes = cache.index[keys[0]]["bytes"]
+
+    # Using the oldest entry makes the second one least recently used
+    assert cache.get(keys[0]) is not None
+    cache.evict(2 * entry_bytes)
+    assert cache.get(keys[1]) is None
+    assert cache.get(keys[0]) is not None
+    assert cache.get(keys[2]) is not None
+    assert not os.path.exists(os.path.join(cache.cache_dir,
+                                           keys[1] + ".npz"))
+
+    # The size limit is applied on every put
+    cache.max_bytes = entry_bytes
+    params = dict(PARAMS, binding_threshold=9.0)
+    newest = cache_key(dump, params)
+    cache.put(newest, dump, params, phi=np.zeros(1000))
+    assert list(cache.index) == [newest]
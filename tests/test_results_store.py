@@ -0,0 +1,70 @@
+# test_results_store.py
+# Upserts into the partitioned results store (on the .npz fallback, which
+# needs no parquet engine) replace rows rather than adding to them.
+
+import glob
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import results_store
+from results_store import ResultsStore
+
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    monkeypatch.setattr(results_store, "FORMAT", "npz")
+    return ResultsStore(str(tmp_path / "store"))
+
+
+def test_upsert_runs_replaces_rows(store):
+    runs = {(30, 10, 5, 1): [0.1, 0.2, 0.3],
+            (30, 10, 5, 2): [0.4, 0.5, 0.6],
+            (30, 20, 5, 1): [0.7, 0.8]}
+    store.upsert_runs(runs)
+    parts = glob.glob(os.path.join(store.root, "*", "**", "part.*"),
+                      recursive=True)
+    assert parts and all(p.endswith(".npz") for p in parts)
+
+    # Rerunning one run replaces its rows, even with fewer TUs than before
+    store.upsert_runs({(30, 10, 5, 1): [0.9, 0.9]})
+    store.upsert_runs({(30, 10, 5, 1): [0.9, 0.9]})
+
+    runs_df = store.load("runs")
+    assert len(runs_df) == 3
+    assert not runs_df.duplicated(subset=results_store.RUN_KEY).any()
+    rerun = runs_df[(runs_df.l == 10) & (runs_df.run == 1)]
+    assert rerun.phi_mean.item() == pytest.approx(0.9)
+    assert rerun.n_tus.item() == 2
+
+    per_tu = store.load("per_tu", l=10)
+    assert len(per_tu) == 2 + 3
+    np.testing.assert_allclose(per_tu[per_tu.run == 1].phi, [0.9, 0.9])
+    np.testing.assert_allclose(per_tu[per_tu.run == 2].phi, [0.4, 0.5, 0.6])
+
+
+def test_load_filters_and_columns(store):
+    store.upsert_runs({(30, 10, 5, 1): [0.1], (30, 10, 8, 1): [0.2],
+                       (40, 10, 5, 1): [0.3]})
+    df = store.load("runs", columns=["Np", "phi_mean"], Ns=30, Np=[8])
+    assert list(df.columns) == ["Np", "phi_mean"]
+    assert df.phi_mean.tolist() == pytest.approx([0.2])
+    assert len(store.load("runs", Ns=40)) == 1
+    assert store.load("runs", l=99).empty
+
+
+def test_upsert_thresholds_adds_up(store):
+    phi = np.array([[0.1, 0.3], [0.5, 0.7]])
+    store.upsert_thresholds({(30, 10, 5, 1): phi}, [1.0, 1.5])
+    # A second sweep over other thresholds keeps the first one's rows
+    store.upsert_thresholds({(30, 10, 5, 1): phi}, [1.5, 2.0])
+    df = store.load("thresholds")
+    assert sorted(df.threshold) == [1.0, 1.5, 2.0]
+    assert df.set_index("threshold").phi_mean[1.5] == pytest.approx(0.2)
+
+
+def test_upsert_requires_key_columns(store):
+    with pytest.raises(ValueError):
+        store.upsert("runs", pd.DataFrame({"Ns": [30]}))
@@ -0,0 +1,131 @@
+# test_run_sweep.py
+# run_sweep.py against a stub LAMMPS executable: completion checks, resuming
+# from sweep_state.json and --retry-failed.
+
+import json
+import os
+import stat
+import sys
+
+import pytest
+
+import run_sweep
+from lammps_init import run_name
+from run_sweep import DONE, FAILED, PENDING, RUNNING, STATE_FILE, \
+    build_grid, is_complete, run_sweep as sweep
+
+# Writes the outputs is_complete looks for, and appends the run name to
+# $STUB_LMP_LOG; exits with code 3 for the runs listed in $STUB_LMP_FAIL
+STUB_LMP = """#!{python}
+import os, sys
+name = sys.argv[sys.argv.index("-in") + 1][:-len(".lam")]
+with open(os.environ["STUB_LMP_LOG"], "a") as f:
+    f.write(name + "\\n")
+if name in os.environ.get("STUB_LMP_FAIL", "").split(","):
+    sys.exit(3)
+open(name + ".restart", "w").close()
+with open("pos_" + name + ".lammpstrj", "w") as f:
+    f.write("ITEM: TIMESTEP\\n0\\n")
+"""
+
+GRID = build_grid(2, [3], [2, 4], 2)
+NAMES = [run_name(*params) for params in GRID]
+
+
+@pytest.fixture
+def lmp(tmp_path, monkeypatch):
+    exe = tmp_path / "lmp"
+    exe.write_text(STUB_LMP.format(python=sys.executable))
+    exe.chmod(exe.stat().st_mode | stat.S_IXUSR)
+    log = tmp_path / "lmp.log"
+    monkeypatch.setenv("STUB_LMP_LOG", str(log))
+    monkeypatch.delenv("STUB_LMP_FAIL", raising=False)
+
+    # The stub's runs, in order, and then forgotten
+    def calls():
+        names = log.read_text().split() if log.exists() else []
+        log.unlink(missing_ok=True)
+        return names
+    return str(exe), calls
+
+
+def run(out_dir, lmp_exe, **kwargs):
+    return sweep(GRID, str(out_dir), lmp_exe, n_jobs=2, pin=False, poll=0.01,
+                 **kwargs)
+
+
+def load_state(out_dir):
+    with open(os.path.join(out_dir, STATE_FILE)) as f:
+        return {name: job["status"] for name, job in json.load(f).items()}
+
+
+def test_is_complete(tmp_path):
+    name = "noise_Ns_2_l_3_Np_2_run_1"
+    assert not is_complete(str(tmp_path), name)
+    (tmp_path / f"pos_{name}.lammpstrj").write_text("ITEM: TIMESTEP\n")
+    assert not is_complete(str(tmp_path), name)  # No restart file
+    (tmp_path / f"{name}.restart").touch()
+    assert is_complete(str(tmp_path), name)
+    (tmp_path / f"pos_{name}.lammpstrj").write_text("")
+    assert not is_complete(str(tmp_path), name)  # Empty dump
+
+
+def test_fresh_sweep(tmp_path, lmp):
+    exe, calls = lmp
+    counts = run(tmp_path, exe)
+    assert counts == {DONE: len(GRID)}
+    assert sorted(calls()) == sorted(NAMES)
+    assert set(load_state(tmp_path).values()) == {DONE}
+    for name in NAMES:
+        assert os.path.exists(tmp_path / name / f"{name}.lam")
+
+
+def test_failed_runs(tmp_path, lmp, monkeypatch):
+    exe, calls = lmp
+    monkeypatch.setenv("STUB_LMP_FAIL", NAMES[1])
+    counts = run(tmp_path, exe)
+    assert counts == {DONE: len(GRID) - 1, FAILED: 1}
+    with open(tmp_path / STATE_FILE) as f:
+        assert json.load(f)[NAMES[1]]["returncode"] == 3
+
+
+def test_resume_from_state(tmp_path, lmp, monkeypatch):
+    exe, calls = lmp
+    monkeypatch.setenv("STUB_LMP_FAIL", NAMES[1])
+    run(tmp_path, exe)
+    calls()
+    # An interrupted sweep: NAMES[2] was left running without outputs and
+    # NAMES[3] never started
+    state = run_sweep.SweepState(str(tmp_path / STATE_FILE))
+    state.set(NAMES[2], RUNNING)
+    state.set(NAMES[3], PENDING)
+    for name in NAMES[2:]:
+        os.remove(tmp_path / name / f"{name}.restart")
+    lam = (tmp_path / NAMES[2] / f"{NAMES[2]}.lam").read_text()
+    monkeypatch.delenv("STUB_LMP_FAIL")
+
+    # Done runs are kept, failed ones skipped and the others rerun from
+    # their existing inputs (regenerating them would draw new seeds)
+    counts = run(tmp_path, exe)
+    assert sorted(calls()) == sorted(NAMES[2:])
+    assert counts == {DONE: len(GRID) - 1, FAILED: 1}
+    assert load_state(tmp_path)[NAMES[1]] == FAILED
+    assert (tmp_path / NAMES[2] / f"{NAMES[2]}.lam").read_text() == lam
+
+    # Nothing left to do, unless failed runs are retried
+    assert run(tmp_path, exe) == counts
+    assert calls() == []
+    assert run(tmp_path, exe, retry_failed=True) == {DONE: len(GRID)}
+    assert calls() == [NAMES[1]]
+
+
+def test_completed_outputs_mark_done(tmp_path, lmp):
+    # Runs whose outputs exist count as done whatever the state says
+    exe, calls = lmp
+    run(tmp_path, exe)
+    calls()
+    state = run_sweep.SweepState(str(tmp_path / STATE_FILE))
+    state.set(NAMES[0], FAILED)
+    state.set(NAMES[1], RUNNING)
+    assert run(tmp_path, exe) == {DONE: len(GRID)}
+    assert calls() == []
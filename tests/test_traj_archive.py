@@ -0,0 +1,140 @@
+# test_traj_archive.py
+# Round trip of dumps through the .lta archive, and the checks that guard
+# traj_archive.py convert --verify --remove.
+
+import os
+import sys
+
+import numpy as np
+import pytest
+
+import traj_archive
+from traj_archive import ArchiveReader, convert, dump_state
+from traj_reader import read_frames
+
+
+@pytest.mark.parametrize("coords", ["quantized", "float32"])
+def test_round_trip(dump, coords):
+    out, n, _, _, error = convert(dump, coords=coords, keyframe_interval=5,
+                                  verify=True)
+    originals = list(read_frames(dump))
+    copies = list(read_frames(out))
+    assert n == len(originals) == len(copies) == 12
+    for original, copy in zip(originals, copies):
+        assert original.timestep == copy.timestep
+        np.testing.assert_array_equal(original.ids, copy.ids)
+        np.testing.assert_array_equal(original.types, copy.types)
+        np.testing.assert_array_equal(original.images, copy.images)
+        np.testing.assert_allclose(original.scaled, copy.scaled,
+                                   atol=2.0 ** -traj_archive.BITS)
+    assert error <= 2.0 ** -traj_archive.BITS
+
+
+def test_random_and_strided_access(dump):
+    out = convert(dump, keyframe_interval=5)[0]
+    originals = list(read_frames(dump))
+    with ArchiveReader(out) as reader:
+        for k in [7, 2, 11, 4, -1]:
+            np.testing.assert_allclose(reader.frame(k).scaled,
+                                       originals[k].scaled, atol=1e-5)
+    strided = list(read_frames(out, start=1, stop=None, stride=3))
+    assert [f.timestep for f in strided] == \
+        [f.timestep for f in originals[1::3]]
+
+
+def test_truncated_archive_reads_complete_frames(dump, tmp_path):
+    out = convert(dump)[0]
+    with open(out, "rb") as f:
+        data = f.read()
+    with ArchiveReader(out) as reader:
+        cut = int(reader.offsets[8]) + 10
+    truncated = tmp_path / "cut.lta"
+    truncated.write_bytes(data[:cut])
+    assert len(list(read_frames(str(truncated)))) == 8
+
+
+def test_verify_rejects_coarse_quantization(dump):
+    with pytest.raises(ValueError, match="resolution"):
+        convert(dump, bits=4, verify=True)
+    # The failed archive must not shadow the dump
+    assert not os.path.exists(traj_archive.archive_path(dump))
+
+
+@pytest.mark.parametrize("content", ["", "ITEM: TIMESTEP\n0\nITEM: NUMB"])
+def test_dump_without_complete_frames(tmp_path, content):
+    # An empty dump, or one whose only frame is still being written
+    dump = tmp_path / "pos_empty.lammpstrj"
+    dump.write_text(content)
+    with pytest.raises(ValueError, match="No complete frames"):
+        convert(str(dump))
+    assert os.listdir(tmp_path) == ["pos_empty.lammpstrj"]
+
+
+def test_verify_rejects_frame_count_mismatch(dump, monkeypatch):
+    # The dump gains a frame between writing and verifying the archive, as a
+    # dump still being written by LAMMPS does
+    reads = []
+
+    def growing(path, *args, **kwargs):
+        frames = list(read_frames(path, *args, **kwargs))
+        reads.append(path)
+        if path == dump and len(reads) > 1:
+            frames.append(frames[-1])
+        return iter(frames)
+
+    monkeypatch.setattr(traj_archive, "read_frames", growing)
+    with pytest.raises(ValueError, match="frames written"):
+        convert(dump, verify=True)
+
+
+def test_remove_keeps_changed_dump(dump, monkeypatch):
+    # A dump appended to during the conversion is archived but not removed
+    real_convert = traj_archive.convert
+
+    def convert_while_growing(path, *args):
+        result = real_convert(path, *args)
+        with open(path, "a") as f:
+            f.write("ITEM: TIMESTEP\n")
+        return result
+
+    monkeypatch.setattr(traj_archive, "convert", convert_while_growing)
+    monkeypatch.setattr(traj_archive, "ProcessPoolExecutor",
+                        _InlineExecutor)
+    monkeypatch.setattr(sys, "argv", ["traj_archive.py", "convert", dump,
+                                      "--verify", "--remove", "-j", "1"])
+    before = dump_state(dump)
+    traj_archive.main()
+    assert os.path.exists(dump) and dump_state(dump) != before
+    assert os.path.exists(traj_archive.archive_path(dump))
+
+
+def test_remove_deletes_verified_dump(dump, monkeypatch):
+    monkeypatch.setattr(traj_archive, "ProcessPoolExecutor",
+                        _InlineExecutor)
+    monkeypatch.setattr(sys, "argv", ["traj_archive.py", "convert", dump,
+                                      "--verify", "--remove", "-j", "1"])
+    traj_archive.main()
+    assert not os.path.exists(dump)
+    assert len(list(read_frames(traj_archive.archive_path(dump)))) == 12
+
+
+class _InlineExecutor:
+    # Runs submitted calls in the test process, so that monkeypatches apply
+
+    def __init__(self, max_workers=None):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def submit(self, fn, *args):
+        from concurrent.futures import Future
+        future = Future()
+        try:
+            future.set_result(fn(*args))
+        except Exception as e:
+            future.set_exception(e)
+        return future
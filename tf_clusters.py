@@ -0,0 +1,411 @@
+#!/usr/bin/env python3
+# tf_clusters.py
+# Protein clusters of every frame: cluster sizes, the TUs each cluster holds
+# and how long clusters live.
+#
+# The ON/OFF switching proteins of lammps_init.sh form clusters by bridging
+# chromatin. In every frame two proteins are in contact if they are closer
+# than --cutoff (minimum image), and a cluster is a connected component of
+# the contact graph. By default only ON proteins (type 3) are clustered;
+# --include-off also clusters the OFF ones. A TU belongs to the cluster of
+# its nearest clustered protein if that is within the binding threshold.
+#
+# Contacts come from one periodic cKDTree per frame (query_pairs, so the cost
+# grows with the number of contacts rather than Np^2). The contact graphs of
+# a block of frames are stacked into one sparse graph, with the proteins of
+# frame k numbered k*Np..(k+1)*Np-1, and labelled in a single union-find pass
+# (scipy.sparse.csgraph.connected_components). Sizes and TU counts are then
+# bincounts over the labels of the whole block.
+#
+# Lifetimes follow clusters of at least --min-size proteins from frame to
+# frame: a cluster continues the cluster of the previous frame with which it
+# shares the most proteins, if that cluster's largest overlap is also with
+# it. On a split the largest fragment continues the cluster and the others
+# are new; on a merge the cluster continues the largest contributor and the
+# others end. Lifetimes are in frames. As in dwell_times.py, clusters that
+# exist in the first or last frame are censored: they are counted but left
+# out of the lifetime histogram.
+#
+# Per run this writes, under <out_dir>/runSep{l}/TF_Clusters/,
+#   TF_clusters_Np_{Np}_run_{run}.csv       number of clusters, largest
+#                                           cluster, clustered fraction and
+#                                           TUs in clusters of every frame
+#   TF_cluster_hist_Np_{Np}_run_{run}.npz   histograms of cluster size (all
+#                                           clusters, singletons included),
+#                                           TUs per cluster and lifetime
+# and for the sweep a summary (one row per run) and the size, TU and lifetime
+# distributions summed over the runs of each (l, Np).
+#
+# Usage: tf_clusters.py <sweep_dir> [-o clusters] [-j N] [--cutoff 2.5]
+#            [--min-size 2] [--include-off] [--force]
+
+import argparse
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+import pandas as pd
+from scipy.sparse import coo_matrix
+from scipy.sparse.csgraph import connected_components
+from scipy.spatial import cKDTree
+
+from batch_phi import scan_sweep
+from binding import BINDING_THRESHOLD, frame_blocks, wrap_into_box
+from profiling import active
+from traj_reader import add_frame_args, read_frames
+
+CLUSTER_CUTOFF = 2.5  # Protein-protein contact distance (in sigma)
+MIN_SIZE = 2  # Smallest cluster counted in the per-frame series and tracked
+HISTOGRAMS = ["size", "tus", "lifetime"]
+SERIES_COLUMNS = ["timestep", "n_clusters", "largest", "clustered_fraction",
+                  "tus_in_clusters"]
+
+
+def cluster_filename(np_value, run_value, hist=False):
+    if hist:
+        return f"TF_cluster_hist_Np_{np_value}_run_{run_value}.npz"
+    return f"TF_clusters_Np_{np_value}_run_{run_value}.csv"
+
+
+def _add_hist(hist, counts):
+    # hist + counts, padding the shorter one
+    if len(counts) > len(hist):
+        hist = np.pad(hist, (0, len(counts) - len(hist)))
+    hist[:len(counts)] += counts.astype(hist.dtype)
+    return hist
+
+
+def _add_counts(hist, values, weights=None):
+    # hist + bincount(values)
+    return _add_hist(hist, np.bincount(values, weights=weights))
+
+
+def label_clusters(tu, prot, members, lengths, cutoff=CLUSTER_CUTOFF,
+                   binding_cutoff=BINDING_THRESHOLD):
+    # Cluster labels of a block of frames (see frame_blocks for the arrays;
+    # members is the (F, Np) mask of the proteins to cluster). Returns
+    # (F, Np) labels, unique across the block and -1 for proteins that are
+    # not clustered, and the (F, Ntu) label of the cluster each TU is bound
+    # to (-1 if none)
+    nframes, n_prot = members.shape
+    edges = [np.zeros((0, 2), dtype=np.int64)]
+    owner = np.full(tu.shape[:2], -1, dtype=np.int64)
+    for k in range(nframes):
+        idx = np.flatnonzero(members[k])
+        if len(idx) == 0:
+            continue
+        box = lengths[k]
+        tree = cKDTree(wrap_into_box(prot[k, idx], box), boxsize=box)
+        pairs = tree.query_pairs(cutoff, output_type="ndarray")
+        edges.append(k * n_prot + idx[pairs])
+        dist, nearest = tree.query(wrap_into_box(tu[k], box),
+                                   distance_upper_bound=binding_cutoff)
+        bound = np.isfinite(dist)
+        owner[k, bound] = k * n_prot + idx[nearest[bound]]
+
+    edges = np.vstack(edges)
+    n_nodes = nframes * n_prot
+    graph = coo_matrix((np.ones(len(edges), dtype=np.int8),
+                        (edges[:, 0], edges[:, 1])), shape=(n_nodes, n_nodes))
+    _, labels = connected_components(graph, directed=False)
+    labels[~members.ravel()] = -1
+    tu_labels = np.where(owner >= 0, labels[np.maximum(owner, 0)], -1)
+    return labels.reshape(nframes, n_prot), tu_labels
+
+
+class ClusterStats:
+    # Streaming cluster statistics of one trajectory. update() takes the
+    # labels of a block of frames from label_clusters
+
+    def __init__(self, min_size=MIN_SIZE):
+        self.min_size = min_size
+        self.n = 0
+        self.hists = {name: np.zeros(1, dtype=np.int64)
+                      for name in HISTOGRAMS}
+        self.tu_sum_by_size = np.zeros(1)  # TUs summed over clusters by size
+        self.n_censored = 0
+        self.series = []
+        # Tracks: the track of every protein's cluster in the last frame
+        # (-1 if none), and the first frame of every track
+        self._prev = None
+        self._birth = np.zeros(0, dtype=np.int64)
+        self._n_tracks = 0
+
+    def update(self, timesteps, labels, tu_labels):
+        nframes, n_prot = labels.shape
+        valid = labels >= 0
+        sizes = np.bincount(labels[valid], minlength=labels.size)
+        tus = np.bincount(tu_labels[tu_labels >= 0], minlength=labels.size)
+        frame_of = np.zeros(labels.size, dtype=np.int64)
+        frame_of[labels[valid]] = np.nonzero(valid)[0]
+
+        present = np.flatnonzero(sizes)
+        self.hists["size"] = _add_counts(self.hists["size"], sizes[present])
+        big = present[sizes[present] >= self.min_size]
+        self.hists["tus"] = _add_counts(self.hists["tus"], tus[big])
+        self.tu_sum_by_size = _add_counts(self.tu_sum_by_size, sizes[big],
+                                          tus[big])
+
+        # Per-frame series
+        n_clusters = np.bincount(frame_of[big], minlength=nframes)
+        largest = np.zeros(nframes, dtype=np.int64)
+        np.maximum.at(largest, frame_of[present], sizes[present])
+        clustered = np.bincount(frame_of[big], weights=sizes[big],
+                                minlength=nframes)
+        n_members = valid.sum(axis=1)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            fraction = clustered / n_members
+        tus_in = np.bincount(frame_of[big], weights=tus[big],
+                             minlength=nframes)
+        self.series.append(np.column_stack([timesteps, n_clusters, largest,
+                                            fraction, tus_in]))
+
+        tracked = np.where(valid & (sizes[np.maximum(labels, 0)]
+                                    >= self.min_size), labels, -1)
+        for k in range(nframes):
+            self._track(tracked[k], self.n + k)
+        self.n += nframes
+
+    def _track(self, cur, frame):
+        # Continue, start and end the tracks of one frame
+        prev = self._prev if self._prev is not None \
+            else np.full(len(cur), -1)
+        cur_labels = np.unique(cur[cur >= 0])
+        tracks = np.full(len(cur_labels), -1, dtype=np.int64)
+
+        both = (prev >= 0) & (cur >= 0)
+        if both.any():
+            # Overlap (shared proteins) of every (track, cluster) pair, and
+            # the mutual best matches
+            c = np.searchsorted(cur_labels, cur[both])
+            pairs, counts = np.unique(np.column_stack([prev[both], c]),
+                                      axis=0, return_counts=True)
+            order = np.lexsort((-counts, pairs[:, 0]))
+            best_of_track = order[np.unique(pairs[order, 0],
+                                            return_index=True)[1]]
+            order = np.lexsort((-counts, pairs[:, 1]))
+            best_of_cluster = order[np.unique(pairs[order, 1],
+                                              return_index=True)[1]]
+            mutual = np.intersect1d(best_of_track, best_of_cluster)
+            tracks[pairs[mutual, 1]] = pairs[mutual, 0]
+
+        ended = np.setdiff1d(np.unique(prev[prev >= 0]), tracks)
+        self._end(ended, frame)
+
+        new = np.flatnonzero(tracks < 0)
+        tracks[new] = self._n_tracks + np.arange(len(new))
+        self._n_tracks += len(new)
+        if self._n_tracks > len(self._birth):
+            self._birth = np.pad(self._birth,
+                                 (0, max(self._n_tracks, 2 * len(self._birth))
+                                  - len(self._birth)))
+        self._birth[tracks[new]] = frame
+
+        self._prev = np.full(len(cur), -1, dtype=np.int64)
+        self._prev[cur >= 0] = tracks[np.searchsorted(cur_labels,
+                                                      cur[cur >= 0])]
+
+    def _end(self, tracks, frame):
+        # Record the lifetimes of tracks last seen in the frame before frame
+        if len(tracks) == 0:
+            return
+        births = self._birth[tracks]
+        censored = births == 0
+        self.n_censored += int(np.sum(censored))
+        self.hists["lifetime"] = _add_counts(self.hists["lifetime"],
+                                             frame - births[~censored])
+
+    def finish(self):
+        # End the tracks alive in the last frame (censored)
+        if self._prev is not None:
+            alive = np.unique(self._prev[self._prev >= 0])
+            self.n_censored += len(alive)
+            self._prev = None
+
+    def frame_series(self):
+        if not self.series:
+            return pd.DataFrame(columns=SERIES_COLUMNS)
+        df = pd.DataFrame(np.vstack(self.series), columns=SERIES_COLUMNS)
+        int_columns = ["timestep", "n_clusters", "largest", "tus_in_clusters"]
+        return df.astype({c: np.int64 for c in int_columns})
+
+
+def cluster_traj(path, cutoff=CLUSTER_CUTOFF,
+                 binding_cutoff=BINDING_THRESHOLD, min_size=MIN_SIZE,
+                 include_off=False, frames=(None, None, None)):
+    # ClusterStats of one trajectory, streamed in blocks of frames
+    stats = ClusterStats(min_size)
+    with active().hot():
+        for timesteps, _, tu, prot, on, lengths in frame_blocks(
+                read_frames(path, *frames)):
+            members = np.ones_like(on) if include_off else on
+            with active().stage("distance"):
+                labels, tu_labels = label_clusters(tu, prot, members, lengths,
+                                                   cutoff, binding_cutoff)
+            stats.update(timesteps, labels, tu_labels)
+    stats.finish()
+    if stats.n == 0:
+        raise ValueError(f"No complete frames in {path}")
+    return stats
+
+
+def hist_mean(counts):
+    counts = np.asarray(counts, dtype=np.float64)
+    total = counts.sum()
+    return float(np.arange(len(counts)) @ counts / total) if total else np.nan
+
+
+def run_summary(series, hists, n_censored):
+    size = np.asarray(hists["size"], dtype=np.float64)
+    sizes = np.arange(len(size))
+    # Size of the cluster a randomly chosen protein is in
+    weighted = (float(sizes**2 @ size / (sizes @ size)) if sizes @ size
+                else np.nan)
+    return {"n_frames": len(series),
+            "mean_n_clusters": float(series["n_clusters"].mean()),
+            "mean_largest": float(series["largest"].mean()),
+            "mean_clustered_fraction": float(
+                series["clustered_fraction"].mean()),
+            "mean_tus_in_clusters": float(series["tus_in_clusters"].mean()),
+            "mean_cluster_size": hist_mean(size),
+            "weighted_cluster_size": weighted,
+            "mean_tus_per_cluster": hist_mean(hists["tus"]),
+            "mean_lifetime": hist_mean(hists["lifetime"]),
+            "n_lifetimes": int(np.sum(hists["lifetime"])),
+            "n_censored": int(n_censored)}
+
+
+def save_cluster_outputs(stats, np_value, run_value, out_dir, key,
+                         params):
+    os.makedirs(out_dir, exist_ok=True)
+    series_file = os.path.join(out_dir, cluster_filename(np_value, run_value))
+    hist_file = os.path.join(out_dir,
+                             cluster_filename(np_value, run_value, hist=True))
+    with active().stage("serialize"):
+        stats.frame_series().to_csv(series_file, index=False)
+        np.savez(hist_file, key=np.array(key, dtype=np.int64),
+                 params=np.array(params, dtype=np.float64),
+                 n_censored=np.int64(stats.n_censored),
+                 tu_sum_by_size=stats.tu_sum_by_size,
+                 **stats.hists)
+    return [series_file, hist_file]
+
+
+def process_traj(path, key, out_dir, cutoff=CLUSTER_CUTOFF,
+                 binding_cutoff=BINDING_THRESHOLD, min_size=MIN_SIZE,
+                 include_off=False, frames=(None, None, None), force=False):
+    # Worker: cluster outputs of one trajectory (skipped if newer than the
+    # trajectory and computed with the same parameters). Returns
+    # (summary, histograms)
+    _, np_value, run_value = key
+    series_file = os.path.join(out_dir, cluster_filename(np_value, run_value))
+    hist_file = os.path.join(out_dir,
+                             cluster_filename(np_value, run_value, hist=True))
+    params = [cutoff, binding_cutoff, min_size, include_off] + [
+        -1 if f is None else f for f in frames]
+    if (not force and os.path.exists(hist_file)
+            and os.path.exists(series_file)
+            and os.path.getmtime(hist_file) >= os.path.getmtime(path)):
+        with np.load(hist_file) as data:
+            if np.array_equal(data["params"], params):
+                hists = {name: data[name] for name in HISTOGRAMS}
+                return run_summary(pd.read_csv(series_file), hists,
+                                   int(data["n_censored"])), hists
+    stats = cluster_traj(path, cutoff, binding_cutoff, min_size, include_off,
+                         frames)
+    save_cluster_outputs(stats, np_value, run_value, out_dir, key, params)
+    return run_summary(stats.frame_series(), stats.hists,
+                       stats.n_censored), stats.hists
+
+
+def sum_histograms(hists_by_key):
+    # Long table (l, Np, kind, value, count) of the histograms summed over
+    # the runs of each (l, Np)
+    totals = {}
+    for (l_val, np_value, _), hists in hists_by_key.items():
+        for name in HISTOGRAMS:
+            old = totals.get((l_val, np_value, name), np.zeros(1, np.int64))
+            totals[(l_val, np_value, name)] = _add_hist(old, hists[name])
+    frames = []
+    for (l_val, np_value, name), counts in sorted(totals.items()):
+        values = np.flatnonzero(counts)
+        frames.append(pd.DataFrame({"l": l_val, "Np": np_value, "kind": name,
+                                    "value": values,
+                                    "count": counts[values]}))
+    if not frames:
+        return pd.DataFrame(columns=["l", "Np", "kind", "value", "count"])
+    return pd.concat(frames, ignore_index=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Protein cluster sizes, TUs per cluster and cluster "
+                    "lifetimes of a sweep")
+    parser.add_argument("sweep_dir", nargs="?", default=".",
+                        help="Directory containing the runSep* directories")
+    parser.add_argument("-o", "--out-dir", default="clusters",
+                        help="Where to write the per-run outputs")
+    parser.add_argument("-j", "--workers", type=int, default=os.cpu_count(),
+                        help="Number of worker processes")
+    parser.add_argument("--l", type=int, nargs="+", dest="l_values",
+                        help="Only process these spacings")
+    parser.add_argument("--cutoff", type=float, default=CLUSTER_CUTOFF,
+                        help="Protein-protein contact distance")
+    parser.add_argument("--threshold", type=float, default=BINDING_THRESHOLD,
+                        help="TU-protein binding threshold")
+    parser.add_argument("--min-size", type=int, default=MIN_SIZE,
+                        help="Smallest cluster counted and tracked")
+    parser.add_argument("--include-off", action="store_true",
+                        help="Also cluster OFF proteins (type 4)")
+    parser.add_argument("--summary", default="cluster_summary.csv",
+                        help="Run summaries (one row per run)")
+    parser.add_argument("--hist-out", default="cluster_distributions.csv",
+                        help="Histograms summed over the runs of each (l, Np)")
+    parser.add_argument("--force", action="store_true",
+                        help="Recompute runs whose outputs are up to date")
+    add_frame_args(parser)
+    args = parser.parse_args()
+
+    jobs = scan_sweep(args.sweep_dir)
+    if args.l_values:
+        jobs = jobs[jobs["l"].isin(args.l_values)]
+    if jobs.empty:
+        print(f"No trajectories found in {args.sweep_dir}")
+        return
+    print(f"Found {len(jobs)} trajectories")
+
+    frames = (args.start, args.stop, args.stride)
+    records, hists_by_key = [], {}
+    with ProcessPoolExecutor(max_workers=args.workers) as pool:
+        futures = {}
+        for job in jobs.itertuples(index=False):
+            key = (job.l, job.Np, job.run)
+            out_dir = os.path.join(args.out_dir, f"runSep{job.l}",
+                                   "TF_Clusters")
+            futures[pool.submit(process_traj, job.path, key, out_dir,
+                                args.cutoff, args.threshold, args.min_size,
+                                args.include_off, frames, args.force)] = \
+                (key, job.path)
+        for done, future in enumerate(as_completed(futures), 1):
+            key, path = futures[future]
+            name = os.path.basename(path)
+            try:
+                summary, hists = future.result()
+            except Exception as e:
+                print(f"[{done}/{len(jobs)}] FAILED {name}: {e}")
+                continue
+            records.append({"l": key[0], "Np": key[1], "run": key[2],
+                            **summary})
+            hists_by_key[key] = hists
+            print(f"[{done}/{len(jobs)}] ok {name}")
+
+    summary = pd.DataFrame(records)
+    if not summary.empty:
+        summary = summary.sort_values(["l", "Np", "run"])
+    summary.to_csv(args.summary, index=False)
+    sum_histograms(hists_by_key).to_csv(args.hist_out, index=False)
+    print(f"✓ Saved {args.summary} ({len(summary)} runs) and {args.hist_out}")
+
+
+if __name__ == "__main__":
+    main()
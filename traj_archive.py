@@ -0,0 +1,521 @@
+#!/usr/bin/env python3
+# traj_archive.py
+# A compact binary archive format for LAMMPS trajectories (.lta), and the
+# converter from the dump files.
+#
+# The text dumps (dump ... custom id type xs ys zs ix iy iz) repeat the
+# id and type columns in every frame and write the coordinates as ASCII, which
+# is both most of the storage and most of the analysis time. An archive stores
+# the ids and the types of the first frame once; every frame then stores
+#   - its timestep and box,
+#   - the atoms whose type differs from the first frame (the ON/OFF proteins
+#     switch between types 3 and 4), as (index, type) pairs,
+#   - the scaled coordinates, either as float32 or quantized to fixed point
+#     (--bits per unit of the box, 20 by default, about the 6 digits of the
+#     dump). Quantized frames are stored as differences from the previous
+#     frame, with an absolute keyframe every --keyframe-interval frames,
+#   - the image flags as int8 (int16 if a flag does not fit).
+# Coordinate arrays are byte-shuffled (all first bytes, then all second
+# bytes, ...) and every frame is compressed on its own with zlib, lzma or, if
+# the zstandard module is installed, zstd.
+#
+# Layout: magic, JSON header, compressed ids/types, then length-prefixed
+# frame records, and at the end a table of the frame offsets and timesteps
+# with a footer pointing to it. The table gives random access to any frame
+# (decoding from its keyframe); an archive without the table (e.g. an
+# interrupted conversion) is still read sequentially up to its last complete
+# frame. traj_reader.read_frames reads archives like the text dumps, so every
+# analysis accepts .lta files.
+#
+# Usage: traj_archive.py convert <dump or sweep dir> [...] [--coords quantized]
+#            [--bits 20] [--codec zlib] [--keyframe-interval 100] [-j N]
+#            [--verify] [--remove]
+#        traj_archive.py info <archive> [...]
+
+import argparse
+import json
+import lzma
+import os
+import re
+import struct
+import sys
+import zlib
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from itertools import zip_longest
+
+import numpy as np
+
+from profiling import active
+from traj_reader import Frame, read_frames
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+ARCHIVE_EXT = ".lta"
+MAGIC = b"LTARCH01"
+FOOTER = struct.Struct("<QQ8s")  # number of frames, table offset, magic
+RECORD = struct.Struct("<I")  # compressed length of a record
+FRAME_HEAD = struct.Struct("<q6dBBBI")  # timestep, box, kind, coordinate
+                                        # and image itemsize, type changes
+FLOAT32, KEYFRAME, DELTA = 0, 1, 2  # Kinds of coordinate records
+BITS = 20
+KEYFRAME_INTERVAL = 100
+CODECS = ["zlib", "lzma"] + (["zstd"] if zstandard is not None else [])
+DEFAULT_CODEC = "zstd" if zstandard is not None else "zlib"
+DUMP_PRECISION = 1e-6  # Resolution of the %g scaled coordinates of a dump
+DUMP_RE = re.compile(r"\.lammpstrj(\.gz)?$")
+
+
+def archive_path(dump_path):
+    return DUMP_RE.sub("", str(dump_path)) + ARCHIVE_EXT
+
+
+def _compressor(codec):
+    if codec == "zlib":
+        return lambda data: zlib.compress(data, 6)
+    if codec == "lzma":
+        return lzma.compress
+    if codec == "zstd" and zstandard is not None:
+        return zstandard.ZstdCompressor(level=10).compress
+    raise ValueError(f"Codec '{codec}' is not available")
+
+
+def _decompressor(codec):
+    if codec == "zlib":
+        return zlib.decompress
+    if codec == "lzma":
+        return lzma.decompress
+    if codec == "zstd" and zstandard is not None:
+        return zstandard.ZstdDecompressor().decompress
+    raise ValueError(f"Codec '{codec}' is not available (pip install "
+                     f"zstandard)")
+
+
+def _shuffle(values):
+    # Bytes of an array grouped by byte position
+    values = np.ascontiguousarray(values).ravel()
+    return values.view(np.uint8).reshape(-1, values.itemsize).T.tobytes()
+
+
+def _unshuffle(buf, dtype, count):
+    dtype = np.dtype(dtype)
+    planes = np.frombuffer(buf, np.uint8, dtype.itemsize * count)
+    return planes.reshape(dtype.itemsize, count).T.copy().view(dtype).ravel()
+
+
+def _smallest_int(values, dtypes=(np.int8, np.int16, np.int32, np.int64)):
+    # values as the smallest of dtypes that holds them all
+    lo, hi = (values.min(), values.max()) if values.size else (0, 0)
+    for dtype in dtypes:
+        info = np.iinfo(dtype)
+        if info.min <= lo and hi <= info.max:
+            return values.astype(dtype)
+    return values
+
+
+class ArchiveWriter:
+    # Write frames to an archive: with ArchiveWriter(path) as w: w.write(f).
+    # The archive is written to path.tmp and renamed when closed without error
+    # after at least one frame (an archive without frames has no header)
+
+    def __init__(self, path, coords="quantized", bits=BITS, codec=DEFAULT_CODEC,
+                 keyframe_interval=KEYFRAME_INTERVAL):
+        if coords not in ("quantized", "float32"):
+            raise ValueError(f"Unknown coordinate format '{coords}'")
+        self.path = str(path)
+        self.coords = coords
+        self.bits = bits
+        self.codec = codec
+        self.compress = _compressor(codec)
+        self.keyframe_interval = keyframe_interval
+        self.f = None
+        self.offsets, self.timesteps = [], []
+
+    def __enter__(self):
+        self.f = open(self.path + ".tmp", "wb")
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None and self.offsets:
+            self._write_table()
+            self.f.close()
+            os.replace(self.path + ".tmp", self.path)
+        else:
+            self.f.close()
+            os.remove(self.path + ".tmp")
+        return False
+
+    def _write_block(self, data):
+        data = self.compress(data)
+        self.f.write(RECORD.pack(len(data)))
+        self.f.write(data)
+
+    def _write_header(self, frame):
+        self.ids = frame.ids
+        self.types = frame.types
+        self.scale = float(2 ** self.bits)
+        self.prev = None
+        header = json.dumps({"version": 1, "natoms": len(frame.ids),
+                             "coords": self.coords, "bits": self.bits,
+                             "codec": self.codec,
+                             "keyframe_interval": self.keyframe_interval})
+        self.f.write(MAGIC)
+        self.f.write(RECORD.pack(len(header)))
+        self.f.write(header.encode())
+        self._write_block(frame.ids.astype(np.int64).tobytes()
+                          + frame.types.astype(np.int32).tobytes())
+
+    def write(self, frame):
+        if not self.offsets:
+            self._write_header(frame)
+        elif not np.array_equal(frame.ids, self.ids):
+            raise ValueError(f"Atom ids change at timestep {frame.timestep}")
+
+        changed = np.flatnonzero(frame.types != self.types)
+        if self.coords == "float32":
+            kind, coords = FLOAT32, frame.scaled.astype(np.float32)
+        else:
+            q = np.rint(frame.scaled * self.scale).astype(np.int64)
+            if len(self.offsets) % self.keyframe_interval == 0:
+                kind, coords = KEYFRAME, _smallest_int(q, (np.int32, np.int64))
+            else:
+                kind, coords = DELTA, _smallest_int(q - self.prev)
+            self.prev = q
+        images = _smallest_int(frame.images)
+        head = FRAME_HEAD.pack(int(frame.timestep), *frame.box.ravel(), kind,
+                               coords.itemsize, images.itemsize, len(changed))
+        record = b"".join([head, changed.astype(np.uint32).tobytes(),
+                           frame.types[changed].astype(np.uint8).tobytes(),
+                           _shuffle(coords), _shuffle(images)])
+        self.offsets.append(self.f.tell())
+        self.timesteps.append(int(frame.timestep))
+        self._write_block(record)
+
+    def _write_table(self):
+        table_offset = self.f.tell()
+        self.f.write(np.array(self.offsets, dtype=np.uint64).tobytes())
+        self.f.write(np.array(self.timesteps, dtype=np.int64).tobytes())
+        self.f.write(FOOTER.pack(len(self.offsets), table_offset, MAGIC))
+
+
+class ArchiveReader:
+    # Random and sequential access to the frames of an archive
+
+    def __init__(self, path):
+        self.path = str(path)
+        self.f = open(self.path, "rb")
+        if self.f.read(len(MAGIC)) != MAGIC:
+            self.f.close()
+            raise ValueError(f"{self.path} is not a trajectory archive")
+        (size,) = RECORD.unpack(self.f.read(RECORD.size))
+        self.header = json.loads(self.f.read(size))
+        self.decompress = _decompressor(self.header["codec"])
+        self.natoms = self.header["natoms"]
+        self.scale = float(2 ** self.header["bits"])
+        data = self._read_block()
+        self.ids = np.frombuffer(data, np.int64, self.natoms)
+        self.types = np.frombuffer(data, np.int32, self.natoms,
+                                   8 * self.natoms).astype(np.int64)
+        self.first_offset = self.f.tell()
+        self.offsets, self.timesteps = self._load_table()
+        self._last = None  # (frame number, quantized coordinates)
+
+    def close(self):
+        self.f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def _read_block(self):
+        head = self.f.read(RECORD.size)
+        if len(head) < RECORD.size:
+            return None
+        (size,) = RECORD.unpack(head)
+        data = self.f.read(size)
+        if len(data) < size:
+            return None
+        return self.decompress(data)
+
+    def _load_table(self):
+        # Frame offsets and timesteps from the table, or by walking the
+        # records of an archive that was not closed
+        self.f.seek(0, os.SEEK_END)
+        end = self.f.tell()
+        if end >= self.first_offset + FOOTER.size:
+            self.f.seek(end - FOOTER.size)
+            n, table_offset, magic = FOOTER.unpack(self.f.read(FOOTER.size))
+            if magic == MAGIC:
+                self.f.seek(table_offset)
+                table = self.f.read(16 * n)
+                return (np.frombuffer(table, np.uint64, n).astype(np.int64),
+                        np.frombuffer(table, np.int64, n, 8 * n))
+        offsets, timesteps = [], []
+        pos = self.first_offset
+        self.f.seek(pos)
+        while True:
+            try:
+                record = self._read_block()
+            except (zlib.error, lzma.LZMAError):
+                record = None
+            if record is None or len(record) < FRAME_HEAD.size:
+                break
+            offsets.append(pos)
+            timesteps.append(FRAME_HEAD.unpack_from(record)[0])
+            pos = self.f.tell()
+        return np.array(offsets, dtype=np.int64), np.array(timesteps,
+                                                           dtype=np.int64)
+
+    def _decode(self, k, record):
+        (timestep, *box, kind, coord_size, image_size,
+         n_changed) = FRAME_HEAD.unpack_from(record)
+        pos = FRAME_HEAD.size
+        changed = np.frombuffer(record, np.uint32, n_changed, pos)
+        pos += 4 * n_changed
+        types = self.types.copy()
+        types[changed] = np.frombuffer(record, np.uint8, n_changed, pos)
+        pos += n_changed
+
+        n = 3 * self.natoms
+        if kind == FLOAT32:
+            coords = _unshuffle(record[pos:], np.float32, n)
+            scaled = coords.astype(np.float64)
+        else:
+            coords = _unshuffle(record[pos:], f"i{coord_size}", n)
+            q = coords.astype(np.int64)
+            if kind == DELTA:
+                if self._last is None or self._last[0] != k - 1:
+                    raise ValueError(f"Frame {k} of {self.path} decoded "
+                                     f"without its previous frame")
+                q += self._last[1]
+            self._last = (k, q)
+            scaled = q / self.scale
+        pos += coord_size * n
+        images = _unshuffle(record[pos:], f"i{image_size}", n)
+        return Frame(timestep, np.array(box).reshape(3, 2), self.ids, types,
+                     scaled.reshape(-1, 3),
+                     images.astype(np.int64).reshape(-1, 3))
+
+    def _read(self, k):
+        # Decode frame k, which follows the last decoded frame or is a
+        # keyframe
+        prof = active()
+        with prof.stage("read"):
+            self.f.seek(self.offsets[k])
+            (size,) = RECORD.unpack(self.f.read(RECORD.size))
+            data = self.f.read(size)
+        with prof.stage("parse"):
+            frame = self._decode(k, self.decompress(data))
+        if prof.enabled:
+            prof.count("parsed")
+            prof.count("bytes", RECORD.size + size)
+        return frame
+
+    def frame(self, k):
+        # Frame k (negative counts from the end), decoding forward from the
+        # nearest keyframe if needed
+        k = range(len(self))[k]
+        if self.header["coords"] == "float32":
+            return self._read(k)
+        first = k - k % self.header["keyframe_interval"]
+        if self._last is not None and first <= self._last[0] < k:
+            first = self._last[0] + 1
+        for j in range(first, k):
+            self._read(j)
+        return self._read(k)
+
+    def frames(self, start=None, stop=None, stride=None):
+        # Frames selected like a slice. Delta frames between the selected
+        # ones are decoded (but not returned) back to the last decoded frame
+        # or keyframe
+        for k in range(len(self))[slice(start, stop, stride)]:
+            yield self.frame(k)
+
+
+def read_archive_frames(path, start=None, stop=None, stride=None):
+    # Generator of the frames of an archive (used by traj_reader.read_frames)
+    with ArchiveReader(path) as reader:
+        selected = range(len(reader))[slice(start, stop, stride)]
+        active().count("skipped", len(reader) - len(selected))
+        yield from reader.frames(start, stop, stride)
+
+
+def convert(dump_path, out_path=None, coords="quantized", bits=BITS,
+            codec=DEFAULT_CODEC, keyframe_interval=KEYFRAME_INTERVAL,
+            verify=False):
+    # Write the archive of a dump. Returns (archive path, frames, dump size,
+    # archive size, largest coordinate error in box units or None). With
+    # verify, raises ValueError unless the archive reads back as the same
+    # number of frames as were written, with the same ids, types, images and
+    # boxes, and coordinates within the resolution of the format and of the
+    # dump (so e.g. --bits 8 fails); the archive is then removed. A dump
+    # without a complete frame raises ValueError and writes no archive
+    out_path = out_path or archive_path(dump_path)
+    n = 0
+    with ArchiveWriter(out_path, coords, bits, codec,
+                       keyframe_interval) as writer:
+        for frame in read_frames(dump_path):
+            writer.write(frame)
+            n += 1
+    if n == 0:
+        raise ValueError(f"No complete frames in {dump_path}")
+    max_error = None
+    if verify:
+        try:
+            max_error = _verify(dump_path, out_path, n, coords, bits)
+        except ValueError:
+            # Never leave an archive that would be read instead of the dump
+            os.remove(out_path)
+            raise
+    return (out_path, n, os.path.getsize(dump_path),
+            os.path.getsize(out_path), max_error)
+
+
+def _verify(dump_path, out_path, n, coords, bits):
+    # Largest coordinate error of the archive of a dump; raises ValueError
+    # if they differ beyond it (see convert)
+    max_error = 0.0
+    # Within one step of the format, and no coarser than the dump
+    tolerance = min(2.0 ** -bits if coords == "quantized"
+                    else float(np.finfo(np.float32).eps), DUMP_PRECISION)
+    n_dump = n_archive = 0
+    for original, copy in zip_longest(read_frames(dump_path),
+                                      read_frames(out_path)):
+        n_dump += original is not None
+        n_archive += copy is not None
+        if original is None or copy is None:
+            continue
+        if not (original.timestep == copy.timestep
+                and np.array_equal(original.ids, copy.ids)
+                and np.array_equal(original.types, copy.types)
+                and np.array_equal(original.images, copy.images)
+                and np.allclose(original.box, copy.box)):
+            raise ValueError(f"{out_path} differs from {dump_path} at "
+                             f"timestep {original.timestep}")
+        max_error = max(max_error, float(np.max(np.abs(
+            original.scaled - copy.scaled), initial=0.0)))
+    if not n_dump == n_archive == n:
+        raise ValueError(f"{n} frames written to {out_path}, but it reads "
+                         f"back {n_archive} frames and {dump_path} now "
+                         f"has {n_dump}")
+    if max_error > tolerance:
+        raise ValueError(f"Coordinates of {out_path} differ from "
+                         f"{dump_path} by up to {max_error:.2g} "
+                         f"(resolution {tolerance:.2g})")
+    return max_error
+
+
+def dump_state(path):
+    # Size and modification time of a dump, to tell whether it changed
+    st = os.stat(path)
+    return st.st_size, st.st_mtime_ns
+
+
+def find_dumps(paths):
+    # The dump files given or found under the given directories
+    found = []
+    for path in paths:
+        if os.path.isdir(path):
+            for dirpath, _, filenames in os.walk(path):
+                found += [os.path.join(dirpath, name)
+                          for name in sorted(filenames)
+                          if DUMP_RE.search(name)]
+        else:
+            found.append(path)
+    return found
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Convert LAMMPS dumps to compact trajectory archives")
+    commands = parser.add_subparsers(dest="command", required=True)
+    conv = commands.add_parser("convert", help="Convert dumps to archives")
+    conv.add_argument("paths", nargs="+",
+                      help="Dump files or directories searched for dumps")
+    conv.add_argument("--coords", choices=["quantized", "float32"],
+                      default="quantized")
+    conv.add_argument("--bits", type=int, default=BITS,
+                      help="Fixed-point bits per box length (quantized)")
+    conv.add_argument("--codec", choices=CODECS, default=DEFAULT_CODEC)
+    conv.add_argument("--keyframe-interval", type=int,
+                      default=KEYFRAME_INTERVAL,
+                      help="Frames between absolute (non-delta) frames")
+    conv.add_argument("-j", "--workers", type=int, default=os.cpu_count(),
+                      help="Number of worker processes")
+    conv.add_argument("--force", action="store_true",
+                      help="Convert dumps whose archive is up to date")
+    conv.add_argument("--verify", action="store_true",
+                      help="Read every archive back and compare it to the dump")
+    conv.add_argument("--remove", action="store_true",
+                      help="Delete each dump once its archive is verified")
+    info = commands.add_parser("info", help="Describe archives")
+    info.add_argument("archives", nargs="+")
+    args = parser.parse_args()
+
+    if args.command == "info":
+        for path in args.archives:
+            with ArchiveReader(path) as reader:
+                span = (f", timesteps {reader.timesteps[0]}-"
+                        f"{reader.timesteps[-1]}" if len(reader) else "")
+                print(f"{path}: {len(reader)} frames, {reader.natoms} atoms, "
+                      f"{reader.header['coords']} ({reader.header['bits']} "
+                      f"bits), {reader.header['codec']}{span}")
+        return
+
+    if args.remove and not args.verify:
+        parser.error("--remove requires --verify")
+    dumps = [path for path in find_dumps(args.paths)
+             if args.force or not os.path.exists(archive_path(path))
+             or os.path.getmtime(archive_path(path)) < os.path.getmtime(path)]
+    if not dumps:
+        print("No dumps to convert")
+        return
+    print(f"Converting {len(dumps)} dumps with {args.workers} workers")
+    # A dump that is still being written (e.g. by a running simulation) must
+    # not be removed, even if its archive verifies up to its last frame
+    states = {path: dump_state(path) for path in dumps}
+
+    total_in = total_out = n_failed = 0
+    with ProcessPoolExecutor(max_workers=args.workers) as pool:
+        futures = {pool.submit(convert, path, None, args.coords, args.bits,
+                               args.codec, args.keyframe_interval,
+                               args.verify): path for path in dumps}
+        for done, future in enumerate(as_completed(futures), 1):
+            path = futures[future]
+            try:
+                out_path, n, size_in, size_out, error = future.result()
+            except Exception as e:
+                n_failed += 1
+                print(f"[{done}/{len(dumps)}] FAILED {path}: {e}")
+                continue
+            total_in += size_in
+            total_out += size_out
+            check = "" if error is None else f", max error {error:.2g}"
+            print(f"[{done}/{len(dumps)}] {out_path}: {n} frames, "
+                  f"{size_in / 2**20:.1f} -> {size_out / 2**20:.1f} MiB"
+                  f"{check}")
+            if args.remove:
+                if dump_state(path) != states[path]:
+                    print(f"Not removing {path}: it changed during the "
+                          f"conversion")
+                else:
+                    os.remove(path)
+
+    if total_out:
+        print(f"✓ Converted {total_in / 2**20:.1f} MiB to "
+              f"{total_out / 2**20:.1f} MiB "
+              f"({total_in / total_out:.1f}x smaller)")
+    if n_failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
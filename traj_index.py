@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+# traj_index.py
+# A sidecar frame index for .lammpstrj dump files.
+#
+# The index is built in one pass by scanning for "ITEM: TIMESTEP" and stores
+# the byte offset, timestep and atom count of every complete frame in
+# <dump>.idx.npz next to the dump. With it, traj_reader.read_frames can seek
+# straight to any frame or slice of frames (e.g. frames[500::5]) through mmap
+# instead of reading the whole file. If the dump has grown since the index
+# was written (LAMMPS still running), only the new part is scanned.
+#
+# Usage: traj_index.py <dump_file> [...]   # Build/refresh the index
+
+import mmap
+import os
+import sys
+from collections import namedtuple
+
+import numpy as np
+
+FRAME_MARK = b"ITEM: TIMESTEP"
+
+# offsets, timesteps, natoms : (F,) int arrays, one entry per frame
+# size                       : size of the dump when the index was built
+TrajIndex = namedtuple("TrajIndex", ["offsets", "timesteps", "natoms",
+                                     "size"])
+
+
+def index_path(file_path):
+    return str(file_path) + ".idx.npz"
+
+
+def _scan(mm, start, end):
+    # Find all frame headers in mm[start:end]
+    offsets, timesteps, natoms = [], [], []
+    pos = mm.find(FRAME_MARK, start, end)
+    while pos != -1:
+        # Header: TIMESTEP / t / NUMBER OF ATOMS / n
+        header = mm[pos:min(pos + 256, end)].split(b"\n")
+        try:
+            timesteps.append(int(header[1]))
+            natoms.append(int(header[3]))
+        except (IndexError, ValueError):
+            break  # Header still being written
+        offsets.append(pos)
+        pos = mm.find(FRAME_MARK, pos + len(FRAME_MARK), end)
+    return offsets, timesteps, natoms
+
+
+def build_index(file_path, previous=None):
+    # Scan the dump for frame offsets. If a previous index is given, only
+    # the part from its last frame onwards is rescanned
+    size = os.path.getsize(file_path)
+    if size == 0:
+        empty = np.zeros(0, dtype=np.int64)
+        return TrajIndex(empty, empty, empty, 0)
+
+    start, keep = 0, 0
+    if previous is not None and len(previous.offsets) and previous.size <= size:
+        # The last indexed frame may have been incomplete, scan it again
+        keep = len(previous.offsets) - 1
+        start = int(previous.offsets[-1])
+
+    with open(file_path, "rb") as f, \
+            mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        # If the file was replaced rather than appended to, start over
+        if keep and mm[start:start + len(FRAME_MARK)] != FRAME_MARK:
+            start, keep = 0, 0
+        offsets, timesteps, natoms = _scan(mm, start, size)
+        # Leave out a final frame that is still being written (9 header
+        # lines plus one line per atom)
+        if offsets and mm[offsets[-1]:size].count(b"\n") < 9 + natoms[-1]:
+            del offsets[-1], timesteps[-1], natoms[-1]
+
+    if keep:
+        offsets = np.concatenate([previous.offsets[:keep], offsets])
+        timesteps = np.concatenate([previous.timesteps[:keep], timesteps])
+        natoms = np.concatenate([previous.natoms[:keep], natoms])
+    return TrajIndex(np.asarray(offsets, dtype=np.int64),
+                     np.asarray(timesteps, dtype=np.int64),
+                     np.asarray(natoms, dtype=np.int64), size)
+
+
+def save_index(file_path, index):
+    tmp_file = index_path(file_path) + ".tmp.npz"
+    np.savez(tmp_file, **index._asdict())
+    os.replace(tmp_file, index_path(file_path))
+
+
+def load_index(file_path, update=True):
+    # Load the sidecar index, building it or extending it if the dump has
+    # changed size since it was written
+    idx_file = index_path(file_path)
+    index = None
+    if os.path.exists(idx_file):
+        with np.load(idx_file) as data:
+            index = TrajIndex(data["offsets"], data["timesteps"],
+                              data["natoms"], int(data["size"]))
+    if not update:
+        return index
+
+    size = os.path.getsize(file_path)
+    if index is None or index.size != size:
+        index = build_index(file_path, index)
+        try:
+            save_index(file_path, index)
+        except OSError:
+            pass  # Read-only directory, just use the index in memory
+    return index
+
+
+def frame_range(index, start=None, stop=None, stride=None):
+    # Frame numbers selected by a Python-style slice
+    return np.arange(len(index.offsets))[slice(start, stop, stride)]
+
+
+def timestep_range(index, tmin=None, tmax=None):
+    # (start, stop) frame numbers covering timesteps in [tmin, tmax]
+    start = None if tmin is None else int(np.searchsorted(index.timesteps,
+                                                         tmin, "left"))
+    stop = None if tmax is None else int(np.searchsorted(index.timesteps,
+                                                        tmax, "right"))
+    return start, stop
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print("Usage: traj_index.py <dump_file> [...]")
+        sys.exit(1)
+
+    for dump_file in sys.argv[1:]:
+        index = load_index(dump_file)
+        print(f"{dump_file}: {len(index.offsets)} frames")
@@ -0,0 +1,201 @@
+#!/usr/bin/env python3
+# traj_reader.py
+# A streaming reader for LAMMPS "dump custom" trajectory files such as the
+# pos_*.lammpstrj files written by lammps_init.sh
+# (dump ... custom id type xs ys zs ix iy iz), gzipped dumps and the binary
+# archives of traj_archive.py.
+#
+# Frames are yielded one at a time, so memory stays constant no matter how many
+# frames are in the dump. Each frame's atom block is parsed in bulk into NumPy
+# arrays instead of building per-atom Python tuples.
+
+import gzip
+import io
+import mmap
+from collections import namedtuple
+from itertools import islice
+
+import numpy as np
+
+from profiling import active
+from traj_index import frame_range, load_index
+
+# A single trajectory frame
+#   timestep : int
+#   box      : (3,2) float array of [lo, hi] bounds for x, y, z
+#   ids      : (N,) int array of atom ids
+#   types    : (N,) int array of atom types
+#   scaled   : (N,3) float array of scaled coordinates (xs, ys, zs)
+#   images   : (N,3) int array of image flags (ix, iy, iz), zeros if absent
+Frame = namedtuple("Frame", ["timestep", "box", "ids", "types", "scaled",
+                             "images"])
+
+
+def open_traj(file_path):
+    # Open a (possibly gzipped) trajectory file in binary mode
+    file_path = str(file_path)
+    if file_path.endswith(".gz"):
+        return gzip.open(file_path, "rb")
+    return open(file_path, "rb")
+
+
+def box_lengths(box):
+    # Box edge lengths from a (3,2) array (or (F,3,2) stack) of bounds
+    box = np.asarray(box)
+    return box[..., 1] - box[..., 0]
+
+
+def real_coords(frame):
+    # Convert the scaled coordinates of a frame to real (box) coordinates
+    return frame.scaled * box_lengths(frame.box) + frame.box[:, 0]
+
+
+def unwrapped_coords(frame):
+    # Real coordinates with the periodic image flags undone
+    return ((frame.scaled + frame.images) * box_lengths(frame.box)
+            + frame.box[:, 0])
+
+
+def _parse_atoms(lines, columns, natoms):
+    # Parse the atom block of one frame in a single NumPy call
+    data = np.array(b"".join(lines).split(), dtype=np.float64)
+    data = data.reshape(natoms, len(columns))
+    col = {name: k for k, name in enumerate(columns)}
+    return data, col
+
+
+def _build_frame(timestep, box, data, col):
+    ids = data[:, col["id"]].astype(np.int64)
+    types = data[:, col["type"]].astype(np.int64)
+
+    if "xs" in col:
+        scaled = data[:, [col["xs"], col["ys"], col["zs"]]]
+    else:
+        # Unscaled dumps (x y z): convert to scaled coordinates
+        real = data[:, [col["x"], col["y"], col["z"]]]
+        scaled = (real - box[:, 0]) / box_lengths(box)
+
+    if "ix" in col:
+        images = data[:, [col["ix"], col["iy"], col["iz"]]].astype(np.int64)
+    else:
+        images = np.zeros((len(ids), 3), dtype=np.int64)
+
+    # Keep atoms in id order so that indices are stable across frames
+    if np.any(ids[1:] < ids[:-1]):
+        order = np.argsort(ids, kind="stable")
+        ids, types = ids[order], types[order]
+        scaled, images = scaled[order], images[order]
+
+    return Frame(timestep, box, ids, types, np.ascontiguousarray(scaled),
+                 np.ascontiguousarray(images))
+
+
+def read_frame(f):
+    # Read the next complete frame from an open binary file handle. Returns
+    # None at the end of the file or if the final frame is only partially
+    # written (e.g. LAMMPS is still running)
+    prof = active()
+    with prof.stage("read"):
+        line = f.readline()
+        while line and not line.startswith(b"ITEM: TIMESTEP"):
+            line = f.readline()
+        if not line:
+            return None
+
+        try:
+            timestep = int(f.readline())
+            f.readline()  # ITEM: NUMBER OF ATOMS
+            natoms = int(f.readline())
+            f.readline()  # ITEM: BOX BOUNDS pp pp pp
+            box = np.array([f.readline().split()[:2] for _ in range(3)],
+                           dtype=np.float64)
+            header = f.readline()  # ITEM: ATOMS id type xs ys zs ix iy iz
+        except ValueError:
+            prof.count("truncated")
+            return None
+        if not header.startswith(b"ITEM: ATOMS"):
+            prof.count("truncated")
+            return None
+        columns = header.decode().split()[2:]
+
+        lines = list(islice(f, natoms))
+        if len(lines) != natoms or not lines[-1].endswith(b"\n"):
+            prof.count("truncated")
+            return None  # Truncated final frame
+
+    with prof.stage("parse"):
+        try:
+            data, col = _parse_atoms(lines, columns, natoms)
+        except ValueError:
+            prof.count("truncated")
+            return None
+        frame = _build_frame(timestep, box, data, col)
+    if prof.enabled:
+        prof.count("parsed")
+        prof.count("bytes", sum(map(len, lines)))
+    return frame
+
+
+def read_frames(file_path, start=None, stop=None, stride=None):
+    # Generator yielding the frames of a trajectory file one at a time.
+    # start/stop/stride select frames like a Python slice; for plain dumps
+    # this seeks through the sidecar frame index (see traj_index.py) rather
+    # than parsing the skipped frames. Archives (.lta, see traj_archive.py)
+    # are decoded from their own frame table
+    if str(file_path).endswith(".lta"):
+        from traj_archive import read_archive_frames
+        frames = read_archive_frames(file_path, start, stop, stride)
+    elif start is None and stop is None and stride is None:
+        frames = _stream_frames(file_path)
+    elif str(file_path).endswith(".gz"):
+        # Compressed dumps cannot be seeked, so skip frames while streaming
+        frames = islice(_stream_frames(file_path), start, stop, stride)
+    else:
+        frames = _read_indexed(file_path, start, stop, stride)
+    prof = active()
+    for frame in frames:
+        prof.count("frames")
+        yield frame
+
+
+def _stream_frames(file_path):
+    with open_traj(file_path) as f:
+        while True:
+            frame = read_frame(f)
+            if frame is None:
+                break
+            yield frame
+
+
+def _read_indexed(file_path, start, stop, stride):
+    index = load_index(file_path)
+    frames = frame_range(index, start, stop, stride)
+    active().count("skipped", len(index.offsets) - len(frames))
+    if len(frames) == 0:
+        return
+    with open(file_path, "rb") as f, \
+            mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        ends = np.append(index.offsets[1:], len(mm))
+        for k in frames:
+            frame = read_frame(io.BytesIO(mm[index.offsets[k]:ends[k]]))
+            if frame is None:
+                break
+            yield frame
+
+
+def type_indices(frame, bead_type):
+    # Indices (into the id-sorted frame arrays) of all beads of a given type
+    return np.flatnonzero(frame.types == bead_type)
+
+
+def add_frame_args(parser):
+    # Add the --start/--stop/--stride frame selection options to an
+    # argparse parser
+    group = parser.add_argument_group("frame selection")
+    group.add_argument("--start", type=int, default=None,
+                       help="First frame to analyse (negative counts from "
+                            "the end)")
+    group.add_argument("--stop", type=int, default=None,
+                       help="Frame to stop before")
+    group.add_argument("--stride", type=int, default=None,
+                       help="Analyse every Nth frame")